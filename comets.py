@@ -6,12 +6,21 @@ For more information see https://comets-manual.readthedocs.io/en/latest/
 '''
 
 import re
+import io
 import math
+import asyncio
+import hashlib
+import tempfile
 import subprocess as sp
 import pandas as pd
 import os
-import cobra
-import io
+import copy
+import json
+import shutil
+import zipfile
+import itertools
+import collections.abc
+import concurrent.futures as cf
 import numpy as np
 
 __author__ = "Djordje Bajic, Jean Vila, Jeremy Chacon"
@@ -58,6 +67,409 @@ def readlines_file(filename):
     return f_lines
 
 
+def index_sections(lines, keywords, ignore_case=False):
+    """ walks the lines of a comets file once and returns a dictionary with,
+    for the first section headed by each of the given keywords, the index of
+    its header line and of the line closing it (the next line starting with
+    '//'). Sections that are never closed end at the end of the file """
+    if ignore_case:
+        keywords = {k.upper(): k for k in keywords}
+    else:
+        keywords = {k: k for k in keywords}
+    sections = {}
+    open_sections = {}
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith('//'):
+            for key, start in open_sections.items():
+                sections[key] = (start, i)
+            open_sections = {}
+            continue
+        tokens = line.split(None, 1)
+        if not tokens:
+            continue
+        key = keywords.get(tokens[0].upper() if ignore_case else tokens[0])
+        if (key is not None and key not in sections and
+                key not in open_sections):
+            open_sections[key] = i
+    for key, start in open_sections.items():
+        sections[key] = (start, len(lines))
+    return(sections)
+
+
+def numeric_block(lines, ncols):
+    """ parses lines of whitespace-separated numbers into a 2D float array
+    with ncols columns """
+    values = np.array(' '.join(lines).split(), dtype=np.float64)
+    return(values.reshape(-1, ncols))
+
+
+def parse_number(token):
+    """ converts a string to int if it looks like an integer and to float
+    otherwise, so that values are written back the same way they were read """
+    if token.lstrip('-').isdigit():
+        return(int(token))
+    return(float(token))
+
+
+def format_column(values):
+    """ converts a column of values to a list of strings in bulk; the
+    strings are the same as str() of each value """
+    return(np.asarray(values).astype(str).tolist())
+
+
+def format_amounts(values):
+    """ converts a float array to a list of strings in bulk, writing whole
+    numbers as integers and NaN as 0 """
+    values = np.nan_to_num(np.asarray(values, dtype=float), nan=0.)
+    # amounts often repeat, so each distinct value is only converted once
+    values, positions = np.unique(values, return_inverse=True)
+    strings = values.astype(str).astype(object)
+    whole = (values == np.round(values)) & (np.abs(values) < 1e15)
+    strings[whole] = values[whole].astype(np.int64).astype(str)
+    return(strings[positions].tolist())
+
+
+def format_block(columns, indent='    ', sep='   '):
+    """ formats equally long columns of values into the lines of a comets
+    file block, one row per line """
+    columns = [format_column(col) for col in columns]
+    if len(columns) == 0 or len(columns[0]) == 0:
+        return('')
+    return(indent + ('\n' + indent).join(map(sep.join, zip(*columns))) +
+           '\n')
+
+
+def truncate_partial_line(path):
+    """ removes an unfinished last line from a file, e.g. from a log whose
+    writer was stopped """
+    with open(path, 'rb+') as f:
+        pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            start = max(0, pos - 65536)
+            f.seek(start)
+            i = f.read(pos - start).rfind(b'\n')
+            if i >= 0:
+                f.truncate(start + i + 1)
+                return
+            pos = start
+        f.truncate(0)
+
+
+def flux_block(lines, model_number, n_reactions):
+    """ parses flux log lines of one model into a float array with columns
+    cycle, x, y, model number and its n_reactions fluxes """
+    try:
+        return(numeric_block(lines, 4 + n_reactions))
+    except ValueError:
+        raise CorruptLine('flux log rows of model ' + str(model_number) +
+                          ' do not have ' + str(n_reactions) + ' fluxes')
+
+
+def read_flux_log(path, n_reactions, chunk_size=1 << 24):
+    """ reads a comets flux log, whose rows are cycle, x, y, model number
+    and the fluxes of that model. n_reactions is the number of reactions of
+    each model. Returns one float array per model, with columns cycle, x, y
+    and the fluxes, each as large as the rows of that model, and for each
+    model the positions of its rows in the log. The log is read in chunks
+    of about chunk_size bytes, so no table as wide as the largest model is
+    built """
+    parts = [[] for n in n_reactions]
+    positions = [[] for n in n_reactions]
+    row = 0
+    with open(path) as f:
+        while True:
+            lines = f.readlines(chunk_size)
+            if not lines:
+                break
+            rows = [[] for n in n_reactions]
+            for line in lines:
+                tokens = line.split(None, 4)
+                if len(tokens) > 3:
+                    i = int(tokens[3]) - 1
+                    rows[i].append(line)
+                    positions[i].append(row)
+                    row += 1
+            for i, n in enumerate(n_reactions):
+                if rows[i]:
+                    values = flux_block(rows[i], i + 1, n)
+                    parts[i].append(np.delete(values, 3, axis=1))
+    return([np.concatenate(p) if p else np.empty((0, 3 + n))
+            for p, n in zip(parts, n_reactions)],
+           [np.array(p, dtype=np.int64) for p in positions])
+
+
+def read_log_blocks(path, cycle_column, cycles=None, block_size=1 << 22):
+    """ yields the text of a comets log in blocks of whole lines, of about
+    block_size bytes. Logs are written in cycle order, so with
+    cycles=(first, last) the start of first is found by bisecting the file,
+    and reading stops after last. Blocks are not split into lines here;
+    only the first and last line of each block are looked at """
+    def cycle_of(line):
+        return(float(line.split()[cycle_column]))
+
+    with open(path, 'rb') as f:
+        if cycles is not None:
+            # bisect for a line start before every line of cycle >= first
+            low, high = 0, f.seek(0, os.SEEK_END)
+            while high - low > block_size:
+                middle = (low + high) // 2
+                f.seek(middle)
+                f.readline()
+                line = f.readline()
+                while line and not line.strip():
+                    line = f.readline()
+                if not line or cycle_of(line) >= cycles[0]:
+                    high = middle
+                else:
+                    low = middle
+            f.seek(low)
+            if low > 0:
+                f.readline()
+
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            # complete the last line
+            block += f.readline()
+            text = block.strip()
+            if not text:
+                continue
+            if cycles is not None:
+                if cycle_of(text[text.rfind(b'\n') + 1:]) < cycles[0]:
+                    continue
+                first_line = text.find(b'\n')
+                if cycle_of(text[:first_line if first_line >= 0
+                                 else len(text)]) > cycles[1]:
+                    return
+            yield(block.decode())
+
+
+def log_window(cycle, x, y, cycles=None, bbox=None):
+    """ returns the mask of the rows with cycle within cycles=(first, last)
+    and x, y within bbox=(x_min, x_max, y_min, y_max), all inclusive """
+    mask = np.ones(len(cycle), dtype=bool)
+    if cycles is not None:
+        mask &= (cycle >= cycles[0]) & (cycle <= cycles[1])
+    if bbox is not None:
+        mask &= (x >= bbox[0]) & (x <= bbox[1])
+        mask &= (y >= bbox[2]) & (y <= bbox[3])
+    return(mask)
+
+
+def group_by_cycle(frames, cycles_per_chunk=1):
+    """ regroups an iterator of dataframes in cycle order, yielding
+    dataframes with the rows of cycles_per_chunk consecutive logged
+    cycles """
+    pending = []
+    pending_cycles = []
+    for df in frames:
+        cycle = df['cycle'].to_numpy()
+        if len(cycle) == 0:
+            continue
+        starts = np.flatnonzero(np.r_[True, cycle[1:] != cycle[:-1]])
+        ends = np.r_[starts[1:], len(cycle)]
+        for start, end in zip(starts, ends):
+            if not pending_cycles or cycle[start] != pending_cycles[-1]:
+                if len(pending_cycles) == cycles_per_chunk:
+                    yield(pd.concat(pending, ignore_index=True))
+                    pending = []
+                    pending_cycles = []
+                pending_cycles.append(cycle[start])
+            pending.append(df.iloc[start:end])
+    if pending:
+        yield(pd.concat(pending, ignore_index=True))
+
+
+def iter_media_log(path, metabolites=None, cycles=None, bbox=None,
+                   cycles_per_chunk=1, block_size=1 << 22):
+    """ reads a comets media log in chunks, yielding dataframes (metabolite,
+    cycle, x, y, conc_mmol) of cycles_per_chunk cycles each. Only the rows
+    of metabolites (a list), cycles=(first, last) and bbox=(x_min, x_max,
+    y_min, y_max) are kept, with x and y as in the log (from 1). Only the
+    lines of metabolites are parsed """
+    met_lines = None
+    if metabolites is not None:
+        met_lines = re.compile(
+            r'^[ \t]*(?:' + '|'.join(re.escape(met) for met in metabolites) +
+            r')[ \t].*$', re.MULTILINE)
+
+    def frames():
+        for text in read_log_blocks(path, 1, cycles, block_size):
+            if met_lines is not None:
+                lines = met_lines.findall(text)
+                if not lines:
+                    continue
+                text = '\n'.join(lines)
+            df = pd.read_csv(io.StringIO(text),
+                             delim_whitespace=True, header=None,
+                             names=['metabolite', 'cycle', 'x', 'y',
+                                    'conc_mmol'])
+            mask = log_window(df['cycle'].to_numpy(), df['x'].to_numpy(),
+                              df['y'].to_numpy(), cycles, bbox)
+            yield(df.loc[mask])
+    return(group_by_cycle(frames(), cycles_per_chunk))
+
+
+def iter_biomass_log(path, species=None, cycles=None, bbox=None,
+                     cycles_per_chunk=1, block_size=1 << 22):
+    """ reads a comets spatial biomass log in chunks, yielding dataframes
+    (cycle, x, y, species, biomass) of cycles_per_chunk cycles each. Only
+    the rows of species (a list of model ids), cycles=(first, last) and
+    bbox=(x_min, x_max, y_min, y_max) are kept, with x and y as in the log
+    (from 1) """
+    def frames():
+        for text in read_log_blocks(path, 0, cycles, block_size):
+            df = pd.read_csv(io.StringIO(text), header=None,
+                             delimiter=r'\s+',
+                             names=['cycle', 'x', 'y', 'species',
+                                    'biomass'],
+                             dtype={'species': 'category'})
+            mask = log_window(df['cycle'].to_numpy(), df['x'].to_numpy(),
+                              df['y'].to_numpy(), cycles, bbox)
+            if species is not None:
+                mask &= df['species'].isin(species).to_numpy()
+            yield(df.loc[mask].astype({'species': object}))
+    return(group_by_cycle(frames(), cycles_per_chunk))
+
+
+def iter_flux_log(path, model_number, reaction_names, reactions=None,
+                  cycles=None, bbox=None, cycles_per_chunk=1,
+                  block_size=1 << 22):
+    """ reads the fluxes of one model from a comets flux log in chunks,
+    yielding dataframes (cycle, x, y and the reactions) of cycles_per_chunk
+    cycles each. model_number is the position of the model in the layout,
+    from 1, and reaction_names its reactions. Only the columns of reactions
+    (a list, by default all) and the rows of cycles=(first, last) and
+    bbox=(x_min, x_max, y_min, y_max) are kept, with x and y as in the log
+    (from 1). Only the lines of the model are parsed """
+    reaction_names = list(reaction_names)
+    if reactions is None:
+        reactions = reaction_names
+    rxn_index = dict(zip(reaction_names, range(len(reaction_names))))
+    columns = [rxn_index[rxn] + 4 for rxn in reactions]
+    model_number = str(model_number)
+    # a line whose fourth field is the model number
+    model_line = re.compile(r'^[ \t]*(?:\S+[ \t]+){3}' + model_number +
+                            r'(?:[ \t].*)?$', re.MULTILINE)
+
+    def frames():
+        for text in read_log_blocks(path, 0, cycles, block_size):
+            lines = model_line.findall(text)
+            if not lines:
+                continue
+            values = flux_block(lines, model_number, len(reaction_names))
+            values = values[log_window(values[:, 0], values[:, 1],
+                                       values[:, 2], cycles, bbox)]
+            df = pd.DataFrame(values[:, columns], columns=reactions)
+            for j, col in enumerate(['cycle', 'x', 'y']):
+                df.insert(j, col, values[:, j].astype(int))
+            yield(df)
+    return(group_by_cycle(frames(), cycles_per_chunk))
+
+
+def check_parquet_engine():
+    """ raises an ImportError with install instructions when neither pyarrow
+    nor fastparquet, the optional Parquet engines of pandas, is installed """
+    for engine in ['pyarrow', 'fastparquet']:
+        try:
+            __import__(engine)
+            return
+        except ImportError:
+            pass
+    raise ImportError('saving and loading results needs a Parquet engine, ' +
+                      'which is an optional dependency: install pyarrow ' +
+                      '(pip install pyarrow) or fastparquet')
+
+
+def compact_frame(df, float32=False):
+    """ returns df with compact dtypes: text columns as categoricals, and
+    integer columns, and the cycle, x and y columns, as the smallest of
+    int16, int32 and int64 that holds them. With float32, the other float
+    columns become float32 """
+    dtypes = {}
+    for col in df.columns:
+        values = df[col]
+        kind = values.dtype.kind
+        if kind == 'O':
+            dtypes[col] = 'category'
+        elif kind in 'iu' or (col in ['cycle', 'x', 'y'] and kind == 'f' and
+                              np.all(np.mod(values.to_numpy(), 1) == 0)):
+            low, high = (values.min(), values.max()) if len(values) else (0, 0)
+            for dtype in [np.int16, np.int32, np.int64]:
+                if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                    dtypes[col] = dtype
+                    break
+        elif kind == 'f' and float32:
+            dtypes[col] = np.float32
+    return(df.astype(dtypes))
+
+
+def frames_to_arrays(frames):
+    """ converts a dict of dataframes to arrays that can be stored in an
+    .npz file without pickling. Returns a description of the frames, to
+    rebuild them with arrays_to_frames, and the dict of arrays """
+    description = {}
+    arrays = {}
+    for name, df in frames.items():
+        description[name] = []
+        for i, col in enumerate(df.columns):
+            key = name + '_' + str(i)
+            values = df[col].to_numpy()
+            kind = 'native'
+            if values.dtype == object:
+                kind = 'object'
+                if all(isinstance(x, str) for x in values):
+                    values = values.astype(str)
+                else:
+                    values = np.array(values.tolist())
+            arrays[key] = values
+            description[name].append([col, key, kind])
+        arrays[name + '_index'] = df.index.to_numpy()
+    return(description, arrays)
+
+
+def arrays_to_frames(description, data):
+    """ rebuilds the dataframes stored with frames_to_arrays """
+    frames = {}
+    for name, columns in description.items():
+        frames[name] = pd.DataFrame(
+            {col: data[key].astype(object) if kind == 'object' else data[key]
+             for col, key, kind in columns},
+            index=data[name + '_index'])
+    return(frames)
+
+
+def write_npz_entry(entry, meta, arrays):
+    """ writes arrays and the json-serializable meta to the .npz file entry.
+    The file is written to a temporary file and moved in place, so
+    concurrent readers never see it half written """
+    arrays = {key: value for key, value in arrays.items() if key != 'meta'}
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp, entry)
+
+
+def file_hash(path):
+    """ returns the sha1 hex digest of the contents of a file """
+    content_hash = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            content_hash.update(chunk)
+    return(content_hash.hexdigest())
+
+
+def copy_containers(obj):
+    """ returns a shallow copy of obj whose list and dict attributes are
+    copied too, so that changing them does not change obj """
+    new = copy.copy(obj)
+    for key, value in list(new.__dict__.items()):
+        if isinstance(value, (list, dict)):
+            new.__dict__[key] = copy.copy(value)
+    return(new)
+
+
 def chemostat(models, reservoir_media, dilution_rate):
     """ this returns a layout object and a parameters object setup to use the
     given models, reservoir_media, and dilution_rate in a chemostat-like
@@ -87,8 +499,209 @@ def chemostat(models, reservoir_media, dilution_rate):
     return(mylayout, parameters)
 
 
+class npz_cache:
+    '''
+    Base class of model_cache and result_cache, which keep their entries in
+    directory as compressed .npz files, one per key. Each cache defines
+    entry_path(key) and how entries are loaded and saved. When the entries
+    exceed max_size bytes, the least recently used ones are removed.
+    '''
+    # bump when the stored format changes, to ignore older entries
+    FORMAT_VERSION = 1
+
+    def __init__(self, directory, max_size=1e9):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_path(self, key):
+        ''' returns the path of the cache entry of key '''
+        raise NotImplementedError
+
+    def invalidate(self, key):
+        ''' removes the cache entry of key, if any '''
+        entry = self.entry_path(key)
+        if os.path.isfile(entry):
+            os.remove(entry)
+
+    def clear(self):
+        ''' removes all cache entries '''
+        for entry, _, _ in self.__entries():
+            os.remove(entry)
+
+    def size(self):
+        ''' returns the total size in bytes of the cache entries '''
+        return(sum(size for _, size, _ in self.__entries()))
+
+    def evict(self):
+        ''' removes the least recently used entries until the cache is not
+        larger than max_size '''
+        entries = sorted(self.__entries(), key=lambda x: x[2])
+        total = sum(size for _, size, _ in entries)
+        for entry, size, _ in entries:
+            if total <= self.max_size:
+                break
+            os.remove(entry)
+            total -= size
+
+    def __entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                entry = os.path.join(self.directory, name)
+                stat = os.stat(entry)
+                entries.append((entry, stat.st_size, stat.st_mtime))
+        return(entries)
+
+
+class model_cache(npz_cache):
+    '''
+    Opt-in on-disk cache of parsed models, so that building a model from an
+    SBML or COMETS model file a second time does not parse it again (nor
+    import cobra). Entries are kept in directory as compressed .npz files
+    and are keyed by the source path; they are valid while the source file
+    keeps its modification time or, failing that, its content hash.
+
+    To use it for all models built from files, including those read by
+    comets.layout, set:
+
+        comets.default_model_cache = comets.model_cache('/path/to/cache')
+
+    or pass it to a single model with comets.model(path, cache=cache).
+    When the entries exceed max_size bytes, the least recently used ones
+    are removed.
+    '''
+    def entry_path(self, path):
+        ''' returns the path of the cache entry of a source file '''
+        key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        return(os.path.join(self.directory, key + '.npz'))
+
+    def load(self, path, target):
+        ''' fills the comets model target with the cached version of the
+        model file at path. Returns False if there is no valid entry '''
+        entry = self.entry_path(path)
+        if not os.path.isfile(entry):
+            return(False)
+        try:
+            with np.load(entry, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                if meta['version'] != self.FORMAT_VERSION:
+                    return(False)
+                stat = os.stat(path)
+                if (meta['mtime'] != stat.st_mtime_ns or
+                        meta['size'] != stat.st_size):
+                    if meta['content_hash'] != file_hash(path):
+                        return(False)
+                    # same content, just touched: refresh the entry
+                    meta['mtime'] = stat.st_mtime_ns
+                    meta['size'] = stat.st_size
+                    write_npz_entry(entry, meta, dict(data))
+                frames = arrays_to_frames(meta['frames'], data)
+        except (OSError, ValueError, KeyError, EOFError,
+                zipfile.BadZipFile):
+            return(False)
+
+        for key, value in meta['attributes'].items():
+            setattr(target, key, value)
+        target.reactions = frames['reactions']
+        target.smat = frames['smat']
+        target.metabolites = frames['metabolites']
+
+        # mark the entry as recently used
+        os.utime(entry)
+        return(True)
+
+    def save(self, path, source):
+        ''' stores the comets model source, which was just parsed from the
+        model file at path. Models with attributes that cannot be stored
+        (e.g. signals) are not cached '''
+        if source.signals.size > 0:
+            return
+        attributes = {key: value for key, value in source.__dict__.items()
+                      if key not in ['metabolites', 'signals'] and
+                      not key.startswith('_model__')}
+        try:
+            json.dumps(attributes)
+        except TypeError:
+            return
+
+        stat = os.stat(path)
+        meta = {'version': self.FORMAT_VERSION,
+                'source': os.path.abspath(path),
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'content_hash': file_hash(path),
+                'attributes': attributes}
+        meta['frames'], arrays = frames_to_arrays(
+            {name: getattr(source, name)
+             for name in ['reactions', 'smat', 'metabolites']})
+
+        write_npz_entry(self.entry_path(path), meta, arrays)
+        self.evict()
+
+
+# model_cache used by comets.model when no cache is given. None disables it
+default_model_cache = None
+
+
+class result_cache(npz_cache):
+    '''
+    Opt-in on-disk store of simulation results, so that running a
+    simulation that already ran returns its results without running COMETS
+    again. Entries are keyed by comets.get_fingerprint(), a hash of the
+    layout, model and parameter files, the COMETS jar and the stopping
+    rules, and are kept in directory as compressed .npz files. When they
+    exceed max_size bytes, the least recently used ones are removed.
+
+    To use it for all simulations, set:
+
+        comets.default_result_cache = comets.result_cache('/path/to/store')
+
+    or pass it to a single simulation with
+    comets.comets(layout, params, result_cache=store). Use
+    comets.run(force=True) to run the simulation anyway.
+    '''
+    def entry_path(self, fingerprint):
+        ''' returns the path of the entry of a simulation fingerprint '''
+        return(os.path.join(self.directory, fingerprint + '.npz'))
+
+    def load(self, fingerprint):
+        ''' returns the stored (frames, attributes) dicts of a simulation
+        fingerprint, or None if there is no valid entry '''
+        entry = self.entry_path(fingerprint)
+        if not os.path.isfile(entry):
+            return(None)
+        try:
+            with np.load(entry, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                if meta['version'] != self.FORMAT_VERSION:
+                    return(None)
+                frames = arrays_to_frames(meta['frames'], data)
+        except (OSError, ValueError, KeyError, EOFError,
+                zipfile.BadZipFile):
+            return(None)
+
+        # mark the entry as recently used
+        os.utime(entry)
+        return((frames, meta['attributes']))
+
+    def save(self, fingerprint, frames, attributes):
+        ''' stores the result dataframes and json-serializable attributes of
+        the simulation with this fingerprint '''
+        meta = {'version': self.FORMAT_VERSION,
+                'attributes': attributes}
+        meta['frames'], arrays = frames_to_arrays(frames)
+        write_npz_entry(self.entry_path(fingerprint), meta, arrays)
+        self.evict()
+
+
+# result_cache used by comets.run when the simulation has none. None
+# disables it
+default_result_cache = None
+
+
 class model:
-    def __init__(self, model=None):
+    def __init__(self, model=None, cache=None):
         self.initial_pop = [[0, 0, 0.0]]
         self.id = None
         self.reactions = pd.DataFrame(columns=['REACTION_NAMES', 'ID',
@@ -126,17 +739,85 @@ class model:
         self.obj_style = 'MAXIMIZE_OBJECTIVE_FLUX'
 
         if model is not None:
-            if isinstance(model, cobra.Model):
+            if isinstance(model, (str, os.PathLike)):
+                model = os.fspath(model)
+                if cache is None:
+                    cache = default_model_cache
+                if cache is None or not cache.load(model, self):
+                    if model[-3:] == "cmd":
+                        self.read_comets_model(model)
+                    else:
+                        self.read_cobra_model(model)
+                    if cache is not None:
+                        cache.save(model, self)
+            else:
+                import cobra
+                if not isinstance(model, cobra.Model):
+                    raise TypeError('model must be a cobra model or the ' +
+                                    'path of a model file, not ' +
+                                    type(model).__name__)
                 self.load_cobra_model(model)
-            else:  # assume it is a path
-                if model[-3:] == "cmd":
-                    self.read_comets_model(model)
-                else:
-                    self.read_cobra_model(model)
 
     def get_reaction_names(self):
         return(list(self.reactions['REACTION_NAMES']))
 
+    def clone(self):
+        """ returns a copy of the model, e.g. for a mutant. The S-matrix,
+        metabolites and signals are shared with this model, and so are the
+        reactions columns other than the bounds and kinetic values, which
+        are the ones the change_* methods set. Shared tables should be
+        replaced, not changed in place """
+        new = copy_containers(self)
+        new.__reactions = self.reactions.copy(deep=False)
+        # the columns that change_* sets are copied on their first change,
+        # by either model
+        shared = {col for col in ['LB', 'UB', 'V_MAX', 'KM', 'HILL']
+                  if col in self.reactions.columns}
+        self.__shared_columns = set(shared)
+        new.__shared_columns = set(shared)
+        return(new)
+
+    def __own_columns(self, *columns):
+        """ copies the reactions columns that are shared with a clone, so
+        that they can be changed in place """
+        for col in columns:
+            if col in self.__shared_columns:
+                self.reactions[col] = self.reactions[col].to_numpy(copy=True)
+                self.__shared_columns.discard(col)
+
+    def get_fingerprint(self):
+        """ returns a hash of everything written to the comets model file,
+        except the model id (which only names the file). Models with the
+        same fingerprint produce identical model files """
+        fingerprint = hashlib.sha1()
+        for df in [self.reactions, self.smat, self.metabolites]:
+            fingerprint.update(repr([list(df.columns),
+                                     list(df.dtypes.astype(str))]).encode())
+            fingerprint.update(pd.util.hash_pandas_object(
+                df, index=False).values.tobytes())
+        fingerprint.update(repr(self.signals.values.tolist()).encode())
+
+        optional = [self.default_bounds, self.objective,
+                    self.optimizer, self.obj_style,
+                    self.vmax_flag, self.default_vmax,
+                    self.km_flag, self.default_km,
+                    self.hill_flag, self.default_hill,
+                    self.light_flag, self.light,
+                    self.convection_flag,
+                    self.nonlinear_diffusion_flag,
+                    self.noise_variance_flag,
+                    self.neutral_drift_flag]
+        if self.convection_flag:
+            optional.append(self.convection_parameters)
+        if self.nonlinear_diffusion_flag:
+            optional.append(self.nonlinear_diffusion_parameters)
+        if self.noise_variance_flag:
+            optional.append(self.noise_variance)
+        if self.neutral_drift_flag:
+            optional.append(self.neutralDriftSigma)
+        fingerprint.update(repr(optional).encode())
+        return(fingerprint.hexdigest())
+
     def add_signal(self, rxn_num, exch_ind, bound,
                    function, parms):
 
@@ -226,19 +907,45 @@ class model:
         self.noise_variance_flag = True
         self.noise_variance = noiseVariance
 
+    # reactions and smat are properties so that replacing one of them
+    # clears the cached rows of the exchange metabolites
+    @property
+    def reactions(self):
+        return(self.__reactions)
+
+    @reactions.setter
+    def reactions(self, reactions):
+        self.__reactions = reactions
+        self.__exchange_rows = None
+        self.__shared_columns = set()
+
+    @property
+    def smat(self):
+        return(self.__smat)
+
+    @smat.setter
+    def smat(self, smat):
+        self.__smat = smat
+        self.__exchange_rows = None
+
     def get_exchange_metabolites(self):
-        """ useful for layouts to grab these and get the set of them """
-        exchmets = pd.merge(self.reactions.loc[self.reactions['EXCH'], 'ID'],
-                            self.smat,
-                            left_on='ID', right_on='rxn',
-                            how='inner')['metabolite']
-        exchmets = self.metabolites.iloc[exchmets-1]
-        return(exchmets.METABOLITE_NAMES)
+        """ useful for layouts to grab these and get the set of them. The
+        rows of the exchange metabolites are kept until reactions or smat
+        are replaced, so only the names are looked up again """
+        if self.__exchange_rows is None:
+            exchmets = pd.merge(self.reactions.loc[self.reactions['EXCH'],
+                                                   'ID'],
+                                self.smat,
+                                left_on='ID', right_on='rxn',
+                                how='inner')['metabolite']
+            self.__exchange_rows = exchmets.to_numpy(dtype=np.int64) - 1
+        return(self.metabolites.METABOLITE_NAMES.iloc[self.__exchange_rows])
 
     def change_bounds(self, reaction, lower_bound, upper_bound):
         if reaction not in self.reactions['REACTION_NAMES'].values:
             print('reaction couldnt be found')
             return
+        self.__own_columns('LB', 'UB')
         self.reactions.loc[self.reactions['REACTION_NAMES'] == reaction,
                            'LB'] = lower_bound
         self.reactions.loc[self.reactions['REACTION_NAMES'] == reaction,
@@ -259,6 +966,7 @@ class model:
             print('reaction couldnt be found')
             return
         self.vmax_flag = True
+        self.__own_columns('V_MAX')
         self.reactions.loc[self.reactions[
             'REACTION_NAMES'] == reaction, 'V_MAX'] = vmax
 
@@ -267,6 +975,7 @@ class model:
             print('reaction couldnt be found')
             return
         self.km_flag = True
+        self.__own_columns('KM')
         self.reactions.loc[self.reactions[
             'REACTION_NAMES'] == reaction, 'KM'] = km
 
@@ -275,10 +984,13 @@ class model:
             print('reaction couldnt be found')
             return
         self.hill_flag = True
+        self.__own_columns('HILL')
         self.reactions.loc[self.reactions[
             'REACTION_NAMES'] == reaction, 'HILL'] = hill
 
     def read_cobra_model(self, path):
+        # cobra is only imported when needed, it is slow to import
+        import cobra
         curr_m = cobra.io.read_sbml_model(path)
         self.load_cobra_model(curr_m)
 
@@ -346,22 +1058,7 @@ class model:
                                                 x in metabolite_list]
 
         # S matrix
-        for index, row in self.reactions.iterrows():
-            rxn = curr_m.reactions.get_by_id(
-                row['REACTION_NAMES'])
-            rxn_num = row['ID']
-            rxn_mets = [1+list(self.metabolites[
-                'METABOLITE_NAMES']).index(
-                x.id) for x in rxn.metabolites]
-            met_s_coefs = list(rxn.metabolites.values())
-
-            cdf = pd.DataFrame({'metabolite': rxn_mets,
-                                'rxn': [rxn_num]*len(rxn_mets),
-                                's_coef': met_s_coefs})
-            cdf = cdf.sort_values('metabolite')
-            self.smat = pd.concat([self.smat, cdf])
-
-        self.smat = self.smat.sort_values(by=['metabolite', 'rxn'])
+        self.smat = self.__build_smat(curr_m)
 
         # The rest of stuff
         if hasattr(curr_m, 'default_bounds'):
@@ -379,186 +1076,155 @@ class model:
         if hasattr(curr_m, 'comets_obj_style'):
             self.obj_style = curr_m.comets_obj_style
 
+    def __build_smat(self, curr_m):
+        """ builds the S matrix of a cobra model as a long dataframe of
+        (metabolite, rxn, s_coef) triplets, sorted by metabolite and rxn.
+        The triplets are collected in a single pass over the reactions and
+        the dataframe is built once at the end """
+        met_index = {met_id: k+1 for k, met_id in
+                     enumerate(self.metabolites['METABOLITE_NAMES'])}
+
+        n_entries = sum(len(rxn.metabolites) for rxn in curr_m.reactions)
+        mets = np.empty(n_entries, dtype=np.int64)
+        rxns = np.empty(n_entries, dtype=np.int64)
+        s_coefs = np.empty(n_entries, dtype=np.float64)
+        # row labels are the position of the metabolite within its reaction
+        labels = np.empty(n_entries, dtype=np.int64)
+
+        k = 0
+        for rxn_num, rxn in enumerate(curr_m.reactions, start=1):
+            n = len(rxn.metabolites)
+            mets[k:k+n] = [met_index[x.id] for x in rxn.metabolites]
+            s_coefs[k:k+n] = list(rxn.metabolites.values())
+            rxns[k:k+n] = rxn_num
+            labels[k:k+n] = np.arange(n)
+            k += n
+
+        order = np.lexsort((rxns, mets))
+        smat = pd.DataFrame({'metabolite': mets[order].astype(object),
+                             'rxn': rxns[order].astype(object),
+                             's_coef': s_coefs[order]},
+                            index=labels[order])
+        return(smat)
+
     def read_comets_model(self, path):
         self.id = os.path.splitext(os.path.basename(path))[0]
 
         # in this way, its robust to empty lines:
-        m_f_lines = [s for s in read_file(path).splitlines() if s]
-        m_filedata_string = os.linesep.join(m_f_lines)
-        ends = []
-        for k in range(0, len(m_f_lines)):
-            if '//' in m_f_lines[k]:
-                ends.append(k)
+        m_f_lines = [s for s in read_file(path).splitlines() if s.strip()]
+
+        # walk the file once, recording where each section starts and ends
+        sections = index_sections(m_f_lines, ['SMATRIX', 'BOUNDS',
+                                              'REACTION_NAMES',
+                                              'METABOLITE_NAMES',
+                                              'EXCHANGE_REACTIONS',
+                                              'VMAX_VALUES', 'KM_VALUES',
+                                              'HILL_COEFFICIENTS',
+                                              'HILL_VALUES',
+                                              'OBJECTIVE', 'OBJECTIVE_STYLE',
+                                              'OPTIMIZER', 'neutralDrift',
+                                              'neutralDriftsigma',
+                                              'neutralDriftSigma',
+                                              'packedDensity',
+                                              'elasticModulus',
+                                              'frictionConstant',
+                                              'convDiffConstant',
+                                              'convNonLinDiffZero',
+                                              'convNonlinDiffN',
+                                              'convNonlinDiffExponent',
+                                              'convNonlinDiffHillN',
+                                              'convNonlinDiffHillK',
+                                              'noiseVariance'])
+
+        def header(key):
+            return(m_f_lines[sections[key][0]].split())
+
+        def body(key):
+            start, end = sections[key]
+            return(m_f_lines[start+1:end])
 
         # '''----------- S MATRIX ------------------------------'''
-        lin_smat = re.split('SMATRIX',
-                            m_filedata_string)[0].count('\n')
-        lin_smat_end = next(x for x in ends if x > lin_smat)
-
-        self.smat = pd.read_csv(io.StringIO('\n'.join(m_f_lines[
-            lin_smat:lin_smat_end])),
-                           delimiter=r'\s+',
-                           skipinitialspace=True)
-        self.smat.columns = ['metabolite', 'rxn', 's_coef']
+        smat = numeric_block(body('SMATRIX'), 3)
+        self.smat = pd.DataFrame({'metabolite': smat[:, 0].astype(np.int64),
+                                  'rxn': smat[:, 1].astype(np.int64),
+                                  's_coef': smat[:, 2]})
 
         # '''----------- REACTIONS AND BOUNDS-------------------'''
-        lin_rxns = re.split('REACTION_NAMES',
-                            m_filedata_string)[0].count('\n')
-        lin_rxns_end = next(x for x in
-                            ends if x > lin_rxns)
-
-        rxn = pd.read_csv(io.StringIO('\n'.join(m_f_lines[
-            lin_rxns:lin_rxns_end])),
-                          delimiter=r'\s+',
-                          skipinitialspace=True)
-
-        rxn['ID'] = range(1, len(rxn)+1)
-
-        lin_bnds = re.split('BOUNDS',
-                            m_filedata_string)[0].count('\n')
-        lin_bnds_end = next(x for x in ends if x > lin_bnds)
-
-        bnds = pd.read_csv(io.StringIO('\n'.join(m_f_lines[
-            lin_bnds:lin_bnds_end])),
-                           delimiter=r'\s+',
-                           skipinitialspace=True)
-
-        default_bounds = [float(bnds.columns[1]),
-                          float(bnds.columns[2])]
-
-        bnds.columns = ['ID', 'LB', 'UB']
-        reactions = pd.merge(rxn, bnds,
-                             left_on='ID', right_on='ID',
-                             how='left')
-        reactions.LB.fillna(default_bounds[0], inplace=True)
-        reactions.UB.fillna(default_bounds[1], inplace=True)
+        rxn_names = [x.strip() for x in body('REACTION_NAMES')]
+        n_rxns = len(rxn_names)
+        reactions = pd.DataFrame({'REACTION_NAMES': rxn_names,
+                                  'ID': np.arange(1, n_rxns+1)})
+
+        default_bounds = [float(x) for x in header('BOUNDS')[1:3]]
+        bnds = numeric_block(body('BOUNDS'), 3)
+        bnds_ind = bnds[:, 0].astype(np.int64) - 1
+        lb = np.full(n_rxns, default_bounds[0])
+        ub = np.full(n_rxns, default_bounds[1])
+        lb[bnds_ind] = bnds[:, 1]
+        ub[bnds_ind] = bnds[:, 2]
+        reactions['LB'] = lb
+        reactions['UB'] = ub
 
         # '''----------- METABOLITES ---------------------------'''
-        lin_mets = re.split('METABOLITE_NAMES',
-                            m_filedata_string)[0].count('\n')
-        lin_mets_end = next(x for x in ends if x > lin_mets)
-
-        metabolites = pd.read_csv(io.StringIO('\n'.join(m_f_lines[
-            lin_mets:lin_mets_end])),
-                                  delimiter=r'\s+',
-                                  skipinitialspace=True)
+        metabolites = pd.DataFrame({'METABOLITE_NAMES':
+                                    [x.strip() for x in
+                                     body('METABOLITE_NAMES')]})
 
         # '''----------- EXCHANGE RXNS -------------------------'''
-        lin_exch = re.split('EXCHANGE_REACTIONS',
-                            m_filedata_string)[0].count('\n')+1
-        exch = [int(k) for k in re.findall(r'\S+',
-                                           m_f_lines[lin_exch].
-                                           strip())]
-
-        reactions['EXCH'] = [True if x in exch else False
-                             for x in reactions['ID']]
-        reactions['EXCH_IND'] = [exch.index(x)+1
-                                 if x in exch else 0
-                                 for x in reactions['ID']]
-
-        # '''----------- VMAX VALUES --------------------------'''
-        if 'VMAX_VALUES' in m_filedata_string:
-            self.vmax_flag = True
-            lin_vmax = re.split('VMAX_VALUES',
-                                m_filedata_string)[0].count('\n')
-            lin_vmax_end = next(x for x in ends if x > lin_vmax)
-
-            Vmax = pd.read_csv(io.StringIO('\n'.join(m_f_lines[
-                lin_vmax:lin_vmax_end])),
-                               delimiter=r'\s+',
-                               skipinitialspace=True)
-
-            Vmax.columns = ['EXCH_IND', 'V_MAX']
-
-            reactions = pd.merge(reactions, Vmax,
-                                 left_on='EXCH_IND',
-                                 right_on='EXCH_IND',
-                                 how='left')
-            self.default_vmax = float(m_f_lines[lin_vmax-1].split()[1])
-        else:
-            reactions['V_MAX'] = np.NaN
-
-        # '''----------- VMAX VALUES --------------------------'''
-        if 'KM_VALUES' in m_filedata_string:
-            self.km_flag = True
-            lin_km = re.split('KM_VALUES',
-                              m_filedata_string)[0].count('\n')
-            lin_km_end = next(x for x in ends if x > lin_km)
-
-            Km = pd.read_csv(io.StringIO('\n'.join(m_f_lines[
-                lin_km:lin_km_end])),
-                             delimiter=r'\s+',
-                             skipinitialspace=True)
-            Km.columns = ['EXCH_IND', 'KM']
-
-            reactions = pd.merge(reactions, Km,
-                                 left_on='EXCH_IND',
-                                 right_on='EXCH_IND',
-                                 how='left')
-            self.default_km = float(m_f_lines[lin_km-1].split()[1])
-        else:
-            reactions['KM'] = np.NaN
-
-        # '''----------- VMAX VALUES --------------------------'''
-        if 'HILL_COEFFICIENTS' in m_filedata_string:
-            self.hill_flag = True
-            lin_hill = re.split('HILL_COEFFICIENTS',
-                                m_filedata_string)[0].count('\n')
-            lin_hill_end = next(x for x in ends if x > lin_hill)
-
-            Hill = pd.read_csv(io.StringIO('\n'.join(m_f_lines[
-                lin_hill:lin_hill_end])),
-                               delimiter=r'\s+',
-                               skipinitialspace=True)
-            Hill.columns = ['EXCH_IND', 'HILL']
-
-            reactions = pd.merge(reactions, Hill,
-                                 left_on='EXCH_IND',
-                                 right_on='EXCH_IND',
-                                 how='left')
-            self.default_hill = float(m_f_lines[lin_hill-1].split()[1])
-        else:
-            reactions['HILL'] = np.NaN
+        exch = np.array(' '.join(body('EXCHANGE_REACTIONS')).split(),
+                        dtype=np.int64)
+        exch_ind = np.zeros(n_rxns, dtype=np.int64)
+        exch_ind[exch - 1] = np.arange(1, len(exch)+1)
+
+        reactions['EXCH'] = exch_ind > 0
+        reactions['EXCH_IND'] = exch_ind
+
+        # '''----------- VMAX, KM AND HILL VALUES -------------'''
+        # values are given per exchange reaction index; reactions that are
+        # not exchange reactions (EXCH_IND 0) always get NaN
+        reactions['V_MAX'] = np.NaN
+        reactions['KM'] = np.NaN
+        reactions['HILL'] = np.NaN
+        for key, col, kin in [('VMAX_VALUES', 'V_MAX', 'vmax'),
+                              ('KM_VALUES', 'KM', 'km'),
+                              ('HILL_COEFFICIENTS', 'HILL', 'hill'),
+                              ('HILL_VALUES', 'HILL', 'hill')]:
+            if key in sections:
+                setattr(self, kin + '_flag', True)
+                setattr(self, 'default_' + kin, float(header(key)[1]))
+                values = numeric_block(body(key), 2)
+                ind = values[:, 0].astype(np.int64)
+                valid = (ind > 0) & (ind <= len(exch))
+                by_exch_ind = np.full(len(exch)+1, np.NaN)
+                by_exch_ind[ind[valid]] = values[valid, 1]
+                reactions[col] = by_exch_ind[exch_ind]
 
         # '''----------- OBJECTIVE -----------------------------'''
-        lin_obj = re.split('OBJECTIVE',
-                           m_filedata_string)[0].count('\n')+1
-        self.objective = int(m_f_lines[lin_obj].strip())
+        self.objective = int(m_f_lines[sections['OBJECTIVE'][0]+1].strip())
 
         # '''----------- OBJECTIVE STYLE -----------------------'''
-        if 'OBJECTIVE_STYLE' in m_filedata_string:
-            lin_obj_st = re.split('OBJECTIVE_STYLE',
-                                  m_filedata_string)[0].count(
-                                      '\n')+1
-            self.obj_style = m_f_lines[lin_obj_st].strip()
+        if 'OBJECTIVE_STYLE' in sections:
+            self.obj_style = m_f_lines[
+                sections['OBJECTIVE_STYLE'][0]+1].strip()
 
         # '''----------- OPTIMIZER -----------------------------'''
-        if 'OPTIMIZER' in m_filedata_string:
-            lin_opt = re.split('OPTIMIZER',
-                               m_filedata_string)[0].count('\n')
-            self.optimizer = m_f_lines[lin_opt].split()[1]
+        if 'OPTIMIZER' in sections:
+            self.optimizer = header('OPTIMIZER')[1]
 
         # '''--------------neutral drift------------------------'''
-        if "neutralDrift" in m_filedata_string:
-            lin_obj_st = re.split('neutralDrift',
-                                  m_filedata_string)[0].count(
-                                      '\n')
-            if "TRUE" == m_f_lines[lin_obj_st].strip().split()[1].upper():
+        if 'neutralDrift' in sections:
+            if "TRUE" == header('neutralDrift')[1].upper():
                 self.neutral_drift_flag = True
                 self.neutralDriftSigma = 0.
-        if "neutralDriftsigma" in m_filedata_string:
-            lin_opt = re.split('neutralDriftsigma',
-                               m_filedata_string)[0].count('\n')
-            self.neutralDriftSigma = float(m_f_lines[lin_opt].split()[1])
+        for key in ['neutralDriftsigma', 'neutralDriftSigma']:
+            if key in sections:
+                self.neutralDriftSigma = float(header(key)[1])
 
         # '''--------------convection---------------------------'''
         for parm in ['packedDensity', 'elasticModulus',
                      'frictionConstant', 'convDiffConstant']:
-            if parm in m_filedata_string:
-                lin_obj_st = re.split(parm,
-                                      m_filedata_string)[0].count(
-                                          '\n')
-                parm_value = float(m_f_lines[lin_obj_st].strip().split()[1])
+            if parm in sections:
+                parm_value = float(header(parm)[1])
                 try:
                     self.convection_parameters[parm] = parm_value
                 except:
@@ -572,11 +1238,8 @@ class model:
         # '''--------------non-linear diffusion---------------------------'''
         for parm in ['convNonLinDiffZero', 'convNonlinDiffN', 'convNonlinDiffExponent',
                      'convNonlinDiffHillN', 'convNonlinDiffHillK']:
-            if parm in m_filedata_string:
-                lin_obj_st = re.split(parm,
-                                      m_filedata_string)[0].count(
-                                          '\n')
-                parm_value = float(m_f_lines[lin_obj_st].strip().split()[1])
+            if parm in sections:
+                parm_value = float(header(parm)[1])
                 try:
                     self.nonlinear_diffusion_parameters[parm] = parm_value
                 except:
@@ -587,16 +1250,12 @@ class model:
                                                            'convNonlinDiffHillN': 10.,
                                                            'convNonlinDiffHillK': .9}
                     self.nonlinear_diffusion_parameters[parm] = parm_value
-                    
-        # '''-----------noise variance-----------------'''
-        if 'noiseVariance' in m_filedata_string:
-            lin_obj_st = re.split('noiseVariance',
-                                  m_filedata_string)[0].count(
-                                      '\n')
-            noiseVariance = float(m_f_lines[lin_obj_st].strip().split()[1])
 
+        # '''-----------noise variance-----------------'''
+        if 'noiseVariance' in sections:
             self.noise_variance_flag = True
-            self.noise_variance = noiseVariance
+            self.noise_variance = float(header('noiseVariance')[1])
+
         # assign the dataframes we just built
         self.reactions = reactions
         self.metabolites = metabolites
@@ -608,154 +1267,328 @@ class model:
             path_to_write = working_dir
         path_to_write = path_to_write + self.id + '.cmd'
 
-        # format variables for writing comets model
+        # each section is formatted in bulk into a single string
+        sections = []
+
+        sections.append('SMATRIX  ' + str(len(self.metabolites)) +
+                        '  ' + str(len(self.reactions)) + '\n' +
+                        format_block([self.smat[col] for col in
+                                      self.smat.columns]))
+
         bnd = self.reactions.loc[(self.reactions['LB']
                                   != self.default_bounds[0]) |
                                  (self.reactions['UB'] !=
                                   self.default_bounds[1]),
-                                 ['ID', 'LB', 'UB']].astype(
-                                     str).apply(lambda x: '   '.join(x),
-                                                axis=1)
-        bnd = '    ' + bnd.astype(str)
+                                 ['ID', 'LB', 'UB']]
+        sections.append('BOUNDS ' +
+                        str(self.default_bounds[0]) + ' ' +
+                        str(self.default_bounds[1]) + '\n' +
+                        format_block([bnd['ID'], bnd['LB'], bnd['UB']]))
 
-        rxn_n = '    ' + self.reactions['REACTION_NAMES'].astype(str)
+        sections.append('OBJECTIVE\n' +
+                        '    ' + str(self.objective) + '\n')
 
-        met_n = '    ' + self.metabolites.astype(str)
+        sections.append('METABOLITE_NAMES\n' +
+                        format_block([self.metabolites[col] for col in
+                                      self.metabolites.columns]))
 
-        smat = self.smat.astype(str).apply(lambda x:
-                                           '   '.join(x), axis=1)
-        smat = '    ' + smat.astype(str)
+        sections.append('REACTION_NAMES\n' +
+                        format_block([self.reactions['REACTION_NAMES']]))
 
-        exch_r = ' '.join([str(x) for x in
-                           self.reactions.loc[self.reactions.EXCH, 'ID']])
+        exch_r = ' '.join(format_column(
+            self.reactions.loc[self.reactions.EXCH, 'ID']))
+        sections.append('EXCHANGE_REACTIONS\n' +
+                        ' ' + exch_r + '\n')
 
         # optional fields (vmax,km, hill)
-        if self.vmax_flag:
-            Vmax = self.reactions.loc[self.reactions['V_MAX'].notnull(),
-                                      ['EXCH_IND', 'V_MAX']]
-            Vmax = Vmax.astype(str).apply(lambda x:
-                                          '   '.join(x), axis=1)
-            Vmax = '    ' + Vmax.astype(str)
+        for flag, name, default, col in [
+                (self.vmax_flag, 'VMAX_VALUES', self.default_vmax, 'V_MAX'),
+                (self.km_flag, 'KM_VALUES', self.default_km, 'KM'),
+                (self.hill_flag, 'HILL_VALUES', self.default_hill, 'HILL')]:
+            if flag:
+                kin = self.reactions.loc[self.reactions[col].notnull(),
+                                         ['EXCH_IND', col]]
+                sections.append(name + ' ' + str(default) + '\n' +
+                                format_block([kin['EXCH_IND'], kin[col]]))
+
+        if self.light_flag:
+            light = 'LIGHT\n'
+            for lrxn in self.light:
+                lrxn_ind = str(int(self.reactions.ID[
+                    self.reactions['REACTION_NAMES'] == lrxn[0]]))
+                light += '    {} {} {}\n'.format(lrxn_ind, lrxn[1], lrxn[2])
+            sections.append(light)
+
+        if self.signals.size > 0:
+            signals = 'MET_REACTION_SIGNAL\n'
+            for idx in self.signals.index:
+                row = self.signals.loc[idx]
+                signals += ' '.join(str(x) for x in
+                                    [row['REACTION_NUMBER'],
+                                     row['EXCH_IND'],
+                                     row['BOUND'],
+                                     row['FUNCTION']] +
+                                    list(row['PARAMETERS'])) + '\n'
+            sections.append(signals)
+
+        if self.convection_flag:
+            for key, value in self.convection_parameters.items():
+                sections.append(key + ' ' + str(value) + '\n')
+
+        if self.nonlinear_diffusion_flag:
+            for key, value in self.nonlinear_diffusion_parameters.items():
+                sections.append(key + ' ' + str(value) + '\n')
+
+        if self.noise_variance_flag:
+            sections.append('noiseVariance' + ' ' +
+                            str(self.noise_variance) + '\n')
+
+        if self.neutral_drift_flag:
+            sections.append("neutralDrift true\n")
+            sections.append("neutralDriftSigma " +
+                            str(self.neutralDriftSigma) + "\n")
+
+        sections.append('OBJECTIVE_STYLE\n' + self.obj_style + '\n')
+
+        sections.append('OPTIMIZER ' + self.optimizer + '\n')
+
+        with open(path_to_write, 'w') as f:
+            for section in sections:
+                f.write(section + r'//' + '\n')
+
+
+class local_field(collections.abc.MutableMapping):
+    '''
+    Location-specific metabolite values of a layout, e.g. its local media.
+    Each metabolite that was set somewhere has a 2D array of amounts over
+    the grid, with NaN where it is not set, and cells is the mask of the
+    locations that have a line in the layout block. Copies share the
+    arrays, and an array is only copied when it is first changed.
+
+    It is also a mapping with the set (x, y) locations as keys, in x, y
+    order, and as values, mappings of the amounts of the mets set there.
+    Changes made through them are made to the arrays:
+
+        field[(0, 1)]['glc__D_e'] = 5.
+        field[(2, 2)] = {'o2_e': 1.}
+        del field[(0, 1)]
+    '''
+    def __init__(self):
+        self.cells = np.zeros((0, 0), dtype=bool)
+        self.amounts = {}
+        # the arrays shared with copies, by met name (None for cells)
+        self.__shared = set()
+
+    def copy(self):
+        ''' returns a copy that shares the arrays until they are changed '''
+        field = copy.copy(self)
+        field.amounts = dict(self.amounts)
+        self.__shared = set(self.amounts) | {None}
+        field.__shared = set(self.__shared)
+        return(field)
+
+    def __own_cells(self):
+        if None in self.__shared:
+            self.cells = self.cells.copy()
+            self.__shared.discard(None)
+        return(self.cells)
+
+    def __fit(self, shape):
+        # grows the arrays so that they cover shape. They at least double
+        # along an axis that grows, so that setting locations one by one
+        # only copies them a few times
+        old_shape = self.cells.shape
+        shape = tuple(old if size <= old else max(size, 2 * old)
+                      for size, old in zip(shape, old_shape))
+        if shape == old_shape:
+            return
+        cells = np.zeros(shape, dtype=bool)
+        cells[:old_shape[0], :old_shape[1]] = self.cells
+        self.cells = cells
+        for met, old in self.amounts.items():
+            self.amounts[met] = np.full(shape, np.nan)
+            self.amounts[met][:old_shape[0], :old_shape[1]] = old
+        self.__shared = set()
+
+    def __met_amounts(self, met):
+        # returns the array of met, to be changed
+        if met not in self.amounts:
+            self.amounts[met] = np.full(self.cells.shape, np.nan)
+        elif met in self.__shared:
+            self.amounts[met] = self.amounts[met].copy()
+            self.__shared.discard(met)
+        return(self.amounts[met])
+
+    def set(self, met, amounts):
+        ''' sets met from a 2D array of amounts by location. Locations where
+        amounts is NaN are left as they are '''
+        amounts = np.asarray(amounts, dtype=float)
+        if amounts.ndim != 2:
+            raise ValueError('amounts should be a 2D array')
+        self.__fit(amounts.shape)
+        given = ~np.isnan(amounts)
+        part = (slice(0, amounts.shape[0]), slice(0, amounts.shape[1]))
+        self.__met_amounts(met)[part][given] = amounts[given]
+        self.__own_cells()[part] |= given
+
+    def set_at(self, met, location, amount):
+        ''' sets met at a single (x, y) location '''
+        x, y = location[0], location[1]
+        if x >= self.cells.shape[0] or y >= self.cells.shape[1]:
+            self.__fit((x + 1, y + 1))
+        if not self.cells[x, y]:
+            self.__own_cells()[x, y] = True
+        self.__met_amounts(met)[x, y] = amount
+
+    def get_at(self, met, location):
+        ''' returns the amount of met at (x, y), NaN if it is not set '''
+        x, y = location[0], location[1]
+        if (met not in self.amounts or x >= self.cells.shape[0] or
+                y >= self.cells.shape[1]):
+            return(np.nan)
+        return(self.amounts[met][x, y].item())
+
+    def unset_at(self, met, location):
+        ''' unsets met at (x, y), leaving the location set '''
+        if not np.isnan(self.get_at(met, location)):
+            self.__met_amounts(met)[location[0], location[1]] = np.nan
+
+    def set_cells(self, met, locs, amounts):
+        ''' sets met at locs, an (n, 2) array of x, y locations, to amounts.
+        If met is None, the locations are only marked as set '''
+        locs = np.asarray(locs, dtype=int).reshape(-1, 2)
+        if len(locs) == 0:
+            return
+        self.__fit(tuple(locs.max(axis=0) + 1))
+        self.__own_cells()[locs[:, 0], locs[:, 1]] = True
+        if met is not None:
+            self.__met_amounts(met)[locs[:, 0], locs[:, 1]] = amounts
+
+    def __location(self, location):
+        # the (x, y) tuple of a set location, or a KeyError
+        x, y = location
+        if (x < 0 or y < 0 or x >= self.cells.shape[0] or
+                y >= self.cells.shape[1] or not self.cells[x, y]):
+            raise KeyError(location)
+        return((x, y))
+
+    def __getitem__(self, location):
+        return(local_amounts(self, self.__location(location)))
+
+    def __setitem__(self, location, amounts):
+        # the location gets exactly the given amounts
+        if location in self:
+            for met in list(self[location]):
+                self.unset_at(met, location)
+        self.set_cells(None, [location], None)
+        for met, amount in dict(amounts).items():
+            self.set_at(met, location, amount)
+
+    def __delitem__(self, location):
+        x, y = self.__location(location)
+        for met in list(self[(x, y)]):
+            self.unset_at(met, (x, y))
+        self.__own_cells()[x, y] = False
+
+    def setdefault(self, location, amounts=None):
+        # returns the view of the location, so that e.g.
+        # field.setdefault(location, {})[met] = amount is kept
+        if location not in self:
+            self[location] = amounts or {}
+        return(self[location])
+
+    def __iter__(self):
+        return(iter(map(tuple, np.argwhere(self.cells).tolist())))
+
+    def __len__(self):
+        return(int(self.cells.sum()))
+
+    def __repr__(self):
+        return(repr(self.to_dict()))
+
+    def to_dict(self):
+        ''' returns a dictionary with the set locations as keys and, as
+        values, a dict of the amounts of the mets set there '''
+        locs = np.argwhere(self.cells)
+        located = {(x, y): {} for x, y in locs.tolist()}
+        for met, values in self.amounts.items():
+            amounts = values[locs[:, 0], locs[:, 1]]
+            for i in np.flatnonzero(~np.isnan(amounts)).tolist():
+                located[tuple(locs[i].tolist())][met] = amounts[i].item()
+        return(located)
+
+    @classmethod
+    def from_dict(cls, located):
+        ''' builds a field from a dictionary like the one of to_dict '''
+        field = cls()
+        field.set_cells(None, list(located.keys()), None)
+        by_met = {}
+        for loc, amounts in located.items():
+            for met, amount in amounts.items():
+                by_met.setdefault(met, ([], []))
+                by_met[met][0].append(loc)
+                by_met[met][1].append(amount)
+        for met, (locs, amounts) in by_met.items():
+            field.set_cells(met, locs, amounts)
+        return(field)
+
+    def lines(self, mets, static=False):
+        ''' formats the field as the lines of a layout block: the location
+        of each set cell and then a value for each of mets, 0 if unset. If
+        static, each met has a pair of values instead: the static flag and
+        the amount '''
+        locs = np.argwhere(self.cells)
+        if len(locs) == 0:
+            return('')
+        zeros = ['0'] * len(locs)
+        columns = [format_column(locs[:, 0]), format_column(locs[:, 1])]
+        for met in mets:
+            if met not in self.amounts:
+                columns.extend([zeros] * (2 if static else 1))
+                continue
+            amounts = self.amounts[met][locs[:, 0], locs[:, 1]]
+            if static:
+                columns.append(np.where(np.isnan(amounts), '0',
+                                        '1').tolist())
+            columns.append(format_amounts(amounts))
+        return('      ' + '\n      '.join(map(' '.join, zip(*columns))) +
+               '\n')
+
+
+
+class local_amounts(collections.abc.MutableMapping):
+    '''
+    The amounts of the mets set at one location of a local_field, by met
+    name. Changes are made to the arrays of the field.
+    '''
+    def __init__(self, field, location):
+        self.field = field
+        self.location = location
 
-        if self.km_flag:
-            Km = self.reactions.loc[self.reactions['KM'].notnull(),
-                                    ['EXCH_IND', 'KM']]
-            Km = Km.astype(str).apply(lambda x:
-                                      '   '.join(x), axis=1)
-            Km = '    ' + Km.astype(str)
+    def __getitem__(self, met):
+        amount = self.field.get_at(met, self.location)
+        if np.isnan(amount):
+            raise KeyError(met)
+        return(amount)
 
-        if self.hill_flag:
-            Hill = self.reactions.loc[self.reactions['HILL'].notnull(),
-                                      ['EXCH_IND', 'HILL']]
-            Hill = Hill.astype(str).apply(lambda x:
-                                          '   '.join(x), axis=1)
-            Hill = '    ' + Hill.astype(str)
-
-        if os.path.isfile(path_to_write):
-            os.remove(path_to_write)
-
-        with open(path_to_write, 'a') as f:
-
-            f.write('SMATRIX  ' + str(len(self.metabolites)) +
-                    '  ' + str(len(self.reactions)) + '\n')
-            smat.to_csv(f, mode='a', header=False, index=False)
-            f.write(r'//' + '\n')
-
-            f.write('BOUNDS ' +
-                    str(self.default_bounds[0]) + ' ' +
-                    str(self.default_bounds[1]) + '\n')
-            bnd.to_csv(f, mode='a', header=False, index=False)
-            f.write(r'//' + '\n')
-
-            f.write('OBJECTIVE\n' +
-                    '    ' + str(self.objective) + '\n')
-            f.write(r'//' + '\n')
-
-            f.write('METABOLITE_NAMES\n')
-            met_n.to_csv(f, mode='a', header=False, index=False)
-            f.write(r'//' + '\n')
-
-            f.write('REACTION_NAMES\n')
-            rxn_n.to_csv(f, mode='a', header=False, index=False)
-            f.write(r'//' + '\n')
-
-            f.write('EXCHANGE_REACTIONS\n')
-            f.write(' ' + exch_r + '\n')
-            f.write(r'//' + '\n')
-
-            if self.vmax_flag:
-                f.write('VMAX_VALUES ' +
-                        str(self.default_vmax) + '\n')
-                Vmax.to_csv(f, mode='a', header=False, index=False)
-                f.write(r'//' + '\n')
-
-            if self.km_flag:
-                f.write('KM_VALUES ' +
-                        str(self.default_km) + '\n')
-                Km.to_csv(f, mode='a', header=False, index=False)
-                f.write(r'//' + '\n')
-
-            if self.hill_flag:
-                f.write('HILL_VALUES ' +
-                        str(self.default_hill) + '\n')
-                Hill.to_csv(f, mode='a', header=False, index=False)
-                f.write(r'//' + '\n')
-
-            if self.light_flag:
-                f.write('LIGHT\n')
-                for lrxn in self.light:
-                    lrxn_ind = str(int(self.reactions.ID[
-                        self.reactions['REACTION_NAMES'] == lrxn[0]]))
-                    f.write('    {} {} {}\n'.format(lrxn_ind,
-                                                    lrxn[1], lrxn[2]))
-                f.write(r'//' + '\n')
-
-            if self.signals.size > 0:
-                f.write('MET_REACTION_SIGNAL\n')
-                sub_signals = self.signals.drop(['REACTION_NAMES', 'EXCH'],
-                                                axis='columns')
-                col_names = list(self.signals.drop(['REACTION_NAMES',
-                                                    'EXCH', 'PARAMETERS'],
-                                                   axis='columns').columns)
-                for idx in sub_signals.index:
-                    row = sub_signals.drop(['PARAMETERS'], axis='columns').iloc[idx, :]
-                    n_parms = len(sub_signals.PARAMETERS[idx])
-                    curr_col_names = col_names + [str(i) for i in range(n_parms)]
-                    temp_df = pd.DataFrame(columns=curr_col_names)
-                    temp_df.loc[0, 'REACTION_NUMBER'] = row.loc['REACTION_NUMBER']
-                    temp_df.loc[0, 'EXCH_IND'] = row.loc['EXCH_IND']
-                    temp_df.loc[0, 'BOUND'] = row.loc['BOUND']
-                    temp_df.loc[0, 'FUNCTION'] = row.loc['FUNCTION']
-                    for i in range(n_parms):
-                        temp_df.loc[0, str(i)] = sub_signals.PARAMETERS[idx][i]
-                    temp_df.to_csv(f, mode='a', sep=' ', header=False, index=False)
-                f.write(r'//' + '\n')
-
-            if self.convection_flag:
-                for key, value in self.convection_parameters.items():
-                    f.write(key + ' ' + str(value) + '\n')
-                    f.write(r'//' + '\n')
-
-            if self.nonlinear_diffusion_flag:
-                for key, value in self.nonlinear_diffusion_parameters.items():
-                    f.write(key + ' ' + str(value) + '\n')
-                    f.write(r'//' + '\n')
-
-            if self.noise_variance_flag:
-                f.write('noiseVariance' + ' ' +
-                        str(self.noise_variance) + '\n')
-                f.write(r'//' + '\n')
-
-            if self.neutral_drift_flag:
-                f.write("neutralDrift true\n//\n")
-                f.write("neutralDriftSigma " + str(self.neutralDriftSigma) + "\n//\n")
-
-            f.write('OBJECTIVE_STYLE\n' + self.obj_style + '\n')
-            f.write(r'//' + '\n')
-
-            f.write('OPTIMIZER ' + self.optimizer + '\n')
-            f.write(r'//' + '\n')
+    def __setitem__(self, met, amount):
+        self.field.set_at(met, self.location, amount)
 
+    def __delitem__(self, met):
+        if np.isnan(self.field.get_at(met, self.location)):
+            raise KeyError(met)
+        self.field.unset_at(met, self.location)
+
+    def __iter__(self):
+        x, y = self.location
+        return(iter([met for met, amounts in self.field.amounts.items()
+                     if not np.isnan(amounts[x, y])]))
+
+    def __len__(self):
+        return(len(list(iter(self))))
+
+    def __repr__(self):
+        return(repr(dict(self)))
 
 class layout:
     '''
@@ -775,6 +1608,10 @@ class layout:
         # define an empty layout that can be filled later
         self.models = []
         self.grid = [1, 1]
+
+        # media is a property: rows are found through a metabolite -> row
+        # position index, and the setters add new rows in one concat
+        self.__media_index = None
         self.media = pd.DataFrame(columns=['metabolite',
                                            'init_amount',
                                            'diff_c',
@@ -782,14 +1619,15 @@ class layout:
                                            'g_static_val',
                                            'g_refresh'])
 
-        # local_media is a dictionary with locations as keys, and as values,
-        # another dict with metabolite names as keys and amounts as values
-        # this information sets initial, location-specific media amounts.
-        self.local_media = {}
+        # location-specific initial media amounts, refresh and static
+        # values are kept in local_field arrays. The local_media,
+        # local_refresh and local_static properties give them as mappings
+        # with locations as keys and mappings of met amounts as values
+        self.__local_fields = {'media': local_field(),
+                               'refresh': local_field(),
+                               'static': local_field()}
         self.global_diff = None
         self.refresh = []
-        self.local_refresh = {}
-        self.local_static = {}
         self.initial_pop_type = "custom"  # JMC not sure purpose of this
         self.initial_pop = []
         self.all_exchanged_mets = []
@@ -914,16 +1752,30 @@ class layout:
     def read_comets_layout(self, input_obj):
 
         # .. load layout file
-        f_lines = [s for s in read_file(input_obj).splitlines() if s]
-        filedata_string = os.linesep.join(f_lines)
-        end_blocks = []
-        for i in range(0, len(f_lines)):
-            if '//' in f_lines[i]:
-                end_blocks.append(i)
+        f_lines = [s for s in read_file(input_obj).splitlines() if s.strip()]
+
+        # walk the file once, recording where each block starts and ends
+        blocks = index_sections(f_lines, ['model_file', 'grid_size',
+                                          'world_media',
+                                          'diffusion_constants', 'media',
+                                          'media_refresh', 'static_media',
+                                          'barrier', 'substrate_diffusivity',
+                                          'substrate_friction',
+                                          'substrate_layout',
+                                          'periodic_media', 'initial_pop',
+                                          'reactions'],
+                                ignore_case=True)
+
+        def header(key):
+            return(f_lines[blocks[key][0]].split())
+
+        def body(key):
+            start, end = blocks[key]
+            return([line.split() for line in f_lines[start+1:end]])
 
         # '''----------- GRID ------------------------------------------'''
         try:
-            self.grid = [int(i) for i in f_lines[2].split()[1:]]
+            self.grid = [int(i) for i in header('grid_size')[1:]]
             if len(self.grid) < 2:
                 raise CorruptLine
         except CorruptLine:
@@ -938,15 +1790,12 @@ class layout:
         '''
         # right now, assume all models in layouts are strings leading to
         # comets model files
+        models = header('model_file')[1:]
 
         # models need initial pop, so lets grab that first
 
         # '''----------- INITIAL POPULATION ----------------------------'''
-        lin_initpop = re.split('initial_pop',
-                               filedata_string)[0].count('\n')
-        lin_initpop_end = next(x for x in end_blocks if x > lin_initpop)
-
-        g_initpop = f_lines[lin_initpop].split()[1:]
+        g_initpop = header('initial_pop')[1:]
 
         # TODO:  I think we should deprecate these, it makes things difficult
         # then, we could just generate these on-the-fly using the py toolbox,
@@ -958,308 +1807,329 @@ class layout:
                                                     'filled',
                                                     'filled_rect',
                                                     'square']):
-            self.initial_pop_type = g_initpop[0]
-            self.initial_pop = [float(x) for x in g_initpop[1:]]
+            # these are generated after the models are added. The last
+            # values are the biomass of each model, and the first ones
+            # give the geometry
+            pop_type = g_initpop[0]
+            pop_args = [float(x) for x in g_initpop[1:]]
+            temp_init_pop_for_models = [[] for m in models]
         else:
+            pop_type = 'custom'
             self.initial_pop_type = 'custom'
 
-            # .. local initial population values
-            lin_initpop += 1
+            # .. local initial population values, one column per model
+            locs, ipop = self.__read_located_block(body('initial_pop'),
+                                                   len(models),
+                                                   'initial_pop')
+            ipop = ipop.astype(np.float64)
 
             # list of lists of lists. first level per-model, then per-location
-            temp_init_pop_for_models = [[] for x in
-                                        range(len(f_lines[0].split()[1:]))]
-
-            try:
-                for i in range(lin_initpop, lin_initpop_end):
-                    ipop_spec = [float(x) for x in
-                                 f_lines[i].split()]
-                    if len(ipop_spec)-2 != len(temp_init_pop_for_models):
-                        raise CorruptLine
-                    if (ipop_spec[0] >= self.grid[0] or
-                            ipop_spec[1] >= self.grid[1]):
-                        raise OutOfGrid
-                    else:
-                        for j in range(len(ipop_spec)-2):
-                            if ipop_spec[j+2] != 0.0:
-                                if len(temp_init_pop_for_models[j]) == 0:
-                                    temp_init_pop_for_models[j] = [[ipop_spec[0],
-                                                                    ipop_spec[1],
-                                                                    ipop_spec[j+2]]]
-                                else:
-                                    temp_init_pop_for_models[j].append([ipop_spec[0],
-                                                                        ipop_spec[1],
-                                                                        ipop_spec[j+2]])
-
-            except CorruptLine:
-                print('Problem at some initial population lines')
-            except OutOfGrid:
-                print('Some initial population values' +
-                      ' fall outside of the defined grid')
+            temp_init_pop_for_models = []
+            for j in range(len(models)):
+                present = ipop[:, j] != 0.0
+                temp_init_pop_for_models.append(
+                    np.column_stack((locs[present].astype(float),
+                                     ipop[present, j])))
 
-        models = f_lines[0].split()[1:]
         if len(models) > 0:
+            layout_models = []
             for i, model_path in enumerate(models):
                 curr_model = model(model_path)
-                # TODO: get the initial pop information for each model, because the models own that info
                 curr_model.initial_pop = temp_init_pop_for_models[i]
-                self.add_model(curr_model)
-                self.update_models()
+                layout_models.append(curr_model)
+            self.add_models(layout_models)
         else:
             print('Warning: No models in layout')
 
-        # '''----------- MEDIA DESCRIPTION -----------------------------'''
-        lin_media = re.split('world_media',
-                             filedata_string)[0].count('\n') + 1
-        lin_media_end = next(x for x in end_blocks if x > lin_media)
-
-        media_names = []
-        media_conc = []
-        for i in range(lin_media, lin_media_end):
-            metabolite = f_lines[i].split()
-            media_names.append(metabolite[0])
-            media_conc.append(float(metabolite[1]))
+        if pop_type != 'custom' and len(models) > 0:
+            geometry = [int(x) for x in pop_args[:-len(models)]]
+            biomass = pop_args[-len(models):]
+            if pop_type == 'random':
+                self.set_initial_pop_random(geometry[0], biomass)
+            elif pop_type == 'random_rect':
+                self.set_initial_pop_random(geometry[4], biomass,
+                                            geometry[:4])
+            elif pop_type == 'filled':
+                self.set_initial_pop_filled(biomass)
+            elif pop_type == 'filled_rect':
+                self.set_initial_pop_filled(biomass, geometry[:4])
+            else:
+                self.set_initial_pop_square(*geometry[:3], biomass)
 
-        self.media['metabolite'] = media_names
-        self.media['init_amount'] = media_conc
+        # '''----------- MEDIA DESCRIPTION -----------------------------'''
+        # the media table follows the order of world_media, because the
+        # global refresh, static and diffusion values are given in that order
+        media_spec = body('world_media')
+        media_names = [row[0] for row in media_spec]
+        media_conc = [parse_number(row[1]) for row in media_spec]
+
+        self.media = pd.DataFrame({'metabolite': media_names,
+                                   'init_amount': media_conc,
+                                   'diff_c': self.default_diff_c,
+                                   'g_static': self.default_g_static,
+                                   'g_static_val': self.default_g_static_val,
+                                   'g_refresh': self.default_g_refresh},
+                                  columns=self.media.columns,
+                                  dtype=object)
+        self.add_new_mets_to_media()
 
         # '''----------- MEDIA DIFFUSION -------------------------------'''
         self.__diffusion_flag = False
-        if 'DIFFUSION' in filedata_string:
+        if 'diffusion_constants' in blocks:
             self.__diffusion_flag = True
-            lin_diff = re.split('diffusion_constants',
-                                filedata_string)[0].count('\n')
-            lin_diff_end = next(x for x in end_blocks if x > lin_diff)
+            self.global_diff = parse_number(header('diffusion_constants')[1])
 
-            self.global_diff = float(re.findall(r'\S+', f_lines[lin_diff].
-                                                strip())[1])
+            # metabolites without a specific value use the global one
+            self.media['diff_c'] = np.NaN
             try:
-                for i in range(lin_diff+1, lin_diff_end):
-                    diff_spec = [float(x) for x in f_lines[i].split()]
-                    if diff_spec[0] > len(self.media.metabolite)-1:
+                for diff_spec in body('diffusion_constants'):
+                    if int(diff_spec[0]) > len(self.media.metabolite)-1:
                         raise UnallocatedMetabolite
                     else:
                         self.media.loc[int(diff_spec[0]),
-                                       'diff_c'] = diff_spec[1]
+                                       'diff_c'] = parse_number(diff_spec[1])
             except UnallocatedMetabolite:
                 print('\n ERROR UnallocatedMetabolite: Some diffusion ' +
                       'values correspond to unallocated metabolites')
 
+        # '''----------- LOCAL MEDIA -----------------------------------'''
+        # local values are given in the order of the exchanged metabolites
         self.__local_media_flag = False
-        if 'MEDIA' in set(filedata_string.upper().strip().split()):
+        if 'media' in blocks:
             self.__local_media_flag = True
-            lin_media = [x for x in range(len(f_lines))
-                         if f_lines[x].strip().split()[0].upper() ==
-                         'MEDIA'][0]+1
-            lin_media_end = next(x for x in end_blocks if x > lin_media)
-            try:
-                for i in range(lin_media, lin_media_end):
-                    media_spec = [float(x) for x in f_lines[i].split()]
-                    if len(media_spec) != len(self.media.metabolite)+2:
-                        raise CorruptLine
-                    elif (media_spec[0] >= self.grid[0] or
-                          media_spec[1] >= self.grid[1]):
-                        raise OutOfGrid
-                    else:
-                        loc = (int(media_spec[0]), int(media_spec[1]))
-                        self.local_media[loc] = {}
-                        media_spec = media_spec[2:]
-                        for j in range(len(media_spec)):
-                            if media_spec[j] != 0:
-                                self.local_media[loc][
-                                    self.all_exchanged_mets[j]] = media_spec[j]
-            except CorruptLine:
-                print('\n ERROR CorruptLine: Some local "media" lines ' +
-                      'have a wrong number of entries')
-            except OutOfGrid:
-                print('\n ERROR OutOfGrid: Some local "media" lines ' +
-                      'have coordinates that fall outside of the ' +
-                      '\ndefined ' + 'grid')
-
-        self.__local_media_flag = False
-        if 'MEDIA' in set(filedata_string.upper().strip().split()):
-            self.__local_media_flag = True
-            lin_media = [x for x in range(len(f_lines)) if
-                         f_lines[x].strip().split()[0].upper() == 'MEDIA'][0]+1
-            lin_media_end = next(x for x in end_blocks if x > lin_media)
-            try:
-                for i in range(lin_media, lin_media_end):
-                    media_spec = [float(x) for x in f_lines[i].split()]
-                    if len(media_spec) != len(self.media.metabolite)+2:
-                        raise CorruptLine
-                    elif (media_spec[0] >= self.grid[0] or
-                          media_spec[1] >= self.grid[1]):
-                        raise OutOfGrid
-                    else:
-                        loc = (int(media_spec[0]), int(media_spec[1]))
-                        self.local_media[loc] = {}
-                        media_spec = media_spec[2:]
-                        for j in range(len(media_spec)):
-                            if media_spec[j] != 0:
-                                self.local_media[loc][
-                                    self.all_exchanged_mets[j]] = media_spec[j]
-            except CorruptLine:
-                print('\n ERROR CorruptLine: Some local "media" lines ' +
-                      'have a wrong number of entries')
-            except OutOfGrid:
-                print('\n ERROR OutOfGrid: Some local "media" lines ' +
-                      'have coordinates that fall outside of the ' +
-                      '\ndefined ' + 'grid')
+            locs, tokens = self.__read_located_block(
+                body('media'), len(self.all_exchanged_mets), 'media')
+            self.__local_fields['media'] = self.__located_values(
+                locs, tokens, tokens != '0')
 
         # '''----------- MEDIA REFRESH----------------------------------'''
         # .. global refresh values
         self.__refresh_flag = False
-        if 'REFRESH' in filedata_string.upper():
+        if 'media_refresh' in blocks:
             self.__refresh_flag = True
-            lin_refr = re.split('REFRESH',
-                                filedata_string.upper())[0].count('\n')
-            lin_refr_end = next(x for x in end_blocks if x > lin_refr)
-
-            g_refresh = [float(x) for x in f_lines[lin_refr].split()[1:]]
 
+            g_refresh = [parse_number(x) for x in header('media_refresh')[1:]]
             try:
-                if len(g_refresh) != len(media_names):
+                if len(g_refresh) != len(self.media):
                     raise CorruptLine
                 else:
-                    self.media['g_refresh'] = g_refresh
+                    self.media['g_refresh'] = np.array(g_refresh,
+                                                       dtype=object)
             except CorruptLine:
                 print('\n ERROR CorruptLine: Number of global refresh ' +
                       'values does not match number of \nmedia ' +
                       'metabolites in provided layout file')
 
             # .. local refresh values
-            lin_refr += 1
-            try:
-                for i in range(lin_refr, lin_refr_end):
-                    refr_spec = [float(x) for x in f_lines[i].split()]
-                    if len(refr_spec) != len(self.media.metabolite)+2:
-                        raise CorruptLine
-                    elif (refr_spec[0] >= self.grid[0] or
-                          refr_spec[1] >= self.grid[1]):
-                        raise OutOfGrid
-                    else:
-                        loc = (int(refr_spec[0]), int(refr_spec[1]))
-                        self.local_refresh[loc] = {}
-                        refr_spec = refr_spec[2:]
-                        for j in range(len(refr_spec)):
-                            if refr_spec[j] != 0:
-                                self.local_refresh[loc][
-                                    self.all_exchanged_mets[j]] = refr_spec[j]
+            locs, tokens = self.__read_located_block(
+                body('media_refresh'), len(self.all_exchanged_mets),
+                'refresh')
+            self.__local_fields['refresh'] = self.__located_values(
+                locs, tokens, tokens != '0')
 
-            except CorruptLine:
-                print('\n ERROR CorruptLine: Some local "refresh" lines ' +
-                      'have a wrong number of entries')
-            except OutOfGrid:
-                print('\n ERROR OutOfGrid: Some local "refresh" lines ' +
-                      'have coordinates that fall outside of the ' +
-                      '\ndefined ' + 'grid')
+        # '''----------- BARRIERS --------------------------------------'''
+        self.__barrier_flag = False
+        if 'barrier' in blocks:
+            self.barriers = [(int(b[0]), int(b[1])) for b in body('barrier')]
+            self.__barrier_flag = len(self.barriers) > 0
 
         # region-based information (substrate diffusivity,friction, layout)
         self.__region_flag = False
         try:
-            if 'SUBSTRATE_LAYOUT' in filedata_string.upper():
-                lin_substrate = re.split('SUBSTRATE_LAYOUT',
-                                         filedata_string.upper())[0].count('\n')
-                lin_substrate_end = next(x for x in end_blocks if x > lin_substrate)
-                region_map_data = []
-                for i in range(lin_substrate+1, lin_substrate_end):
-                    region_map_data.append([int(x) for x in f_lines[i].split()])
-                region_map_data = np.array(region_map_data, dtype=int)
+            if 'substrate_layout' in blocks:
+                region_map_data = np.array(body('substrate_layout'),
+                                           dtype=int)
                 if region_map_data.shape != tuple(self.grid):
                     raise CorruptLine
                 self.__region_flag = True
                 self.region_map = region_map_data
-        except CorruptLine:
+        except (CorruptLine, ValueError):
             print('\n ERROR CorruptLine: Some substrate_layout lines are ' +
                   ' longer or shorter than the grid width, or there are more' +
                   ' lines than the grid length')
 
         try:
-            if 'SUBSTRATE_DIFFUSIVITY' in filedata_string.upper():
-                lin_substrate = re.split('SUBSTRATE_DIFFUSIVITY',
-                                         filedata_string.upper())[0].count('\n')
-                lin_substrate_end = next(x for x in end_blocks if x > lin_substrate)
+            if 'substrate_diffusivity' in blocks:
                 self.region_parameters = {}
                 region = 1
-                for i in range(lin_substrate+1, lin_substrate_end):
+                for diff_spec in body('substrate_diffusivity'):
                     self.region_parameters[region] = [None, None]
-                    self.region_parameters[region][0] = [float(x)
-                                                         for x in f_lines[i].split()]
+                    self.region_parameters[region][0] = [parse_number(x)
+                                                         for x in diff_spec]
                     if len(self.region_parameters[region][0]) != len(self.media.metabolite):
                         raise CorruptLine
                     region += 1
         except CorruptLine:
             print('\n ERROR CorruptLine: Some substrate_diffusivity lines are ' +
                   ' longer or shorter than the number of metabolites')
-        if 'SUBSTRATE_FRICTION' in filedata_string.upper():
-            lin_substrate = re.split('SUBSTRATE_FRICTION',
-                                     filedata_string.upper())[0].count('\n')
-            lin_substrate_end = next(x for x in end_blocks if x > lin_substrate)
+        if 'substrate_friction' in blocks:
             region = 1
-            for i in range(lin_substrate+1, lin_substrate_end):
-                self.region_parameters[region][1] = float(f_lines[i].split()[0])
+            for fric_spec in body('substrate_friction'):
+                self.region_parameters[region][1] = parse_number(fric_spec[0])
                 region += 1
 
+        # '''----------- PERIODIC MEDIA --------------------------------'''
+        self.__periodic_media_flag = False
+        if 'periodic_media' in blocks:
+            self.periodic_media = [[int(p[0]), p[1]] +
+                                   [parse_number(x) for x in p[2:6]]
+                                   for p in body('periodic_media')]
+            self.__periodic_media_flag = len(self.periodic_media) > 0
+
         # '''----------- STATIC MEDIA ----------------------------------'''
         # .. global static values
         self.__static_flag = False
-        if 'STATIC' in filedata_string.upper():
+        if 'static_media' in blocks:
             self.__static_flag = True
-            lin_static = re.split('STATIC',
-                                  filedata_string.upper())[0].count('\n')
-            lin_stat_end = next(x for x in end_blocks if x > lin_static)
 
-            g_static = [float(x) for x in f_lines[lin_static].split()[1:]]
+            g_static = header('static_media')[1:]
             try:
                 if len(g_static) != 2*len(self.media.metabolite):
                     raise CorruptLine
                 else:
-                    self.media.loc[:, 'g_static'] = [int(x)
-                                                     for x in g_static[0::2]]
-                    self.media.loc[:, 'g_static_val'] = [float(x) for x in
-                                                         g_static[1::2]]
+                    self.media['g_static'] = np.array(
+                        [int(float(x)) for x in g_static[0::2]], dtype=object)
+                    self.media['g_static_val'] = np.array(
+                        [parse_number(x) for x in g_static[1::2]],
+                        dtype=object)
             except CorruptLine:
                 print('\nERROR CorruptLine: Wrong number of global ' +
                       'static values')
 
-            # .. local static values
-            lin_static += 1
-            try:
-                for i in range(lin_static, lin_stat_end):
-                    stat_spec = [float(x) for x in f_lines[i].split()]
-                    if len(stat_spec) != (2*len(self.media.metabolite))+2:
-                        raise CorruptLine
-                    elif (stat_spec[0] >= self.grid[0] or
-                          stat_spec[1] >= self.grid[1]):
-                        raise OutOfGrid
-                    else:
-                        loc = (int(stat_spec[0]), int(stat_spec[1]))
-                        self.local_static[loc] = {}
-                        stat_spec = stat_spec[2:]
-                        for j in range(int(len(stat_spec)/2)):
-                            if stat_spec[j*2] != 0:
-                                self.local_static[loc][
-                                    self.all_exchanged_mets[j]] = stat_spec[j*2+1]
+            # .. local static values, given as (flag, value) pairs
+            locs, tokens = self.__read_located_block(
+                body('static_media'), 2*len(self.all_exchanged_mets),
+                'static')
+            self.__local_fields['static'] = self.__located_values(
+                locs, tokens[:, 1::2], tokens[:, 0::2] != '0')
 
-            except CorruptLine:
-                print('\n ERROR CorruptLine: Wrong number of local static ' +
-                      'values at some lines')
-            except OutOfGrid:
-                print('\n ERROR OutOfGrid: Some local "static" lines have ' +
-                      ' coordinates that fall outside of the defined grid')
+        # '''----------- EXTERNAL REACTIONS ----------------------------'''
+        self.__ext_rxns_flag = False
+        if 'reactions' in blocks:
+            ext_rxns = {}
+            part = None
+            for rxn_spec in body('reactions'):
+                if rxn_spec[0] in ['reactants', 'enzymes', 'products']:
+                    part = rxn_spec[0]
+                    continue
+                rxn = ext_rxns.setdefault(int(rxn_spec[0]),
+                                          {'Name': 'rxn' + rxn_spec[0],
+                                           'metabolites': [],
+                                           'stoichiometry': []})
+                if part == 'enzymes':
+                    rxn['Kcat'] = parse_number(rxn_spec[1])
+                    continue
+                rxn['metabolites'].append(
+                    self.media.metabolite[int(rxn_spec[1])-1])
+                stoich = parse_number(rxn_spec[2])
+                rxn['stoichiometry'].append(-stoich if part == 'reactants'
+                                            else stoich)
+                # the first reactant also carries the K (or the Km)
+                if len(rxn_spec) > 3:
+                    rxn['K'] = parse_number(rxn_spec[3])
+
+            self.reactions = []
+            for key in sorted(ext_rxns.keys()):
+                rxn = ext_rxns[key]
+                if 'Kcat' in rxn and 'K' in rxn:
+                    rxn['Km'] = rxn.pop('K')
+                self.reactions.append(rxn)
+            self.__ext_rxns_flag = len(self.reactions) > 0
+
+    def __read_located_block(self, rows, n_values, block_name):
+        """ used by read_comets_layout to parse the split lines of a block
+        where each line is an x y location followed by n_values numbers.
+        Lines are read up to the first corrupt or out-of-grid one. Returns
+        the locations as an int array and the values as an array of strings
+        """
+        n_good = len(rows)
+        bad = [i for i, row in enumerate(rows) if len(row) != n_values + 2]
+        if len(bad) > 0:
+            n_good = bad[0]
+            print('\n ERROR CorruptLine: Some local "' + block_name +
+                  '" lines have a wrong number of entries')
+
+        tokens = np.array(rows[:n_good], dtype=str).reshape(n_good,
+                                                            n_values + 2)
+        locs = tokens[:, :2].astype(float)
+        out_of_grid = np.flatnonzero((locs[:, 0] >= self.grid[0]) |
+                                     (locs[:, 1] >= self.grid[1]))
+        if len(out_of_grid) > 0:
+            n_good = out_of_grid[0]
+            print('\n ERROR OutOfGrid: Some local "' + block_name +
+                  '" lines have coordinates that fall outside of the ' +
+                  '\ndefined ' + 'grid')
+
+        tokens = tokens[:n_good, 2:]
+        return(locs[:n_good].astype(int), tokens)
+
+    def __located_values(self, locs, tokens, present):
+        """ used by read_comets_layout to turn a parsed local block into a
+        local_field with the exchanged metabolites flagged in present and
+        their amounts """
+        field = local_field()
+        field.set_cells(None, locs, None)
+        for j in np.flatnonzero(present.any(axis=0)).tolist():
+            rows = present[:, j]
+            field.set_cells(self.all_exchanged_mets[j], locs[rows],
+                            tokens[rows, j].astype(float))
+        return(field)
 
     def get_model_ids(self):
         ids = [x.id for x in self.models]
         return(ids)
 
-    def write_necessary_files(self, working_dir):
-        self.write_layout(working_dir)
-        self.write_model_files(working_dir)
-
-    def write_model_files(self, working_dir = ""):
-        '''writes each model file'''
+    def clone(self):
+        """ returns a copy of the layout, e.g. for a condition variant, with
+        clones of the models. The media table and initial pop are copied,
+        and the local media, refresh and static arrays are shared until
+        either layout changes them """
+        lyt = copy_containers(self)
+        lyt.models = [m.clone() for m in self.models]
+        lyt.media = self.media.copy()
+        lyt.initial_pop = copy.deepcopy(self.initial_pop)
+        lyt.__local_fields = {kind: field.copy() for kind, field
+                              in self.__local_fields.items()}
+        if self.region_map is not None:
+            lyt.region_map = self.region_map.copy()
+        return(lyt)
+
+    def write_necessary_files(self, working_dir, model_store=None):
+        model_files = self.write_model_files(working_dir, model_store)
+        self.write_layout(working_dir, model_files)
+        return(model_files)
+
+    def write_model_files(self, working_dir = "", model_store=None):
+        '''writes each model file, and returns the list of model file paths
+
+        A model listed more than once is only written once. If
+        model_store is a directory, model files are kept there under their
+        fingerprint (as model_store/fingerprint/model_id.cmd) and are only
+        written if they are not already in the store, so unchanged models
+        are not serialized again across runs. Models are only fingerprinted
+        when there is a model_store'''
+        model_files = []
+        written = set()
         for model in self.models:
-            model.write_comets_model(working_dir)
+            if model_store is None:
+                path = working_dir + model.id + '.cmd'
+                if (path, id(model)) not in written:
+                    model.write_comets_model(working_dir)
+                written.add((path, id(model)))
+            else:
+                directory = os.path.join(model_store, model.get_fingerprint())
+                path = os.path.join(directory, model.id + '.cmd')
+                if not os.path.isfile(path):
+                    # write to a private temporary directory and move the
+                    # file in place, so concurrent runs never see it half
+                    # written
+                    os.makedirs(directory, exist_ok=True)
+                    tmp_dir = tempfile.mkdtemp(dir=directory)
+                    model.write_comets_model(tmp_dir + '/')
+                    os.replace(os.path.join(tmp_dir, model.id + '.cmd'), path)
+                    os.rmdir(tmp_dir)
+            model_files.append(path)
+        return(model_files)
 
     def display_current_media(self):
         print(self.media[self.media['init_amount'] != 0.0])
@@ -1287,23 +2157,93 @@ class layout:
             self.__barrier_flag = True
             self.barriers = list(set(self.barriers))
 
+    @property
+    def media(self):
+        ''' the media table, with one row per metabolite '''
+        return(self.__media)
+
+    @media.setter
+    def media(self, media):
+        self.__media = media
+        self.__media_index = None
+
+    def __media_rows(self):
+        ''' returns the metabolite -> row position index of the media. It is
+        rebuilt when the table is replaced or its length changed '''
+        key = (id(self.__media), len(self.__media))
+        if self.__media_index is None or self.__media_index[0] != key:
+            mets = self.__media['metabolite']
+            self.__media_index = (key, dict(zip(mets, range(len(mets)))))
+        return(self.__media_index[1])
+
+    def __set_media_values(self, values, columns, add=False):
+        ''' sets columns (a dict of name: value) of the media rows of the
+        metabolites in values (a dict of met: value, the value going to
+        columns with value None). Metabolites not in the media are added if
+        add, in one concat, and returned otherwise '''
+        rows = self.__media_rows()
+        names = self.__media['metabolite'].to_numpy()
+        if any(names[rows[met]] != met for met in values if met in rows):
+            # the table was renamed or reordered in place
+            self.__media_index = None
+            rows = self.__media_rows()
+        missing = []
+        positions = []
+        mets = []
+        new_rows = []
+        for met, value in values.items():
+            row = rows.get(met)
+            if row is not None:
+                positions.append(row)
+                mets.append(met)
+            elif add:
+                new_row = {'metabolite': met,
+                           'g_refresh': self.default_g_refresh,
+                           'g_static': self.default_g_static,
+                           'g_static_val': self.default_g_static_val,
+                           'init_amount': 0,
+                           'diff_c': self.default_diff_c}
+                for col, col_value in columns.items():
+                    new_row[col] = value if col_value is None else col_value
+                new_rows.append(new_row)
+            else:
+                missing.append(met)
+
+        if positions:
+            values = [values[met] for met in mets]
+            for col, col_value in columns.items():
+                j = self.__media.columns.get_loc(col)
+                if len(positions) == 1:
+                    self.__media.iat[positions[0], j] = (
+                        values[0] if col_value is None else col_value)
+                else:
+                    self.__media.iloc[positions, j] = (
+                        values if col_value is None else col_value)
+
+        if new_rows:
+            n_table = len(self.__media)
+            self.__media = pd.concat([self.__media, pd.DataFrame(new_rows)],
+                                     axis=0, sort=False)
+            # the index follows the new rows rather than being rebuilt
+            rows.update((row['metabolite'], n_table + i)
+                        for i, row in enumerate(new_rows))
+            self.__media_index = ((id(self.__media), len(self.__media)),
+                                  rows)
+        return(missing)
+
     def set_specific_metabolite(self, met, amount):
-        if met in set(self.media['metabolite']):
-            self.media.loc[self.media['metabolite'] == met,
-                           'init_amount'] = amount
-        else:
-            newrow = {'metabolite': met,
-                      'g_refresh': self.default_g_refresh,
-                      'g_static': self.default_g_static,
-                      'g_static_val': self.default_g_static_val,
-                      'init_amount': amount,
-                      'diff_c': self.default_diff_c}
-            newrow = pd.DataFrame([newrow], columns=newrow.keys())
-            self.media = pd.concat([self.media,
-                                    newrow],
-                                   axis=0, sort=False)
+        if met not in self.__media_rows():
             print('Warning: The added metabolite (' + met + ') is not' +
                   'able to be taken up by any of the current models')
+        self.__set_media_values({met: amount}, {'init_amount': None},
+                                add=True)
+
+    def set_specific_metabolites(self, amounts):
+        ''' sets the initial amounts of many metabolites at once. amounts is
+        a dict or a pandas Series of amounts by metabolite name. Metabolites
+        that are not in the media are added '''
+        self.__set_media_values(dict(amounts), {'init_amount': None},
+                                add=True)
 
     def set_specific_metabolite_at_location(self, met, location, amount):
         """ allows the user to specify a metabolite going to a specific location
@@ -1311,48 +2251,107 @@ class layout:
         environments. The met should be the met name (e.g. 'o2_e') the
         location should be a tuple (e.g. (0, 5)), and the amount should be
         a float / number"""
-        if met not in self.all_exchanged_mets:
+        if not self.__is_exchanged(met):
             raise Exception('met is not in the list of exchangeable mets')
         self.__local_media_flag = True
-        if location not in list(self.local_media.keys()):
-            self.local_media[location] = {}
-        self.local_media[location][met] = amount
+        self.__local_fields['media'].set_at(met, location, amount)
+
+    def set_specific_metabolite_field(self, met, amounts):
+        """ sets the initial amounts of met at many locations at once.
+        amounts is a 2D array indexed by x, y, e.g. of the grid shape.
+        Locations where amounts is NaN are left as they are """
+        self.__set_local_field('media', met, amounts)
+        self.__local_media_flag = True
 
     def set_specific_refresh(self, met, amount):
-        try:
-            self.media.loc[self.media['metabolite'] == met,
-                           'g_refresh'] = amount
-            self.__refresh_flag = True
-        except:
+        self.set_specific_refreshes({met: amount})
+
+    def set_specific_refreshes(self, amounts):
+        ''' sets the global refresh of many metabolites at once. amounts is
+        a dict or a pandas Series of amounts by metabolite name '''
+        missing = self.__set_media_values(dict(amounts), {'g_refresh': None})
+        for met in missing:
             print("the specified metabolite " + met +
                   "is not able to be taken up, not added to media")
+        self.__refresh_flag = True
 
     def set_specific_refresh_at_location(self, met, location, amount):
-        if met not in self.all_exchanged_mets:
+        if not self.__is_exchanged(met):
             raise Exception('met is not in the list of exchangeable mets')
         self.__refresh_flag = True
-        if location not in list(self.local_refresh.keys()):
-            self.local_refresh[location] = {}
-        self.local_refresh[location][met] = amount
+        self.__local_fields['refresh'].set_at(met, location, amount)
+
+    def set_specific_refresh_field(self, met, amounts):
+        """ sets the refresh of met at many locations at once, from a 2D
+        array indexed by x, y. NaN locations are left as they are """
+        self.__set_local_field('refresh', met, amounts)
+        self.__refresh_flag = True
 
     def set_specific_static(self, met, amount):
-        try:
-            self.media.loc[self.media['metabolite'] == met,
-                           'g_static'] = 1
-            self.media.loc[self.media['metabolite'] == met,
-                           'g_static_val'] = amount
-            self.__static_flag = True
-        except:
+        self.set_specific_statics({met: amount})
+
+    def set_specific_statics(self, amounts):
+        ''' sets static global amounts of many metabolites at once. amounts
+        is a dict or a pandas Series of amounts by metabolite name '''
+        missing = self.__set_media_values(dict(amounts),
+                                          {'g_static': 1,
+                                           'g_static_val': None})
+        for met in missing:
             print("the specified metabolite " + met +
                   "is not able to be taken up, not added to media")
+        self.__static_flag = True
 
     def set_specific_static_at_location(self, met, location, amount):
-        if met not in self.all_exchanged_mets:
+        if not self.__is_exchanged(met):
             raise Exception('met is not in the list of exchangeable mets')
         self.__static_flag = True
-        if location not in list(self.local_static.keys()):
-            self.local_static[location] = {}
-        self.local_static[location][met] = amount
+        self.__local_fields['static'].set_at(met, location, amount)
+
+    def set_specific_static_field(self, met, amounts):
+        """ sets static amounts of met at many locations at once, from a
+        2D array indexed by x, y. NaN locations are left as they are """
+        self.__set_local_field('static', met, amounts)
+        self.__static_flag = True
+
+    def __set_local_field(self, kind, met, amounts):
+        if not self.__is_exchanged(met):
+            raise Exception('met is not in the list of exchangeable mets')
+        amounts = np.asarray(amounts, dtype=float)
+        if amounts.ndim != 2 or (amounts.shape[0] > self.grid[0] or
+                                 amounts.shape[1] > self.grid[1]):
+            raise ValueError('amounts should be a 2D array no larger ' +
+                             'than the grid')
+        self.__local_fields[kind].set(met, amounts)
+
+    @property
+    def local_media(self):
+        ''' the local media, as a local_field: a mapping with locations as
+        keys and, as values, mappings of the initial amounts of the mets set
+        there. It can be changed in place like a dict of dicts, or replaced
+        by assigning a dict '''
+        return(self.__local_fields['media'])
+
+    @local_media.setter
+    def local_media(self, located):
+        self.__local_fields['media'] = local_field.from_dict(located)
+
+    @property
+    def local_refresh(self):
+        ''' the local refresh values, as a mapping like local_media '''
+        return(self.__local_fields['refresh'])
+
+    @local_refresh.setter
+    def local_refresh(self, located):
+        self.__local_fields['refresh'] = local_field.from_dict(located)
+
+    @property
+    def local_static(self):
+        ''' the local static values, as a mapping like local_media '''
+        return(self.__local_fields['static'])
+
+    @local_static.setter
+    def local_static(self, located):
+        self.__local_fields['static'] = local_field.from_dict(located)
 
     def add_typical_trace_metabolites(self, amount=1000.0):
         trace_metabolites = ['ca2_e',
@@ -1375,33 +2374,23 @@ class layout:
                              'so4_e',
                              'zn2_e']
 
-        for met in trace_metabolites:
-            if met in set(self.media['metabolite']):
-                self.media.loc[self.media['metabolite'] == met,
-                               'init_amount'] = amount
-            else:
-                newrow = {'metabolite': met,
-                          'g_refresh': self.default_g_refresh,
-                          'g_static': self.default_g_static,
-                          'g_static_val': self.default_g_static_val,
-                          'init_amount': amount,
-                          'diff_c': self.default_diff_c}
-                newrow = pd.DataFrame([newrow], columns=newrow.keys())
-                self.media = pd.concat([self.media,
-                                        newrow],
-                                       axis=0, sort=False)
-                # print('Warning: The added metabolite (' + met + ') is not' +
-                #      'able to be taken up by any of the current models')
+        self.set_specific_metabolites(dict.fromkeys(trace_metabolites,
+                                                    amount))
         self.media = self.media.reset_index(drop=True)
 
-    def write_layout(self, working_dir):
-        ''' Write the layout in a file'''
+    def write_layout(self, working_dir, model_files=None):
+        ''' Write the layout in a file. model_files are the paths of the
+        model files, by default working_dir + model_id + '.cmd' '''
         outfile = working_dir + ".current_layout"
         if os.path.isfile(outfile):
             os.remove(outfile)
 
+        if model_files is None:
+            model_files = [working_dir + model_id + '.cmd'
+                           for model_id in self.get_model_ids()]
+
         lyt = open(outfile, 'a')
-        self.__write_models_and_world_grid_chunk(lyt, working_dir)
+        self.__write_models_and_world_grid_chunk(lyt, model_files)
         self.__write_media_chunk(lyt)
         self.__write_diffusion_chunk(lyt)
         self.__write_local_media_chunk(lyt)
@@ -1416,12 +2405,10 @@ class layout:
         self.__write_ext_rxns_chunk(lyt)
         lyt.close()
 
-    def __write_models_and_world_grid_chunk(self, lyt, working_dir):
+    def __write_models_and_world_grid_chunk(self, lyt, model_files):
         """ writes the top 3 lines  to the open lyt file"""
 
-        model_file_line = "{}.cmd".format(".cmd ".join(self.get_model_ids())).split(" ")
-        model_file_line = [_ + " " for _ in model_file_line]
-        model_file_line = working_dir + working_dir.join(model_file_line)
+        model_file_line = ''.join([path + ' ' for path in model_files])
         model_file_line = "model_file " + model_file_line + "\n"
         lyt.write(model_file_line)
         lyt.write('  model_world\n')
@@ -1443,19 +2430,8 @@ class layout:
         metabolite data"""
         if self.__local_media_flag:
             lyt.write('    media\n')
-            locs = list(self.local_media.keys())
-            for loc in locs:
-                # this chunk goes in order, not by name, so must get met number
-                # for each location, make a list with zeros for each met. Put
-                # non-zero numbers where the self.local_media tells us to
-                met_amounts_in_order = [0] * len(self.all_exchanged_mets)
-                for met in list(self.local_media[loc].keys()):
-                    met_amounts_in_order[
-                        self.__get_met_number(met)] = self.local_media[loc][met]
-                lyt.write('      ')
-                lyt.write('{} {} '.format(loc[0], loc[1]))
-                lyt.write(' '.join(str(x) for x in met_amounts_in_order))
-                lyt.write('\n')
+            lyt.write(self.__local_fields['media'].lines(
+                self.all_exchanged_mets))
             lyt.write('    //\n')
 
     def __write_refresh_chunk(self, lyt):
@@ -1464,17 +2440,8 @@ class layout:
                       ' '.join([str(x) for x in self.media.
                                 g_refresh.tolist()]) +
                       '\n')
-            locs = list(self.local_refresh.keys())
-            if len(locs) > 0:
-                for loc in locs:
-                    met_amounts_in_order = [0] * len(self.all_exchanged_mets)
-                    for met in list(self.local_refresh[loc].keys()):
-                        met_amounts_in_order[self.__get_met_number(met)] = self.local_refresh[loc][met]
-                    met_amounts_in_order.insert(0, loc[1])
-                    met_amounts_in_order.insert(0, loc[0])
-                    lyt.write('      ' +
-                              ' '.join([str(x) for x in met_amounts_in_order]) +
-                              '\n')
+            lyt.write(self.__local_fields['refresh'].lines(
+                self.all_exchanged_mets))
             lyt.write(r'    //' + '\n')
 
     def __write_static_chunk(self, lyt):
@@ -1484,24 +2451,8 @@ class layout:
             g_static_line[1::2] = self.media.g_static_val
             lyt.write('    static_media ' +
                       ' '.join([str(x) for x in g_static_line]) + '\n')
-            locs = list(self.local_static.keys())
-            if len(locs) > 0:
-                for loc in locs:
-                    # this is 2 * len because there is a pair of values for each met
-                    # the first value is a flag--0 if not static, 1 if static
-                    # the second value is the amount if it is static
-                    met_amounts_in_order = [0] * 2 * len(self.all_exchanged_mets)
-                    for met in list(self.local_static[loc].keys()):
-                        met_amounts_in_order[self.__get_met_number(met) * 2] = 1
-                        met_amounts_in_order[
-                            self.__get_met_number(met) * 2 + 1] = self.local_static[
-                                loc][met]
-                    met_amounts_in_order.insert(0, loc[1])
-                    met_amounts_in_order.insert(0, loc[0])
-                    lyt.write('      ' +
-                              ' '.join([str(x) for x in
-                                        met_amounts_in_order]) +
-                              '\n')
+            lyt.write(self.__local_fields['static'].lines(
+                self.all_exchanged_mets, static=True))
             lyt.write(r'    //' + '\n')
 
     def __write_diffusion_chunk(self, lyt):
@@ -1644,13 +2595,16 @@ class layout:
         lyt file and adds the closing //s """
         if (self.initial_pop_type == 'custom'):
             lyt.write('  initial_pop\n')
-            for i in self.initial_pop:
-                lyt.write('    ' + str(int(i[0])) + ' ' + str(int(i[1])) +
-                          ' ' + ' '.join([str(x) for x in i[2:]]) +
-                          '\n')
+            initial_pop = np.asarray(self.initial_pop,
+                                     dtype=float).reshape(
+                                         -1, len(self.models) + 2)
+            columns = ([format_column(initial_pop[:, :2].astype(int).T[k])
+                        for k in range(2)] +
+                       [format_amounts(col) for col in initial_pop[:, 2:].T])
+            for line in zip(*columns):
+                lyt.write('    ' + ' '.join(line) + '\n')
         else:
-            # TODO: test this part and fix, probably not functional currently
-            lyt.write('  initial_pop ' + self.initial_pop_type +
+            lyt.write('  initial_pop ' + self.initial_pop_type + ' ' +
                       ' '.join([str(x) for x in self.initial_pop]) +
                       '\n')
         lyt.write(r'  //' + '\n')
@@ -1663,35 +2617,93 @@ class layout:
 
     def build_initial_pop(self):
         # This counts how many models there are.  then it goes through
-        # each model, and makes a new initial pop line of the right length
+        # each model, and makes a block of initial pop lines of the right
+        # length: x, y and a biomass column per model
         n_models = len(self.models)
-        initial_pop = []
+        blocks = [np.zeros((0, n_models + 2))]
         for i, model in enumerate(self.models):
-            if not isinstance(model.initial_pop[0], list):
-                model.initial_pop = [model.initial_pop]
-            for pop in model.initial_pop:
-                curr_line = [0] * (n_models + 2)
-                curr_line[0] = pop[0]
-                curr_line[1] = pop[1]
-                curr_line[i+2] = pop[2]
-                initial_pop.append(curr_line)
-        self.initial_pop = initial_pop
-
-    def add_new_mets_to_media(self):
+            pop = np.asarray(model.initial_pop, dtype=float).reshape(-1, 3)
+            block = np.zeros((len(pop), n_models + 2))
+            block[:, :2] = pop[:, :2]
+            block[:, i + 2] = pop[:, 2]
+            blocks.append(block)
+        self.initial_pop = np.concatenate(blocks)
+
+    def __models_biomass(self, biomass):
+        # one biomass value per model, from a number or a list
+        biomass = np.broadcast_to(np.asarray(biomass, dtype=float),
+                                  (len(self.models),))
+        return(biomass.tolist())
+
+    def set_initial_pop(self, model_id, biomass, mask=None):
+        """ sets the initial population of a model from a 2D array of
+        biomass indexed by x, y, e.g. of the grid shape. Locations with 0
+        biomass are empty. If mask, a 2D boolean array, is given, biomass
+        may be a number and only the masked locations are filled """
+        i = self.get_model_ids().index(model_id)
+        biomass = np.asarray(biomass, dtype=float)
+        if mask is None:
+            mask = biomass != 0
+        mask = np.asarray(mask, dtype=bool)
+        locs = np.argwhere(mask)
+        if biomass.ndim == 2:
+            biomass = biomass[mask]
+        pop = np.empty((len(locs), 3))
+        pop[:, :2] = locs
+        pop[:, 2] = biomass
+        self.models[i].initial_pop = pop
+        self.initial_pop_type = 'custom'
+        self.build_initial_pop()
+
+    def set_initial_pop_filled(self, biomass, rect=None):
+        """ fills every location, or those in rect = (x, y, width, height),
+        with biomass, one value for all models or one per model """
+        x, y, w, h = rect if rect is not None else (0, 0) + tuple(self.grid)
+        mask = np.zeros(self.grid, dtype=bool)
+        mask[x:x + w, y:y + h] = True
+        for model_id, amount in zip(self.get_model_ids(),
+                                    self.__models_biomass(biomass)):
+            self.set_initial_pop(model_id, amount, mask)
+
+    def set_initial_pop_square(self, x, y, width, biomass):
+        """ fills a width x width square with its corner at x, y """
+        self.set_initial_pop_filled(biomass, (x, y, width, width))
+
+    def set_initial_pop_random(self, n, biomass, rect=None, seed=None):
+        """ puts biomass at n random locations for each model, in the whole
+        grid or in rect = (x, y, width, height). Each model gets n distinct
+        locations, drawn with numpy's generator seeded with seed """
+        x, y, w, h = rect if rect is not None else (0, 0) + tuple(self.grid)
+        w = min(w, self.grid[0] - x)
+        h = min(h, self.grid[1] - y)
+        if n > w * h:
+            raise ValueError('cannot put ' + str(n) + ' random founders ' +
+                             'in ' + str(w * h) + ' locations')
+        rng = np.random.default_rng(seed)
+        for model_id, amount in zip(self.get_model_ids(),
+                                    self.__models_biomass(biomass)):
+            cells = rng.choice(w * h, size=n, replace=False)
+            mask = np.zeros(self.grid, dtype=bool)
+            mask[x + cells // h, y + cells % h] = True
+            self.set_initial_pop(model_id, amount, mask)
+
+    def add_new_mets_to_media(self, mets=None):
         # usually run right after build_exchange mets, to add any new mets
-        # to the media data.frame
-
-        for met in self.all_exchanged_mets:
-            if met not in self.media['metabolite'].values:
-                new_row = pd.DataFrame.from_dict({'metabolite': [met],
-                                                  'init_amount': [0],
-                                                  'diff_c': [self.default_diff_c],
-                                                  'g_static': [self.default_g_static],
-                                                  'g_static_val': [
-                                                      self.default_g_static_val],
-                                                  'g_refresh': [self.default_g_refresh]})
-                self.media = pd.concat([self.media, new_row],
-                                       ignore_index=True, sort=True)
+        # to the media data.frame. If mets is given, only those are checked
+
+        known = set(self.media['metabolite'])
+        if mets is None:
+            mets = self.all_exchanged_mets
+        new_mets = [met for met in mets if met not in known]
+        if new_mets:
+            new_rows = pd.DataFrame({'metabolite': new_mets,
+                                     'init_amount': 0,
+                                     'diff_c': self.default_diff_c,
+                                     'g_static': self.default_g_static,
+                                     'g_static_val': self.default_g_static_val,
+                                     'g_refresh': self.default_g_refresh})
+            self.media = pd.concat([self.media, new_rows],
+                                   ignore_index=True, sort=True)
 
     def build_exchanged_mets(self):
         # goes through each model, grabs its exchange met names, and bundles
@@ -1707,14 +2719,53 @@ class layout:
         pass
 
     def add_model(self, model):
-        self.models.append(model)
-        self.update_models()
+        self.add_models([model])
 
-    def __get_met_number(self, met):
-        """ returns the met number (of the external mets) given a name """
-        met_number = [x for x in range(len(self.all_exchanged_mets)) if
-                      self.all_exchanged_mets[x] == met][0]
-        return(met_number)
+    def add_models(self, models):
+        """ adds several models at once. Only the metabolites exchanged by
+        the new models are merged into all_exchanged_mets and the media """
+        models = list(models)
+        self.models.extend(models)
+        self.build_initial_pop()
+
+        new_mets = set()
+        for model in models:
+            new_mets.update(model.get_exchange_metabolites())
+        known = set(self.all_exchanged_mets)
+        new_mets = [met for met in new_mets if met not in known]
+        if new_mets:
+            self.all_exchanged_mets = sorted(self.all_exchanged_mets +
+                                             new_mets)
+            self.add_new_mets_to_media(sorted(new_mets))
+
+    @property
+    def all_exchanged_mets(self):
+        ''' the sorted names of the metabolites exchanged by the models '''
+        return(self.__all_exchanged_mets)
+
+    @all_exchanged_mets.setter
+    def all_exchanged_mets(self, mets):
+        self.__all_exchanged_mets = mets
+        self.__met_numbers = None
+
+    def __met_index(self):
+        """ returns the met name -> met number index. It is rebuilt when
+        the list is replaced or its length changed """
+        mets = self.__all_exchanged_mets
+        key = (id(mets), len(mets))
+        if self.__met_numbers is None or self.__met_numbers[0] != key:
+            self.__met_numbers = (key, {met: i for i, met in
+                                        enumerate(mets)})
+        return(self.__met_numbers[1])
+
+    def __is_exchanged(self, met):
+        """ whether met is in all_exchanged_mets, checking the index
+        against the list in case the list was changed in place """
+        i = self.__met_index().get(met)
+        if i is None or self.__all_exchanged_mets[i] != met:
+            self.__met_numbers = None
+            i = self.__met_index().get(met)
+        return(i is not None)
 
 
 class params:
@@ -1891,6 +2942,10 @@ class params:
             self.all_params['writeTotalBiomassLog'] = False
             self.all_params['writeBiomassLog'] = True
 
+    def clone(self):
+        ''' returns a copy of the parameters, e.g. for a variant '''
+        return(copy_containers(self))
+
     ''' write parameters files; method probably only used by class comets'''
     def write_params(self, out_glb, out_pkg):
 
@@ -1918,16 +2973,369 @@ class params:
                     pkg.writelines(k + ' = ' + v + '\n')
 
 
+class log_tail:
+    '''
+    Follows a comets log while it is being written. Each call to read()
+    parses only the rows appended since the previous call, and returns the
+    cycles that were completed as a list of (cycle, rows) pairs, where rows
+    are lists of string tokens. cycle_column is the position of the cycle in
+    a row. A cycle is complete when a row of a later cycle appears, or
+    straight away if one_row_per_cycle (e.g. the total biomass log).
+    '''
+    def __init__(self, path, cycle_column=0, one_row_per_cycle=False):
+        self.path = path
+        self.cycle_column = cycle_column
+        self.one_row_per_cycle = one_row_per_cycle
+        self.offset = 0
+        self.partial = ''
+        self.cycle = None
+        self.rows = []
+
+    def read(self, final=False):
+        ''' returns the cycles completed since the last call. If final, the
+        log is finished and the last cycle is returned too '''
+        text = ''
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                text = f.read().decode()
+                self.offset = f.tell()
+
+        lines = (self.partial + text).split('\n')
+        # the last line may still be being written
+        self.partial = '' if final else lines.pop()
+
+        completed = []
+        for line in lines:
+            tokens = line.split()
+            if not tokens:
+                continue
+            cycle = int(float(tokens[self.cycle_column]))
+            if self.cycle is not None and cycle != self.cycle:
+                completed.append((self.cycle, self.rows))
+                self.rows = []
+            self.cycle = cycle
+            self.rows.append(tokens)
+            if self.one_row_per_cycle:
+                completed.append((self.cycle, self.rows))
+                self.rows = []
+                self.cycle = None
+
+        if final and self.rows:
+            completed.append((self.cycle, self.rows))
+            self.rows = []
+            self.cycle = None
+        return(completed)
+
+
+class stop_on_plateau:
+    '''
+    Stopping rule for comets.run: stops the simulation when the total
+    biomass changed less than rel_growth (relative to the previous cycle)
+    for n_cycles consecutive cycles.
+
+    Stopping rules are objects with the log they follow and a call
+    rule(sim, cycle, data, state) that returns the reason for stopping, or
+    None to go on. data is the array that a run callback gets for that log,
+    and state is a dict the rule can use to remember values during one run,
+    so that a rule can be shared by many simulations. A rule may also have
+    a check(sim) method, called before java is started, that raises a
+    ValueError if the rule cannot be used with sim.
+    '''
+    log = 'total_biomass'
+
+    def __init__(self, rel_growth=1e-3, n_cycles=10):
+        self.rel_growth = rel_growth
+        self.n_cycles = n_cycles
+
+    def __call__(self, sim, cycle, data, state):
+        total = data.sum()
+        last = state.get('last')
+        state['last'] = total
+        if last is None:
+            return(None)
+        if last > 0:
+            growth = abs(total - last) / last
+        else:
+            growth = 0. if total == 0 else np.inf
+        state['n'] = state.get('n', 0) + 1 if growth < self.rel_growth else 0
+        if state['n'] >= self.n_cycles:
+            return('relative growth below ' + str(self.rel_growth) +
+                   ' for ' + str(self.n_cycles) + ' cycles')
+        return(None)
+
+
+class stop_on_biomass:
+    '''
+    Stopping rule for comets.run: stops the simulation when the total
+    biomass of model_id (or of all models, if None) reaches target
+    '''
+    log = 'total_biomass'
+
+    def __init__(self, target, model_id=None):
+        self.target = target
+        self.model_id = model_id
+
+    def check(self, sim):
+        if (self.model_id is not None and
+                self.model_id not in sim.layout.get_model_ids()):
+            raise ValueError('stop_on_biomass: ' + str(self.model_id) +
+                             ' is not a model of the layout')
+
+    def __call__(self, sim, cycle, data, state):
+        if self.model_id is None:
+            biomass = data.sum()
+        else:
+            if 'model_index' not in state:
+                state['model_index'] = sim.layout.get_model_ids().index(
+                    self.model_id)
+            biomass = data[state['model_index']]
+        if biomass >= self.target:
+            return('biomass reached ' + str(self.target))
+        return(None)
+
+
+class stop_on_depletion:
+    '''
+    Stopping rule for comets.run: stops the simulation when the total
+    amount of met in the grid falls to threshold or below. It follows the
+    media log, so it is checked every MediaLogRate cycles
+    '''
+    log = 'media'
+
+    def __init__(self, met, threshold=0.):
+        self.met = met
+        self.threshold = threshold
+
+    def check(self, sim):
+        if self.met not in set(sim.layout.media.metabolite):
+            raise ValueError('stop_on_depletion: ' + str(self.met) +
+                             ' is not in the media of the layout')
+
+    def __call__(self, sim, cycle, data, state):
+        if 'met_index' not in state:
+            state['met_index'] = list(sim.layout.media.metabolite).index(
+                self.met)
+        if data[state['met_index']].sum() <= self.threshold:
+            return(self.met + ' depleted')
+        return(None)
+
+
+class media_cube:
+    '''
+    The media of a simulation as a dense float32 array on disk, with shape
+    (metabolite, cycle, x, y). It is memory-mapped, so slicing it only reads
+    the pages that are used. comets.run builds it when the simulation has a
+    media_cube_dir, and write_media_cube builds it from a media log. Open it
+    again later with media_cube(directory).
+
+        cube = sim.media_cube
+        glc = cube.get('glc__D_e')                      # (cycle, x, y)
+        last = cube.get('glc__D_e', cube.cycles[-1])    # (x, y)
+        totals = cube[:, -1].sum(axis=(1, 2))           # all metabolites
+
+    metabolites and cycles label the first two axes.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'media.json')) as f:
+            meta = json.load(f)
+        self.metabolites = meta['metabolites']
+        self.cycles = np.array(meta['cycles'], dtype=int)
+        self.met_index = dict(zip(self.metabolites,
+                                  range(len(self.metabolites))))
+        self.data = np.load(os.path.join(directory, 'media.npy'),
+                            mmap_mode='r')
+
+    def get(self, met, cycle=None):
+        ''' returns the (cycle, x, y) concentrations of met, or its (x, y)
+        concentrations at one cycle '''
+        if met not in self.met_index:
+            raise NameError("met " + met + " is not in the media cube")
+        if cycle is None:
+            return(self.data[self.met_index[met]])
+        c = np.searchsorted(self.cycles, cycle)
+        if c == len(self.cycles) or self.cycles[c] != cycle:
+            raise ValueError('media was not saved at the desired cycle. try another.')
+        return(self.data[self.met_index[met], c])
+
+    def __getitem__(self, key):
+        return(self.data[key])
+
+    # pickle the directory rather than the data, e.g. for batch processes
+    def __getstate__(self):
+        return({'directory': self.directory})
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'])
+
+
+def write_media_cube(log_path, directory, grid, metabolites=(),
+                     max_cycle=None, chunk_size=1000000):
+    """ converts a comets media log into a media_cube in directory, and
+    returns it. metabolites sets the order of the first metabolites (others
+    in the log follow, sorted), and cycles after max_cycle are left out.
+    The log is read in chunks of chunk_size rows, so it never is in memory
+    as a whole """
+    names = ['metabolite', 'cycle', 'x', 'y', 'conc_mmol']
+
+    def chunks(usecols=None, dtype=None):
+        if os.path.getsize(log_path) == 0:
+            return([])
+        return(pd.read_csv(log_path, delim_whitespace=True, header=None,
+                           names=names, usecols=usecols, dtype=dtype,
+                           chunksize=chunk_size))
+
+    # first pass: the metabolite and cycle axes
+    log_mets = set()
+    cycles = set()
+    for chunk in chunks(['metabolite', 'cycle'], {'metabolite': 'category'}):
+        log_mets.update(chunk['metabolite'].cat.categories)
+        cycles.update(chunk['cycle'].unique())
+    metabolites = list(metabolites)
+    metabolites += sorted(log_mets.difference(metabolites))
+    cycles = np.array(sorted(c for c in cycles
+                             if max_cycle is None or c <= max_cycle),
+                      dtype=int)
+
+    # second pass: the concentrations
+    os.makedirs(directory, exist_ok=True)
+    data = np.lib.format.open_memmap(os.path.join(directory, 'media.npy'),
+                                     mode='w+', dtype=np.float32,
+                                     shape=(len(metabolites), len(cycles),
+                                            grid[0], grid[1]))
+    met_dtype = pd.CategoricalDtype(metabolites)
+    for chunk in chunks(dtype={'metabolite': met_dtype}):
+        if max_cycle is not None:
+            chunk = chunk.loc[chunk['cycle'] <= max_cycle]
+        data[chunk['metabolite'].cat.codes.to_numpy(),
+             np.searchsorted(cycles, chunk['cycle'].to_numpy()),
+             chunk['x'].to_numpy() - 1,
+             chunk['y'].to_numpy() - 1] = chunk['conc_mmol'].to_numpy()
+    data.flush()
+    del data
+
+    # the index is written last, so a cube with an index is complete
+    with open(os.path.join(directory, 'media.json'), 'w') as f:
+        json.dump({'metabolites': metabolites,
+                   'cycles': cycles.tolist()}, f)
+    return(media_cube(directory))
+
+
+class saved_results:
+    '''
+    Results of a simulation saved with comets.save_results, loaded lazily:
+    each table is read from its Parquet file the first time it is used.
+
+        res = comets.load_results('/path/to/results')
+        res.total_biomass
+        glc = res.read('media', columns=['cycle', 'x', 'y', 'conc_mmol'],
+                       filters=[('metabolite', '==', 'glc__D_e')])
+        ex = res.read_fluxes('e_coli_core', reactions=['EX_glc__D_e'])
+
+    read() and read_fluxes() only read the given columns and, with filters
+    (as in pandas.read_parquet), the row groups that can match them. The
+    run metadata (stop_reason, stop_cycle, run_output, grid, model_ids and
+    parameters) are attributes. The media of a run in media cube mode are
+    its media_cube attribute.
+    '''
+    def __init__(self, path):
+        check_parquet_engine()
+        self.path = path
+        with open(os.path.join(path, 'metadata.json')) as f:
+            meta = json.load(f)
+        self.tables = meta.pop('tables')
+        self.flux_models = meta.pop('flux_models')
+        cube = meta.pop('media_cube', None)
+        if cube is not None:
+            self.media_cube = media_cube(os.path.join(path, cube))
+        for key, value in meta.items():
+            setattr(self, key, value)
+
+    def __getattr__(self, name):
+        # only called for tables that were not read yet
+        if name == 'fluxes_by_species' and 'flux_models' in self.__dict__:
+            value = {model_id: self.read_fluxes(model_id)
+                     for model_id in self.flux_models}
+        elif name in self.__dict__.get('tables', []):
+            value = self.read(name)
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return(value)
+
+    def read(self, name, columns=None, filters=None):
+        ''' reads the table name, or only its columns and the rows matching
+        filters '''
+        if name not in self.tables:
+            raise NameError("table " + name + " was not saved")
+        return(self.__read(os.path.join(self.path, name + '.parquet'),
+                           columns, filters))
+
+    def read_fluxes(self, model_id, reactions=None, filters=None):
+        ''' reads the fluxes of model_id, or only those of reactions and the
+        rows matching filters '''
+        if model_id not in self.flux_models:
+            raise NameError("no fluxes were saved for model " + model_id)
+        columns = None
+        if reactions is not None:
+            columns = ['cycle', 'x', 'y'] + list(reactions)
+        return(self.__read(os.path.join(self.path, 'fluxes',
+                                        model_id + '.parquet'),
+                           columns, filters))
+
+    def __read(self, path, columns, filters):
+        # memory_map is an option of pyarrow only, the engine pandas picks
+        # first when it is installed
+        try:
+            __import__('pyarrow')
+            options = {'memory_map': True}
+        except ImportError:
+            options = {}
+        return(pd.read_parquet(path, columns=columns, filters=filters,
+                               **options))
+
+
+def load_results(path):
+    """ returns the results saved with comets.save_results in path, read
+    lazily (see saved_results) """
+    return(saved_results(path))
+
+
 class comets:
     '''
     This class sets up an environment with all necessary for
     a comets simulation to run, runs the simulation, and stores the output
     data from it.
     '''
-    def __init__(self, layout, parameters, working_dir=''):
-
-        # define instance variables
-        self.working_dir = os.getcwd() + '/' + working_dir
+    # results of a simulation, and the parameters that enable them
+    RESULT_FLAGS = {'total_biomass': 'writeTotalBiomassLog',
+                    'media': 'writeMediaLog',
+                    'biomass': 'writeBiomassLog',
+                    'evolution': 'evolution',
+                    'genotypes': 'evolution',
+                    'specific_media': 'writeSpecificMediaLog'}
+
+    def __init__(self, layout, parameters, working_dir='', model_store=None,
+                 result_cache=None, media_cube_dir=None, compact=False):
+
+        # define instance variables. working_dir may also be absolute
+        self.working_dir = os.path.join(os.getcwd(), working_dir)
+
+        # optional directory where model files are kept by fingerprint, so
+        # that unchanged models are not rewritten on every run
+        self.model_store = model_store
+
+        # optional result_cache, to reuse the results of identical runs
+        self.result_cache = result_cache
+
+        # if set, the media log is read into a media_cube in this directory
+        # instead of the media dataframe. Use one directory per simulation
+        self.media_cube_dir = media_cube_dir
+
+        # if True, the results are read with compact dtypes (see
+        # compact_results). 'float32' also makes the floats float32
+        self.compact = compact
         self.GUROBI_HOME = os.environ['GUROBI_HOME']
         self.COMETS_HOME = os.environ['COMETS_HOME']
 
@@ -1943,16 +3351,38 @@ class comets:
         self.layout = layout
         self.parameters = parameters
 
-        # dealing with output files
-        self.parameters.all_params['useLogNameTimeStamp'] = False
-        self.parameters.all_params['TotalBiomassLogName'] = (
-            'total_biomass_log_' + hex(id(self)))
-        self.parameters.all_params['BiomassLogName'] = (
-            'biomass_log_' + hex(id(self)))
-        self.parameters.all_params['FluxLogName'] = (
-            'flux_log_' + hex(id(self)))
-        self.parameters.all_params['MediaLogName'] = (
-            'media_log_' + hex(id(self)))
+        # dealing with output files. These override the log names in
+        # parameters when writing them, so that many comets objects can share
+        # one params object. Logs are written in working_dir
+        self.log_names = {'TotalBiomassLogName': ('total_biomass_log_' +
+                                                  hex(id(self))),
+                          'BiomassLogName': 'biomass_log_' + hex(id(self)),
+                          'FluxLogName': 'flux_log_' + hex(id(self)),
+                          'MediaLogName': 'media_log_' + hex(id(self)),
+                          'SpecificMediaLogName': ('specific_media_log_' +
+                                                   hex(id(self)))}
+
+        # why and at which cycle a stopping rule stopped the last run
+        self.stop_reason = None
+        self.stop_cycle = None
+
+        # row positions of the results by cycle, etc. for the images
+        self.__image_indexes = {}
+
+        # arrays of the logs run() followed, by log, so that they are not
+        # parsed again once java exits
+        self.__tailed = {}
+
+        # the fluxes table, built from fluxes_by_species when first used,
+        # and the positions in the flux log of the rows of each model
+        self.__fluxes = None
+        self.__flux_positions = None
+
+        # logs that run() can follow: log name, write flag and cycle column
+        self.tail_logs = {'total_biomass': ('TotalBiomassLogName',
+                                            'writeTotalBiomassLog', 0),
+                          'media': ('MediaLogName', 'writeMediaLog', 1),
+                          'fluxes': ('FluxLogName', 'writeFluxLog', 0)}
 
     def build_default_classpath_pieces(self):
         self.classpath_pieces = {}
@@ -2056,22 +3486,230 @@ class comets:
         self.classpath_pieces[libraryname] = path
         self.build_and_set_classpath()
 
-    def run(self, delete_files=True):
+    def run(self, delete_files=True, callback=None,
+            tail=('total_biomass',), poll_interval=1., stop_rules=None,
+            force=False):
+        ''' runs the simulation and reads its output.
+
+        If a callback is given, the logs named in tail ('total_biomass',
+        'media' and/or 'fluxes') are followed while the simulation runs, and
+        callback(log, cycle, data) is called for each logged cycle as soon
+        as it is written, every poll_interval seconds. data is a NumPy array:
+        the biomass of each model for 'total_biomass', a (metabolite, x, y)
+        array ordered as layout.media for 'media', and a dict of
+        (x, y, reaction) arrays by model id for 'fluxes'. Logs that are not
+        written by the simulation are skipped.
+
+        stop_rules is a list of stopping rules (see stop_on_plateau,
+        stop_on_biomass and stop_on_depletion), checked on each logged cycle
+        in the same way. When one returns a reason, java is stopped, the
+        results are read up to that cycle, and the reason and cycle are kept
+        in stop_reason and stop_cycle.
+
+        With a result_cache (or default_result_cache), results of an
+        identical simulation that ran before are read from the cache
+        instead, and callbacks are not called. force=True runs the
+        simulation anyway, replacing the stored results '''
+        print('\nRunning COMETS simulation ...')
+
+        self.stop_reason = None
+        self.stop_cycle = None
+        stop_rules = [] if stop_rules is None else list(stop_rules)
+        for rule in stop_rules:
+            log_name, write_flag, cycle_column = self.tail_logs[rule.log]
+            if not self.run_params()[write_flag]:
+                raise ValueError(type(rule).__name__ + ' needs the ' +
+                                 rule.log + ' log, which is not written')
+            if hasattr(rule, 'check'):
+                rule.check(self)
+
+        self.write_run_files()
+
+        cache = self.result_cache
+        if cache is None:
+            cache = default_result_cache
+        # media cubes live outside the result cache, so it is not used
+        if self.media_cube_dir is not None:
+            cache = None
+        if cache is not None:
+            fingerprint = self.get_fingerprint(stop_rules)
+            if not force and self.__load_results(cache, fingerprint):
+                if delete_files:
+                    self.remove_run_files()
+                print('Done! Results were read from the result cache.')
+                return
+
+        # simulate. java is started without a shell, so it can be stopped
+        self.__tailed = {}
+        p = sp.Popen(self.cmd_args, stdout=sp.PIPE, stderr=sp.STDOUT,
+                     cwd=self.working_dir)
+
+        if callback is None and not stop_rules:
+            self.run_output, self.run_errors = p.communicate()
+        else:
+            self.run_output, self.run_errors = self.__monitor(
+                p, callback, tail if callback is not None else (),
+                poll_interval, stop_rules)
+        self.run_output = self.run_output.decode()
+
+        if self.run_errors is not None:
+            self.run_errors = self.run_errors.decode()
+        else:
+            self.run_errors = "STDERR empty."
+
+        self.read_run_output(delete_files)
+        if cache is not None:
+            self.__save_results(cache, fingerprint)
+        print('Done!')
+
+    def get_fingerprint(self, stop_rules=None):
+        ''' returns a hash of the input of the simulation, as written by
+        write_run_files: the layout, model and parameter files, the COMETS
+        jar, and the stopping rules. Paths and log names, which change
+        between runs, are left out, but the model ids, which key the
+        results, are kept '''
+        h = hashlib.sha1()
+        h.update(repr(self.layout.get_model_ids()).encode())
+        with open(self.working_dir + '.current_layout', 'rb') as f:
+            for line in f:
+                if not line.strip().startswith(b'model_file'):
+                    h.update(line)
+        for path in self.model_files:
+            h.update(file_hash(path).encode())
+        for f in ['.current_global', '.current_package']:
+            with open(self.working_dir + f) as params_file:
+                for line in params_file:
+                    key = line.split(' = ')[0]
+                    if (key not in self.log_names and
+                            key != 'useLogNameTimeStamp'):
+                        h.update(line.encode())
+        jar = self.classpath_pieces['bin']
+        h.update(file_hash(jar).encode() if os.path.isfile(jar)
+                 else jar.encode())
+        for rule in stop_rules or []:
+            h.update(repr((type(rule).__name__,
+                           sorted(vars(rule).items()))).encode())
+        return(h.hexdigest())
+
+    def __save_results(self, cache, fingerprint):
+        frames = {name: getattr(self, name)
+                  for name, flag in self.RESULT_FLAGS.items()
+                  if self.run_params().get(flag)}
+        if self.parameters.all_params['writeFluxLog']:
+            for model_id, df in self.fluxes_by_species.items():
+                frames['fluxes_by_species/' + model_id] = df
+        attributes = {'run_output': self.run_output,
+                      'stop_reason': self.stop_reason,
+                      'stop_cycle': self.stop_cycle}
+        cache.save(fingerprint, frames, attributes)
+
+    def __load_results(self, cache, fingerprint):
+        ''' sets the results stored in cache. Returns False if there are
+        none '''
+        stored = cache.load(fingerprint)
+        if stored is None:
+            return(False)
+        frames, attributes = stored
+        self.fluxes_by_species = {}
+        self.__fluxes = None
+        self.__flux_positions = None
+        for name, df in frames.items():
+            if name.startswith('fluxes_by_species/'):
+                self.fluxes_by_species[name.split('/', 1)[1]] = df
+            else:
+                setattr(self, name, df)
+        for key, value in attributes.items():
+            setattr(self, key, value)
+        self.run_errors = "STDERR empty."
+        if self.compact:
+            self.compact_results(float32=self.compact == 'float32')
+        return(True)
+
+    async def run_async(self, delete_files=True):
+        ''' coroutine version of run(). Many simulations can be awaited
+        together in one event loop, e.g. with asyncio.gather, without a
+        thread per simulation '''
         print('\nRunning COMETS simulation ...')
+        async for line in self.stream_output(delete_files):
+            pass
+        print('Done!')
 
-        # If evolution is true, write the biomass but not the total biomass log
-        if self.parameters.all_params['evolution']:
-            self.parameters.all_params['writeTotalBiomassLog'] = False
-            self.parameters.all_params['writeBiomassLog'] = True
+    async def stream_output(self, delete_files=True):
+        """ runs the simulation asynchronously, yielding the lines of the
+        java output as they are printed:
+
+            async for line in sim.stream_output():
+                print(line, end='')
+
+        The results are read once the output ends, as in run(). If the
+        iteration is cancelled or stopped early, java is killed and the
+        simulation files and logs are removed. Writing the input files and
+        reading the logs is done in a worker thread, off the event loop """
+        self.stop_reason = None
+        self.stop_cycle = None
+        self.__tailed = {}
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.write_run_files)
+
+        proc = await asyncio.create_subprocess_exec(
+            *self.cmd_args, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT, cwd=self.working_dir)
+
+        output = []
+        finished = False
+        try:
+            async for line in proc.stdout:
+                line = line.decode()
+                output.append(line)
+                yield(line)
+            await proc.wait()
+            finished = True
+        finally:
+            if not finished:
+                if proc.returncode is None:
+                    try:
+                        proc.kill()
+                    except ProcessLookupError:
+                        pass
+                    await proc.wait()
+                # shielded, so that a cancelled task still removes its files
+                await asyncio.shield(loop.run_in_executor(
+                    None, self.remove_run_files))
+
+        self.run_output = ''.join(output)
+        self.run_errors = "STDERR empty."
+        await loop.run_in_executor(None, self.read_run_output, delete_files)
+
+    def run_params(self):
+        ''' returns the parameters the simulation runs with, as a dict: the
+        all_params of parameters, except that with evolution on, the
+        biomass log is written instead of the total biomass log. parameters
+        is not modified, since many simulations may share it '''
+        all_params = self.parameters.all_params
+        if all_params['evolution']:
+            all_params = dict(all_params, writeTotalBiomassLog=False,
+                              writeBiomassLog=True)
+        return(all_params)
+
+    def write_run_files(self):
+        ''' writes the layout, model, parameters and script files for a
+        simulation in working_dir, and sets the command that runs it '''
 
         # write the files for comets in working_dir
+        os.makedirs(self.working_dir, exist_ok=True)
         c_global = self.working_dir + '.current_global'
         c_package = self.working_dir + '.current_package'
         c_script = self.working_dir + '.current_script'
 
-        self.layout.write_necessary_files(self.working_dir)
-        # self.layout.write_layout(self.working_dir + '.current_layout')
-        self.parameters.write_params(c_global, c_package)
+        self.model_files = self.layout.write_necessary_files(
+            self.working_dir, self.model_store)
+
+        # log names go on a copy, so that the shared params are not modified
+        run_parameters = copy.copy(self.parameters)
+        run_parameters.all_params = dict(self.run_params(),
+                                         useLogNameTimeStamp=False,
+                                         **self.log_names)
+        run_parameters.write_params(c_global, c_package)
 
         if os.path.isfile(c_script):
             os.remove(c_script)
@@ -2081,175 +3719,858 @@ class comets:
             f.writelines('load_layout ' + self.working_dir +
                          '.current_layout')
 
-        # simulate
-        self.cmd = ('java -classpath ' + self.JAVA_CLASSPATH +
-                    # ' -Djava.library.path=' + self.D_JAVA_LIB_PATH +
-                    ' edu.bu.segrelab.comets.Comets -loader' +
-                    ' edu.bu.segrelab.comets.fba.FBACometsLoader' +
-                    ' -script ' + c_script)
-
-        p = sp.Popen(self.cmd, shell=True, stdout=sp.PIPE, stderr=sp.STDOUT)
-
-        self.run_output, self.run_errors = p.communicate()
-        self.run_output = self.run_output.decode()
-
-        if self.run_errors is not None:
-            self.run_errors = self.run_errors.decode()
-        else:
-            self.run_errors = "STDERR empty."
+        # cmd_args is used to start java directly, without a shell
+        self.cmd_args = ['java', '-classpath', self.JAVA_CLASSPATH,
+                         # '-Djava.library.path=' + self.D_JAVA_LIB_PATH,
+                         'edu.bu.segrelab.comets.Comets', '-loader',
+                         'edu.bu.segrelab.comets.fba.FBACometsLoader',
+                         '-script', c_script]
+        self.cmd = ' '.join(self.cmd_args)
+
+    def __monitor(self, p, callback, tail, poll_interval, stop_rules):
+        ''' waits for process p while following the logs in tail and those
+        needed by stop_rules, and stops p if a rule says so. The parsed rows
+        are kept, for read_run_output. Returns the output of p, as
+        communicate() '''
+        tails = {}
+        for log in list(tail) + [rule.log for rule in stop_rules]:
+            log_name, write_flag, cycle_column = self.tail_logs[log]
+            if self.run_params()[write_flag]:
+                tails[log] = log_tail(self.get_log_path(log_name),
+                                      cycle_column,
+                                      log == 'total_biomass')
+                self.__tailed[log] = []
+        states = [{} for rule in stop_rules]
+
+        # the output is read in a thread, so that java never blocks on it
+        with cf.ThreadPoolExecutor(1) as executor:
+            output = executor.submit(p.communicate)
+            finished = False
+            while not finished:
+                finished = not cf.wait([output], poll_interval).not_done
+                for log, lt in tails.items():
+                    # the last line of a stopped log may be unfinished
+                    last = finished and self.stop_cycle is None
+                    for cycle, rows in lt.read(final=last):
+                        # cycles logged after stopping are ignored
+                        if (self.stop_cycle is not None and
+                                cycle > self.stop_cycle):
+                            break
+                        columns = self.__tail_columns(log, rows)
+                        self.__tailed[log].append(columns)
+                        data = self.__tail_array(log, columns)
+                        if log in tail:
+                            callback(log, cycle, data)
+                        for rule, state in zip(stop_rules, states):
+                            if rule.log != log or self.stop_cycle is not None:
+                                continue
+                            reason = rule(self, cycle, data, state)
+                            if reason is not None:
+                                self.stop_reason = reason
+                                self.stop_cycle = cycle
+                                p.terminate()
+            # the rows of a cycle that was not completed, e.g. when p was
+            # stopped, are read_run_output's too
+            for log, lt in tails.items():
+                if lt.rows:
+                    self.__tailed[log].append(
+                        self.__tail_columns(log, lt.rows))
+            return(output.result())
+
+    def __tail_columns(self, log, rows):
+        ''' converts the rows of one cycle of a log to NumPy arrays: the
+        float rows for 'total_biomass', the metabolites and the float cycle,
+        x, y and amounts for 'media', and for 'fluxes' the float rows of
+        each model without the model number, as read_flux_log '''
+        if log == 'total_biomass':
+            return(np.array(rows, dtype=float))
+
+        if log == 'media':
+            return((np.array([r[0] for r in rows], dtype=object),
+                    np.array([r[1:5] for r in rows], dtype=float)))
+
+        # fluxes: rows are cycle, x, y, model number and fluxes. The
+        # positions of the rows of each model in the cycle are kept too
+        fluxes = []
+        positions = []
+        for i, m in enumerate(self.layout.models):
+            rows_of_model = [j for j, r in enumerate(rows)
+                             if r[3] == str(i + 1)]
+            model_rows = [rows[j][:3] + rows[j][4:] for j in rows_of_model]
+            if any(len(r) != 3 + len(m.reactions) for r in model_rows):
+                raise CorruptLine('flux log rows of model ' + str(i + 1) +
+                                  ' do not have ' + str(len(m.reactions)) +
+                                  ' fluxes')
+            fluxes.append(np.array(model_rows, dtype=float).reshape(
+                -1, 3 + len(m.reactions)))
+            positions.append(np.array(rows_of_model, dtype=np.int64))
+        return((fluxes, positions, len(rows)))
+
+    def __tail_array(self, log, columns):
+        ''' converts the arrays of one cycle of a log, from __tail_columns,
+        to the data given to callbacks and stopping rules '''
+        if log == 'total_biomass':
+            return(columns[0, 1:])
+
+        grid = self.layout.grid
+        if log == 'media':
+            mets = list(self.layout.media.metabolite)
+            met_index = dict(zip(mets, range(len(mets))))
+            im = np.zeros((len(mets), grid[0], grid[1]))
+            names, values = columns
+            known = np.array([met in met_index for met in names], dtype=bool)
+            if known.any():
+                m = np.array([met_index[met] for met in names[known]])
+                values = values[known]
+                im[m, values[:, 1].astype(int) - 1,
+                   values[:, 2].astype(int) - 1] = values[:, 3]
+            return(im)
+
+        ims = {}
+        for m, values in zip(self.layout.models, columns[0]):
+            im = np.zeros((grid[0], grid[1], len(m.reactions)))
+            if len(values):
+                im[values[:, 1].astype(int) - 1,
+                   values[:, 2].astype(int) - 1] = values[:, 3:]
+            ims[m.id] = im
+        return(ims)
+
+    def __tailed_result(self, log):
+        ''' returns the result of a log that run() followed to its end,
+        built from the arrays kept while following it, or None if it was
+        not followed: a dataframe for 'total_biomass' and 'media', and for
+        'fluxes' the arrays and row positions of each model, as
+        read_flux_log '''
+        pieces = self.__tailed.pop(log, None)
+        log_name = self.tail_logs[log][0]
+        if pieces is None or not os.path.isfile(self.get_log_path(log_name)):
+            return(None)
+
+        if log == 'total_biomass':
+            columns = ['cycle'] + self.layout.get_model_ids()
+            values = (np.concatenate(pieces) if pieces
+                      else np.empty((0, len(columns))))
+            return(pd.DataFrame(values, columns=columns))
+
+        if log == 'media':
+            names = (np.concatenate([piece[0] for piece in pieces]) if pieces
+                     else np.empty(0, dtype=object))
+            values = (np.concatenate([piece[1] for piece in pieces]) if pieces
+                      else np.empty((0, 4)))
+            df = pd.DataFrame({'metabolite': names})
+            for j, col in enumerate(['cycle', 'x', 'y']):
+                df[col] = values[:, j].astype(np.int64)
+            df['conc_mmol'] = values[:, 3]
+            return(df)
+
+        offsets = np.cumsum([0] + [piece[2] for piece in pieces])
+        fluxes = []
+        positions = []
+        for i, m in enumerate(self.layout.models):
+            fluxes.append(np.concatenate([piece[0][i] for piece in pieces])
+                          if pieces else np.empty((0, 3 + len(m.reactions))))
+            positions.append(np.concatenate(
+                [piece[1][i] + offset
+                 for piece, offset in zip(pieces, offsets)])
+                if pieces else np.empty(0, dtype=np.int64))
+        return((fluxes, positions))
+
+    def get_log_path(self, log_name):
+        ''' returns the path of one of the logs of this simulation, given its
+        parameter name (e.g. 'TotalBiomassLogName') '''
+        return(self.working_dir + self.log_names[log_name])
+
+    def read_run_output(self, delete_files=True):
+        ''' parses the logs written by the simulation, and removes them and
+        the simulation files if delete_files '''
 
         # '''----------- READ OUTPUT ---------------------------------------'''
 
-        # Read total biomass output
-        if self.parameters.all_params['writeTotalBiomassLog']:
-            tbmf = readlines_file(
-                self.parameters.all_params['TotalBiomassLogName'])
-            self.total_biomass = pd.DataFrame([re.split(r'\t+', x.strip())
-                                               for x in tbmf],
-                                              columns=['cycle'] +
-                                              self.layout.get_model_ids())
-            self.total_biomass = self.total_biomass.astype('float')
+        # a stopped simulation may have left unfinished lines in the logs
+        if self.stop_cycle is not None:
+            for log_name in (list(self.log_names.values()) +
+                             ['GENOTYPES_' + self.log_names['BiomassLogName']]):
+                if os.path.isfile(self.working_dir + log_name):
+                    truncate_partial_line(self.working_dir + log_name)
+
+        # Read total biomass output. Logs that run() followed are built
+        # from the rows it parsed
+        if self.run_params()['writeTotalBiomassLog']:
+            self.total_biomass = self.__tailed_result('total_biomass')
+            if self.total_biomass is None:
+                tbmf = readlines_file(
+                    self.get_log_path('TotalBiomassLogName'))
+                self.total_biomass = pd.DataFrame(
+                    [re.split(r'\t+', x.strip()) for x in tbmf],
+                    columns=['cycle'] + self.layout.get_model_ids())
+                self.total_biomass = self.total_biomass.astype('float')
+            self.total_biomass = self.__until_stop(self.total_biomass,
+                                                   'cycle')
             if delete_files:
-                os.remove(self.parameters.all_params['TotalBiomassLogName'])
+                os.remove(self.get_log_path('TotalBiomassLogName'))
 
         # Read flux
         if self.parameters.all_params['writeFluxLog']:
-
-            max_rows = 4 + max([len(m.reactions) for m in self.layout.models])
-
-            self.fluxes = pd.read_csv(self.parameters.all_params['FluxLogName'],
-                                      delim_whitespace=True,
-                                      header=None, names=range(max_rows))
+            fluxes = self.__tailed_result('fluxes')
+            if fluxes is None:
+                fluxes = read_flux_log(self.get_log_path('FluxLogName'),
+                                       [len(m.reactions)
+                                        for m in self.layout.models])
             if delete_files:
-                os.remove(self.parameters.all_params['FluxLogName'])
-            self.build_readable_flux_object()
+                os.remove(self.get_log_path('FluxLogName'))
+            self.build_readable_flux_object(*fluxes)
 
         # Read media logs
         if self.parameters.all_params['writeMediaLog']:
-            self.media = pd.read_csv(self.parameters.all_params[
-                'MediaLogName'], delim_whitespace=True, names=('metabolite',
-                                                               'cycle', 'x',
-                                                               'y',
-                                                               'conc_mmol'))
+            if self.media_cube_dir is None:
+                self.media = self.__tailed_result('media')
+                if self.media is None:
+                    self.media = pd.read_csv(
+                        self.get_log_path('MediaLogName'),
+                        delim_whitespace=True,
+                        names=('metabolite', 'cycle', 'x', 'y', 'conc_mmol'))
+                self.media = self.__until_stop(self.media, 'cycle')
+            else:
+                self.media = None
+                self.__tailed.pop('media', None)
+                self.media_cube = write_media_cube(
+                    self.get_log_path('MediaLogName'), self.media_cube_dir,
+                    self.layout.grid, list(self.layout.media.metabolite),
+                    self.stop_cycle)
 
             if delete_files:
-                os.remove(self.parameters.all_params['MediaLogName'])
+                os.remove(self.get_log_path('MediaLogName'))
 
         # Read spatial biomass log
-        if self.parameters.all_params['writeBiomassLog']:
-            biomass_out_file = 'biomass_log_' + hex(id(self))
+        if self.run_params()['writeBiomassLog']:
+            biomass_out_file = self.get_log_path('BiomassLogName')
             self.biomass = pd.read_csv(biomass_out_file,
                                        header=None, delimiter=r'\s+',
                                        names=['cycle', 'x', 'y',
                                               'species', 'biomass'])
-            if delete_files:
-                os.remove(biomass_out_file)
+            self.biomass = self.__until_stop(self.biomass, 'cycle')
 
         # Read evolution-related logs
         if 'evolution' in list(self.parameters.all_params.keys()):
             if self.parameters.all_params['evolution']:
-                evo_out_file = 'biomass_log_' + hex(id(self))
+                evo_out_file = self.get_log_path('BiomassLogName')
                 self.evolution = pd.read_csv(evo_out_file,
                                              header=None, delimiter=r'\s+',
                                              names=['cycle', 'x', 'y',
                                                     'species', 'biomass'])
-                genotypes_out_file = 'GENOTYPES_biomass_log_' + hex(id(self))
+                self.evolution = self.__until_stop(self.evolution, 'cycle')
+                genotypes_out_file = (self.working_dir + 'GENOTYPES_' +
+                                      self.log_names['BiomassLogName'])
                 self.genotypes = pd.read_csv(genotypes_out_file,
                                              header=None, delimiter=r'\s+',
                                              names=['Ancestor',
                                                     'Mutation',
                                                     'Species'])
-            if delete_files:
-                os.remove(genotypes_out_file)
+                if delete_files:
+                    os.remove(genotypes_out_file)
+
+        if self.run_params()['writeBiomassLog'] and delete_files:
+            os.remove(self.get_log_path('BiomassLogName'))
 
         # Read specific media output
         if self.parameters.all_params['writeSpecificMediaLog']:
-            spec_med_file = self.parameters.all_params['SpecificMediaLogName']
+            spec_med_file = self.get_log_path('SpecificMediaLogName')
             self.specific_media = pd.read_csv(spec_med_file, delimiter=r'\s+')
             if delete_files:
-                os.remove(self.parameters.all_params['SpecificMediaLogName'])
+                os.remove(spec_med_file)
+
+        self.__tailed = {}
+        if self.compact:
+            self.compact_results(float32=self.compact == 'float32')
 
         # clean workspace
         if delete_files:
-            os.remove(c_global)
-            os.remove(c_package)
-            os.remove(c_script)
-            os.remove('.current_layout')
-            os.remove('COMETS_manifest.txt')  # todo: stop writing this in java
-        print('Done!')
-
-    def build_readable_flux_object(self):
-        """ comets.fluxes is an odd beast, where the column position has a
-        different meaning depending on what model the row is about. Therefore,
-        this function creates separate dataframes, stored in a dictionary with
-        model_id as a key, that are much more human-readable."""
+            self.remove_run_files(logs=False)
+
+    def __until_stop(self, df, cycle_column):
+        ''' drops the rows logged after the cycle where a stopping rule
+        stopped the simulation, if it was stopped '''
+        if self.stop_cycle is None:
+            return(df)
+        return(df.loc[df[cycle_column] <= self.stop_cycle])
+
+    def remove_run_files(self, logs=True):
+        ''' removes the simulation files from working_dir, and also the logs
+        if logs is True. Files that do not exist are skipped '''
+        files = ['.current_global', '.current_package', '.current_script',
+                 '.current_layout',
+                 'COMETS_manifest.txt']  # todo: stop writing manifest in java
+        if logs:
+            files += list(self.log_names.values())
+            files.append('GENOTYPES_' + self.log_names['BiomassLogName'])
+        for f in files:
+            if os.path.isfile(self.working_dir + f):
+                os.remove(self.working_dir + f)
+
+    def compact_results(self, float32=False):
+        ''' converts the results to compact dtypes (see compact_frame):
+        categorical metabolite and species columns, int16/int32 cycles and
+        coordinates and, with float32, float32 concentrations, biomass and
+        fluxes. Prints and returns the memory used before and after, in
+        bytes '''
+        frames = {name: getattr(self, name)
+                  for name, flag in self.RESULT_FLAGS.items()
+                  if self.run_params().get(flag) and
+                  getattr(self, name, None) is not None}
+        if self.parameters.all_params['writeFluxLog']:
+            for model_id, df in self.fluxes_by_species.items():
+                frames['fluxes_by_species/' + model_id] = df
+
+        before = 0
+        after = 0
+        for name, df in frames.items():
+            before += df.memory_usage(deep=True).sum()
+            df = compact_frame(df, float32)
+            after += df.memory_usage(deep=True).sum()
+            if name.startswith('fluxes_by_species/'):
+                self.fluxes_by_species[name.split('/', 1)[1]] = df
+            else:
+                setattr(self, name, df)
+        # the fluxes table is built again from the compact fluxes_by_species
+        self.__fluxes = None
+        print('Compact results: ' + str(round(before / 2**20, 1)) +
+              ' MB -> ' + str(round(after / 2**20, 1)) + ' MB')
+        return((int(before), int(after)))
+
+    def save_results(self, path, compression='zstd'):
+        ''' saves the results of the simulation in directory path, as one
+        compressed Parquet file per table, with metabolite and species
+        columns as categoricals, plus the run metadata. In media cube mode,
+        the cube is copied into path/media_cube instead of a media table.
+        Read them with load_results(path). Needs pyarrow (or fastparquet) '''
+        check_parquet_engine()
+        os.makedirs(path, exist_ok=True)
+        tables = []
+        for name, flag in self.RESULT_FLAGS.items():
+            df = getattr(self, name, None)
+            if not self.run_params().get(flag) or df is None:
+                continue
+            # e.g. the genotypes table has a 'Species' column
+            df = df.astype({col: 'category' for col in df.columns
+                            if col.lower() in ['metabolite', 'species']})
+            df.to_parquet(os.path.join(path, name + '.parquet'),
+                          compression=compression)
+            tables.append(name)
+
+        # in media cube mode the media are the cube, which is copied
+        cube = None
+        if self.run_params().get('writeMediaLog') and self.media is None:
+            if getattr(self, 'media_cube', None) is None:
+                raise ValueError('the media of the simulation were not read')
+            cube = 'media_cube'
+            os.makedirs(os.path.join(path, cube), exist_ok=True)
+            # the index last, as write_media_cube does
+            for name in ['media.npy', 'media.json']:
+                shutil.copyfile(os.path.join(self.media_cube.directory, name),
+                                os.path.join(path, cube, name))
+
+        flux_models = []
+        if self.parameters.all_params['writeFluxLog']:
+            os.makedirs(os.path.join(path, 'fluxes'), exist_ok=True)
+            for model_id, df in self.fluxes_by_species.items():
+                df.to_parquet(os.path.join(path, 'fluxes',
+                                           model_id + '.parquet'),
+                              compression=compression)
+                flux_models.append(model_id)
+
+        meta = {'tables': tables,
+                'flux_models': flux_models,
+                'media_cube': cube,
+                'stop_reason': self.stop_reason,
+                'stop_cycle': self.stop_cycle,
+                'run_output': getattr(self, 'run_output', None),
+                'grid': list(self.layout.grid),
+                'model_ids': self.layout.get_model_ids(),
+                'parameters': self.run_params()}
+        with open(os.path.join(path, 'metadata.json'), 'w') as f:
+            json.dump(meta, f, default=str)
+
+    def build_readable_flux_object(self, fluxes=None, positions=None):
+        """ builds fluxes_by_species, a dictionary with a dataframe of the
+        fluxes of each model (columns cycle, x, y and the reaction names)
+        with model_id as a key. fluxes are the arrays of each model and
+        positions the positions of their rows in the log, as returned by
+        read_flux_log. Without them, they are taken from comets.fluxes """
+        if fluxes is None:
+            table = self.fluxes
+            model_numbers = table[3].to_numpy()
+            fluxes = []
+            positions = []
+            for i, m in enumerate(self.layout.models):
+                rows = np.flatnonzero(model_numbers == i + 1)
+                columns = [0, 1, 2] + list(range(4, 4 + len(m.reactions)))
+                fluxes.append(table.iloc[rows, columns].to_numpy(dtype=float))
+                positions.append(rows)
+        else:
+            # the table is built from fluxes_by_species when it is used
+            self.__fluxes = None
 
         self.fluxes_by_species = {}
-        for i in range(len(self.layout.models)):
-            model_num = i + 1
-
-            model_id = self.layout.models[model_num - 1].id
-            model_rxn_names = list(self.layout.models[
-                model_num - 1].reactions.REACTION_NAMES)
-            model_rxn_len = len(model_rxn_names)
-
-            sub_df = self.fluxes.loc[self.fluxes[3] == model_num]
-            
-            # this tosses extraneous columns and the model num column
-            sub_df = sub_df.drop(sub_df.columns[model_rxn_len+4: len(sub_df.columns)],
-                                 axis=1)
-            sub_df = sub_df.drop(sub_df.columns[3], axis=1)
-            sub_df.columns = ["cycle", "x", "y"] + model_rxn_names
-            self.fluxes_by_species[model_id] = sub_df
+        self.__flux_positions = []
+        for m, values, rows in zip(self.layout.models, fluxes,
+                                   positions or [None] * len(fluxes)):
+            if self.stop_cycle is not None:
+                kept = values[:, 0] <= self.stop_cycle
+                values = values[kept]
+                rows = rows[kept] if rows is not None else None
+            self.__flux_positions.append(rows)
+            # the fluxes block is used as is, without copying it
+            sub_df = pd.DataFrame(values[:, 3:],
+                                  columns=list(m.reactions.REACTION_NAMES))
+            for j, col in enumerate(['cycle', 'x', 'y']):
+                sub_df.insert(j, col, values[:, j].astype(int))
+            self.fluxes_by_species[m.id] = sub_df
+        if any(rows is None for rows in self.__flux_positions):
+            self.__flux_positions = None
+
+    @property
+    def fluxes(self):
+        """ the fluxes of all models in one table, as in the flux log:
+        columns 0 to 3 are cycle, x, y and model number, followed by the
+        fluxes of that model, padded with NaN. It is built from
+        fluxes_by_species the first time it is used, with the rows in log
+        order, or in cycle order if that is not known (e.g. for results
+        read from a result_cache). It can also be set """
+        if self.__fluxes is None:
+            tables = []
+            for i, m in enumerate(self.layout.models):
+                df = self.fluxes_by_species[m.id]
+                df = pd.concat([df.iloc[:, :3],
+                                pd.DataFrame({'model': i + 1},
+                                             index=df.index),
+                                df.iloc[:, 3:]], axis=1)
+                df.columns = range(len(df.columns))
+                tables.append(df)
+            fluxes = pd.concat(tables, ignore_index=True)
+            if self.__flux_positions is not None:
+                order = np.argsort(np.concatenate(self.__flux_positions),
+                                   kind='stable')
+                fluxes = fluxes.take(order).reset_index(drop=True)
+            else:
+                fluxes = fluxes.sort_values(0, kind='mergesort',
+                                            ignore_index=True)
+            self.__fluxes = fluxes
+        return(self.__fluxes)
+
+    @fluxes.setter
+    def fluxes(self, fluxes):
+        self.__fluxes = fluxes
 
     def get_metabolite_image(self, met, cycle):
         if not self.parameters.all_params['writeMediaLog']:
             raise ValueError("media log was not recorded during simulation")
         if met not in list(self.layout.media.metabolite):
             raise NameError("met " + met + " is not in layout.media.metabolite")
-        if cycle not in list(np.unique(self.media['cycle'])):
+        if self.media is None:
+            return(self.media_cube.get(met, cycle).astype(float))
+        rows = self.__image_index('media', self.media,
+                                  ['metabolite', 'cycle']).get((met, cycle))
+        if rows is None:
             raise ValueError('media was not saved at the desired cycle. try another.')
-        im = np.zeros((self.layout.grid[0], self.layout.grid[1]))
-        aux = self.media.loc[np.logical_and(self.media['cycle'] == cycle,
-                                            self.media['metabolite'] == met)]
-        for index, row in aux.iterrows():
-            im[int(row['x']-1), int(row['y']-1)] = row['conc_mmol']
-        return(im)
+        return(self.__image(self.media, rows, 'conc_mmol'))
 
     def get_biomass_image(self, model_id, cycle):
-        if not self.parameters.all_params['writeBiomassLog']:
+        if not self.run_params()['writeBiomassLog']:
             raise ValueError("biomass log was not recorded during simulation")
         if model_id not in [m.id for m in self.layout.models]:
-            raise NameError("model " + model.id + " is not one of the model ids")
-        if cycle not in list(np.unique(self.biomass['cycle'])):
+            raise NameError("model " + model_id + " is not one of the model ids")
+        if cycle not in self.__image_index('biomass', self.biomass, 'cycle'):
             raise ValueError('biomass was not saved at the desired cycle. try another.')
-        im = np.zeros((self.layout.grid[0], self.layout.grid[1]))
-        aux = self.biomass.loc[self.biomass['cycle'] == cycle, :]
-        for index, row in aux.iterrows():
-            im[int(row['x']-1), int(row['y']-1)] = row[model_id]
-        return(im)
+        rows = self.__image_index('biomass', self.biomass,
+                                  ['species', 'cycle']).get((model_id, cycle))
+        if rows is None:
+            rows = np.array([], dtype=int)
+        return(self.__image(self.biomass, rows, 'biomass'))
 
     def get_flux_image(self, model_id, reaction_id, cycle):
         if not self.parameters.all_params['writeFluxLog']:
             raise ValueError("flux log was not recorded during simulation")
         if model_id not in [m.id for m in self.layout.models]:
-            raise NameError("model " + model.id + " is not one of the model ids")
-        im = np.zeros((self.layout.grid[0], self.layout.grid[1]))
+            raise NameError("model " + model_id + " is not one of the model ids")
         temp_fluxes = self.fluxes_by_species[model_id]
-        if cycle not in list(np.unique(temp_fluxes['cycle'])):
+        rows = self.__image_index('fluxes/' + model_id, temp_fluxes,
+                                  'cycle').get(cycle)
+        if rows is None:
             raise ValueError('flux was not saved at the desired cycle. try another.')
         if reaction_id not in list(temp_fluxes.columns):
             raise NameError("reaction_id " + reaction_id +
                             " is not a reaction in the desired model")
-        aux = temp_fluxes.loc[temp_fluxes['cycle'] == cycle, :]
-        for index, row in aux.iterrows():
-            im[int(row['x']-1), int(row['y']-1)] = row[reaction_id]
+        return(self.__image(temp_fluxes, rows, reaction_id))
+
+    def get_metabolite_cube(self, met):
+        """ returns the concentrations of met at every logged cycle, as a
+        (cycle, x, y) array, and the array of those cycles. With a
+        media_cube, the array is a memory-mapped view of it """
+        if not self.parameters.all_params['writeMediaLog']:
+            raise ValueError("media log was not recorded during simulation")
+        if met not in list(self.layout.media.metabolite):
+            raise NameError("met " + met + " is not in layout.media.metabolite")
+        if self.media is None:
+            return((self.media_cube.get(met), self.media_cube.cycles))
+        rows = np.flatnonzero(self.media['metabolite'].to_numpy() == met)
+        return(self.__cube(self.media, rows, 'conc_mmol'))
+
+    def get_biomass_cube(self, model_id):
+        """ returns the biomass of model_id at every logged cycle, as a
+        (cycle, x, y) array, and the array of those cycles """
+        if not self.run_params()['writeBiomassLog']:
+            raise ValueError("biomass log was not recorded during simulation")
+        if model_id not in [m.id for m in self.layout.models]:
+            raise NameError("model " + model_id + " is not one of the model ids")
+        cycles = np.unique(self.biomass['cycle'].to_numpy())
+        rows = np.flatnonzero(self.biomass['species'].to_numpy() == model_id)
+        return(self.__cube(self.biomass, rows, 'biomass', cycles))
+
+    def get_flux_cube(self, model_id, reaction_id):
+        """ returns the flux of reaction_id of model_id at every logged
+        cycle, as a (cycle, x, y) array, and the array of those cycles """
+        if not self.parameters.all_params['writeFluxLog']:
+            raise ValueError("flux log was not recorded during simulation")
+        if model_id not in [m.id for m in self.layout.models]:
+            raise NameError("model " + model_id + " is not one of the model ids")
+        temp_fluxes = self.fluxes_by_species[model_id]
+        if reaction_id not in list(temp_fluxes.columns):
+            raise NameError("reaction_id " + reaction_id +
+                            " is not a reaction in the desired model")
+        return(self.__cube(temp_fluxes, np.arange(len(temp_fluxes)),
+                           reaction_id))
+
+    def iter_media(self, metabolites=None, cycles=None, bbox=None,
+                   cycles_per_chunk=1):
+        """ reads the media log of a simulation run with delete_files=False
+        in chunks of cycles_per_chunk cycles, keeping only the rows of
+        metabolites, cycles=(first, last) and bbox=(x_min, x_max, y_min,
+        y_max). See iter_media_log """
+        if not self.parameters.all_params['writeMediaLog']:
+            raise ValueError("media log was not recorded during simulation")
+        return(iter_media_log(self.get_log_path('MediaLogName'), metabolites,
+                              self.__until_stop_cycles(cycles), bbox,
+                              cycles_per_chunk))
+
+    def iter_biomass(self, species=None, cycles=None, bbox=None,
+                     cycles_per_chunk=1):
+        """ reads the spatial biomass log of a simulation run with
+        delete_files=False in chunks of cycles_per_chunk cycles, keeping only
+        the rows of species, cycles=(first, last) and bbox=(x_min, x_max,
+        y_min, y_max). See iter_biomass_log """
+        if not self.run_params()['writeBiomassLog']:
+            raise ValueError("biomass log was not recorded during simulation")
+        return(iter_biomass_log(self.get_log_path('BiomassLogName'), species,
+                                self.__until_stop_cycles(cycles), bbox,
+                                cycles_per_chunk))
+
+    def iter_fluxes(self, model_id, reactions=None, cycles=None, bbox=None,
+                    cycles_per_chunk=1):
+        """ reads the fluxes of model_id from the flux log of a simulation
+        run with delete_files=False in chunks of cycles_per_chunk cycles,
+        keeping only the columns of reactions and the rows of
+        cycles=(first, last) and bbox=(x_min, x_max, y_min, y_max). See
+        iter_flux_log """
+        if not self.parameters.all_params['writeFluxLog']:
+            raise ValueError("flux log was not recorded during simulation")
+        if model_id not in [m.id for m in self.layout.models]:
+            raise NameError("model " + model_id + " is not one of the model ids")
+        i = self.layout.get_model_ids().index(model_id)
+        reaction_names = list(self.layout.models[i].reactions.REACTION_NAMES)
+        if reactions is not None:
+            for reaction_id in reactions:
+                if reaction_id not in reaction_names:
+                    raise NameError("reaction_id " + reaction_id +
+                                    " is not a reaction in the desired model")
+        return(iter_flux_log(self.get_log_path('FluxLogName'), i + 1,
+                             reaction_names, reactions,
+                             self.__until_stop_cycles(cycles), bbox,
+                             cycles_per_chunk))
+
+    def __until_stop_cycles(self, cycles):
+        ''' limits cycles=(first, last) of the iter_* methods to the cycle
+        where a stopping rule stopped the simulation, if it was stopped '''
+        if self.stop_cycle is None:
+            return(cycles)
+        if cycles is None:
+            return((0, self.stop_cycle))
+        return((cycles[0], min(cycles[1], self.stop_cycle)))
+
+    def __image_index(self, name, df, keys):
+        """ returns a dict with the row positions of df for each value of
+        keys. It is computed once for each dataframe and keys """
+        cached = self.__image_indexes.get((name, str(keys)))
+        if cached is None or cached[0] is not df:
+            cached = (df, df.groupby(keys, sort=False).indices)
+            self.__image_indexes[(name, str(keys))] = cached
+        return(cached[1])
+
+    def __image(self, df, rows, column):
+        """ returns a grid image with the values of column at rows of df """
+        im = np.zeros((self.layout.grid[0], self.layout.grid[1]))
+        x = df['x'].to_numpy()[rows].astype(int)
+        y = df['y'].to_numpy()[rows].astype(int)
+        im[x - 1, y - 1] = df[column].to_numpy()[rows]
         return(im)
-    
+
+    def __cube(self, df, rows, column, cycles=None):
+        """ returns a (cycle, x, y) array with the values of column at rows
+        of df, and its cycles (by default, those of rows) """
+        row_cycles = df['cycle'].to_numpy()[rows]
+        if cycles is None:
+            cycles = np.unique(row_cycles)
+        cube = np.zeros((len(cycles), self.layout.grid[0],
+                         self.layout.grid[1]))
+        x = df['x'].to_numpy()[rows].astype(int)
+        y = df['y'].to_numpy()[rows].astype(int)
+        cube[np.searchsorted(cycles, row_cycles), x - 1, y - 1] = \
+            df[column].to_numpy()[rows]
+        return((cube, cycles))
+
+
+def run_simulation(layout, parameters, working_dir, delete_files=True,
+                   model_store=None, stop_rules=None):
+    """ runs one comets simulation in working_dir and returns the comets
+    object with its results. It is a module-level function so that batch
+    can also send it to worker processes """
+    sim = comets(layout, parameters, working_dir, model_store=model_store)
+    sim.run(delete_files, stop_rules=stop_rules)
+    return(sim)
+
+
+class batch:
+    '''
+    Runs many COMETS simulations concurrently on a bounded pool of workers.
+    Give a list of (layout, parameters) pairs:
+
+        runs = comets.batch([(layout1, params1), (layout2, params2)],
+                            max_workers=8)
+        sims = runs.run()
+
+    run() returns the finished comets objects in the order of the
+    simulations, while as_completed() yields (index, comets) pairs as soon
+    as each simulation finishes. Every simulation runs in its own scratch
+    directory under scratch_dir (a new temporary directory by default), so
+    simulations never share files, and layouts and params objects can be
+    shared between simulations.
+
+    Each simulation is a separate java process, so a thread pool (the
+    default) is enough to use many cores. With use_processes=True the logs
+    are also parsed in separate processes. stop_rules are applied to every
+    simulation, see comets.run.
+    '''
+    def __init__(self, simulations, max_workers=None, scratch_dir=None,
+                 use_processes=False, model_store=None, stop_rules=None):
+        self.simulations = list(simulations)
+        self.max_workers = max_workers
+        self.scratch_dir = scratch_dir
+        self.use_processes = use_processes
+        self.model_store = model_store
+        self.stop_rules = stop_rules
+
+    def run(self, delete_files=True):
+        ''' runs all simulations and returns the comets objects in order '''
+        sims = [None] * len(self.simulations)
+        for i, sim in self.as_completed(delete_files):
+            sims[i] = sim
+        return(sims)
+
+    def as_completed(self, delete_files=True):
+        ''' runs all simulations, yielding (index, comets) pairs as they
+        finish. If delete_files, the scratch directories are removed '''
+        scratch_dir = self.scratch_dir
+        if scratch_dir is None:
+            scratch_dir = tempfile.mkdtemp(prefix='comets_batch_')
+
+        if self.use_processes:
+            executor = cf.ProcessPoolExecutor(self.max_workers)
+        else:
+            executor = cf.ThreadPoolExecutor(self.max_workers)
+
+        with executor:
+            futures = {}
+            for i, (lyt, parameters) in enumerate(self.simulations):
+                working_dir = os.path.join(scratch_dir, 'run_' + str(i), '')
+                future = executor.submit(run_simulation, lyt, parameters,
+                                         working_dir, delete_files,
+                                         self.model_store, self.stop_rules)
+                futures[future] = (i, working_dir)
+
+            for future in cf.as_completed(futures):
+                i, working_dir = futures[future]
+                sim = future.result()
+                if delete_files:
+                    shutil.rmtree(working_dir, ignore_errors=True)
+                yield(i, sim)
+
+        if delete_files and self.scratch_dir is None:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+class sweep:
+    '''
+    Runs a comets simulation over many values of parameters, media
+    metabolites and model kinetic values or bounds. Define the axes, make a
+    design and run it:
+
+        sw = comets.sweep(layout, params)
+        sw.add_param('timeStep', [0.05, 0.1])
+        sw.add_media('glc__D_e', [0.01, 0.1, 1.])
+        sw.add_model_value('e_coli_core', 'vmax', 'EX_glc__D_e', [5., 10.])
+        results = sw.run(sw.grid(), max_workers=8)
+
+    grid() gives every combination of the axis values, while
+    latin_hypercube(n) and sobol(n) draw n points between the lowest and
+    highest value of each axis (sobol needs scipy). Axes whose values are
+    all integers are sampled as integers. A design is a DataFrame with one
+    column per axis and one row per variant, so it can also be written by
+    hand.
+
+    Variants share models, layout and params with the base simulation,
+    except for the tables they change: params.all_params, layout.media and
+    the reactions table of a changed model are copied for each variant.
+
+    run() returns a tidy table of total biomass indexed by variant, cycle
+    and model, with the axis values as columns, and keeps the comets
+    objects in simulations.
+    '''
+    def __init__(self, layout, parameters):
+        self.layout = layout
+        self.parameters = parameters
+        self.axes = []
+        self.simulations = {}
+
+    def add_param(self, key, values, name=None):
+        ''' sweeps params.all_params[key] over values '''
+        if key not in self.parameters.all_params:
+            raise NameError("parameter " + key + " is not in params")
+        self.__add_axis(name or key, 'param', key, values)
+
+    def add_media(self, met, values, name=None):
+        ''' sweeps the initial amount of met in the media over values '''
+        self.__add_axis(name or met, 'media', met, values)
+
+    def add_model_value(self, model_id, kind, reaction, values, name=None):
+        ''' sweeps a value of a reaction of model model_id over values. kind
+        is one of 'vmax', 'km', 'hill', 'lower_bound' and 'upper_bound' '''
+        if kind not in ['vmax', 'km', 'hill', 'lower_bound', 'upper_bound']:
+            raise ValueError("kind " + kind + " is not a model value")
+        if model_id not in self.layout.get_model_ids():
+            raise NameError("model " + model_id +
+                            " is not one of the model ids")
+        model = self.layout.models[self.layout.get_model_ids().index(
+            model_id)]
+        if reaction not in model.reactions['REACTION_NAMES'].values:
+            raise NameError("reaction " + reaction +
+                            " is not a reaction in model " + model_id)
+        if name is None:
+            name = model_id + '.' + kind + '.' + reaction
+        self.__add_axis(name, 'model', (model_id, kind, reaction), values)
+
+    def __add_axis(self, name, kind, target, values):
+        if name in [axis[0] for axis in self.axes]:
+            raise ValueError("there is already an axis named " + name)
+        self.axes.append((name, kind, target, list(values)))
+
+    def grid(self):
+        ''' returns a design with every combination of the axis values '''
+        rows = list(itertools.product(*[axis[3] for axis in self.axes]))
+        return(pd.DataFrame(rows, columns=[axis[0] for axis in self.axes]))
+
+    def latin_hypercube(self, n, seed=None):
+        ''' returns a design of n variants from a latin hypercube sample '''
+        rng = np.random.default_rng(seed)
+        strata = rng.permuted(np.tile(np.arange(n), (len(self.axes), 1)),
+                              axis=1).T
+        return(self.__scaled_design((strata + rng.random(strata.shape)) /
+                                    n))
+
+    def sobol(self, n, seed=None):
+        ''' returns a design of n variants from a scrambled Sobol sequence.
+        n should be a power of 2 '''
+        from scipy.stats import qmc
+        return(self.__scaled_design(qmc.Sobol(len(self.axes),
+                                              seed=seed).random(n)))
+
+    def __scaled_design(self, u):
+        ''' scales points in the unit cube to the range of each axis '''
+        design = {}
+        for j, (name, kind, target, values) in enumerate(self.axes):
+            low, high = min(values), max(values)
+            if all(isinstance(v, (int, np.integer)) for v in values):
+                column = np.floor(low + u[:, j] * (high - low + 1))
+                design[name] = np.minimum(column, high).astype(int)
+            else:
+                design[name] = low + u[:, j] * (high - low)
+        return(pd.DataFrame(design))
+
+    def variant(self, row):
+        ''' returns the (layout, params) of one variant, given a row of a
+        design as a dict (as in design.to_dict('records'), which keeps
+        integer columns as integers) '''
+        lyt = self.layout.clone()
+        parameters = self.parameters.clone()
+        model_ids = lyt.get_model_ids()
+
+        for name, kind, target, values in self.axes:
+            value = row[name]
+            if isinstance(value, np.generic):
+                value = value.item()
+            if kind == 'param':
+                parameters.all_params[target] = value
+            elif kind == 'media':
+                lyt.set_specific_metabolite(target, value)
+            else:
+                model_id, value_kind, reaction = target
+                m = lyt.models[model_ids.index(model_id)]
+                if value_kind == 'vmax':
+                    m.change_vmax(reaction, value)
+                elif value_kind == 'km':
+                    m.change_km(reaction, value)
+                elif value_kind == 'hill':
+                    m.change_hill(reaction, value)
+                elif value_kind == 'lower_bound':
+                    m.change_bounds(reaction, value, m.get_bounds(reaction)[1])
+                else:
+                    m.change_bounds(reaction, m.get_bounds(reaction)[0], value)
+        return((lyt, parameters))
+
+    def run(self, design, max_workers=None, scratch_dir=None,
+            use_processes=False, model_store=None, stop_rules=None,
+            delete_files=True):
+        ''' runs every variant of design concurrently (see batch), and
+        returns the tidy table of results '''
+        # records keep the type of each column, e.g. integer parameters
+        variants = [self.variant(row) for row in design.to_dict('records')]
+        runs = batch(variants, max_workers, scratch_dir, use_processes,
+                     model_store, stop_rules)
+
+        self.simulations = {}
+        tables = []
+        for i, sim in runs.as_completed(delete_files):
+            variant = design.index[i]
+            self.simulations[variant] = sim
+            if not hasattr(sim, 'total_biomass'):
+                continue
+            table = sim.total_biomass.melt(id_vars='cycle', var_name='model',
+                                           value_name='biomass')
+            table.insert(0, 'variant', variant)
+            tables.append(table)
+
+        if not tables:
+            return(None)
+        results = pd.concat(tables, ignore_index=True)
+        results['cycle'] = results['cycle'].astype(int)
+        results = results.merge(design, left_on='variant', right_index=True)
+        results = results[['variant', 'cycle', 'model'] + list(design.columns)
+                          + ['biomass']]
+        results = results.set_index(['variant', 'cycle', 'model'])
+        return(results.sort_index())
+
+
 # TODO: fix read_comets_layout to always expect text addresses of comets model files
 # TODO: read spatial biomass logs
 # TODO: remove comets manifest (preferably, dont write it)
-# TODO: find quicker reading solution than the pd.read_csv stringIO hack
 # TODO: fucntions to generate predefined media, spatial layouts etc
 # TODO: write noncustom initial pop in layout
 # TODO: add barriers in layout class
@@ -2260,4 +4581,3 @@ class comets:
 # TODO: give warning when unknown parameter is set
 # TODO: write parameters in layout file
 # TODO: model biomass should be added in the layout "add_model" method, and not as a model class field
-# TODO: make a copy function for params, layout and model
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# times comets.model(cobra_model), i.e. model.load_cobra_model, which
+# builds the S matrix. Usage:
+#
+#     python test/bench_load_cobra_model.py [OLD_COMETS_PY]
+#
+# With OLD_COMETS_PY (e.g. git show a872e64:comets.py > /tmp/old.py), the
+# old version is timed too and the S matrices are compared
+
+import sys
+
+import pandas as pd
+from cobra.io import load_model
+
+from bench_models import load_comets, synth_model, timed
+
+versions = [('new', load_comets())]
+if len(sys.argv) > 1:
+    versions.append(('old', load_comets(sys.argv[1], 'old_comets')))
+
+for cobra_model in [load_model('textbook'), synth_model()]:
+    smats = []
+    for name, comets in versions:
+        seconds, m = timed(lambda: comets.model(cobra_model),
+                           repeat=1 if name == 'old' else 3)
+        smats.append(m.smat)
+        print('%-12s %-4s %8.3f s' % (cobra_model.id, name, seconds))
+    if len(smats) > 1:
+        pd.testing.assert_frame_equal(smats[0], smats[1])
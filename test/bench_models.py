@@ -0,0 +1,61 @@
+# helpers shared by the benchmark scripts in this directory
+
+import importlib.util
+import os
+import random
+import time
+
+import cobra
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_comets(path=None, name='comets'):
+    """ imports comets.py from path, by default the one of this checkout.
+    Give the path of an older comets.py (e.g. from git show REV:comets.py)
+    to compare against it """
+    if path is None:
+        path = os.path.join(HERE, '..', 'comets.py')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return(module)
+
+
+def synth_model(n_rxn=10000, n_met=3000, n_ext=200, seed=0):
+    """ a random cobra model with n_rxn internal reactions over n_met
+    metabolites, plus n_ext exchange reactions """
+    random.seed(seed)
+    m = cobra.Model('synth')
+    mets = [cobra.Metabolite('m%d_c' % i, compartment='c')
+            for i in range(n_met)]
+    ext = [cobra.Metabolite('e%d_e' % i, compartment='e')
+           for i in range(n_ext)]
+    m.add_metabolites(mets + ext)
+    rxns = []
+    for i in range(n_rxn):
+        r = cobra.Reaction('R%d' % i, lower_bound=-1000 if i % 3 else 0,
+                           upper_bound=1000)
+        r.add_metabolites({met: random.choice([-1, 1, -2, 0.5, 1.25])
+                           for met in random.sample(mets,
+                                                    random.randint(2, 6))})
+        rxns.append(r)
+    for i, e in enumerate(ext):
+        r = cobra.Reaction('EX_e%d_e' % i, lower_bound=-10,
+                           upper_bound=1000)
+        r.add_metabolites({e: -1})
+        rxns.append(r)
+    m.add_reactions(rxns)
+    m.objective = 'R0'
+    return(m)
+
+
+def timed(f, repeat=3):
+    """ returns the best wall time of repeat calls of f, and its result """
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        result = f()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return(best, result)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# times reading comets model files (model.read_comets_model), for models
+# written by write_comets_model. Usage:
+#
+#     python test/bench_read_comets_model.py [OLD_COMETS_PY]
+#
+# With OLD_COMETS_PY, the old version reads the same files, and the parsed
+# tables are compared
+
+import sys
+import tempfile
+
+import pandas as pd
+from cobra.io import load_model
+
+from bench_models import load_comets, synth_model, timed
+
+versions = [('new', load_comets())]
+if len(sys.argv) > 1:
+    versions.append(('old', load_comets(sys.argv[1], 'old_comets')))
+
+directory = tempfile.mkdtemp() + '/'
+for cobra_model in [load_model('textbook'), synth_model()]:
+    m = versions[0][1].model(cobra_model)
+    m.write_comets_model(directory)
+    path = directory + m.id + '.cmd'
+    read = []
+    for name, comets in versions:
+        # no model cache, so that the file is parsed every time
+        seconds, read_model = timed(lambda: comets.model(path))
+        read.append(read_model)
+        print('%-12s %-4s %8.3f s' % (m.id, name, seconds))
+    if len(read) > 1:
+        for table in ['smat', 'reactions', 'metabolites']:
+            pd.testing.assert_frame_equal(getattr(read[0], table),
+                                          getattr(read[1], table),
+                                          check_dtype=False)
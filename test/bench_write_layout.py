@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# times setting local media in every cell of a 256x256 grid, and local
+# refresh/static values in a third of the cells, reading the exchanged mets
+# of the layout at each cell, and then layout.write_layout. Usage:
+#
+#     python test/bench_write_layout.py [OLD_COMETS_PY]
+#
+# With OLD_COMETS_PY, the old version writes the same layout, and the
+# numbers in the two files are compared as values, so that 2 and 2.0
+# are equal
+
+import contextlib
+import io
+import sys
+import tempfile
+
+from cobra.io import load_model
+
+from bench_models import load_comets, synth_model, timed
+
+SIZE = 256
+
+versions = [('new', load_comets())]
+if len(sys.argv) > 1:
+    versions.append(('old', load_comets(sys.argv[1], 'old_comets')))
+
+
+def make_layout(comets, cobra_model):
+    m = comets.model(cobra_model)
+    layout = comets.layout([m])
+    layout.grid = [SIZE, SIZE]
+    for x in range(SIZE):
+        for y in range(SIZE):
+            n = x * SIZE + y
+            mets = layout.all_exchanged_mets
+            layout.set_specific_metabolite_at_location(
+                mets[n % len(mets)], (x, y), 1 + n % 7)
+            if n % 3 == 0:
+                layout.set_specific_refresh_at_location(
+                    mets[n % len(mets)], (x, y), 0.5)
+                layout.set_specific_static_at_location(
+                    mets[(n + 1) % len(mets)], (x, y), 2.)
+    return layout
+
+
+def tokens(path):
+    def number(token):
+        try:
+            return float(token)
+        except ValueError:
+            return token
+    with open(path) as f:
+        return [number(token) for token in f.read().split()]
+
+
+for name, cobra_model in [('textbook', load_model('textbook')),
+                          ('synth', synth_model())]:
+    directory = tempfile.mkdtemp() + '/'
+    written = []
+    for version, comets in versions:
+        with contextlib.redirect_stdout(io.StringIO()):
+            set_seconds, layout = timed(lambda: make_layout(comets,
+                                                            cobra_model))
+            seconds, _ = timed(lambda: layout.write_layout(directory))
+        written.append(tokens(directory + '.current_layout'))
+        print('%-9s %4d mets %-4s set %8.3f s  write %8.3f s'
+              % (name, len(layout.all_exchanged_mets), version, set_seconds,
+                 seconds))
+    if len(written) > 1:
+        assert written[0] == written[1]
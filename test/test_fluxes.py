@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# checks that the fluxes read from a synthetic flux log, with the rows of
+# two models interleaved, come back in log order, that comets.fluxes can be
+# set, and that a row with the wrong number of fluxes is reported. Needs
+# no COMETS install
+
+import os
+import sys
+import tempfile
+
+import cobra
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+
+def make_sim(tmp):
+    os.environ.setdefault('GUROBI_HOME', tmp)
+    os.environ.setdefault('COMETS_HOME', tmp)
+    m1 = comets.model(cobra.io.load_model('textbook'))
+    m1.id = 'a'
+    m2 = comets.model(cobra.io.load_model('textbook'))
+    m2.id = 'b'
+    m2.reactions = m2.reactions.iloc[:10].copy()
+    lyt = comets.layout([m1, m2])
+    lyt.grid = [2, 2]
+    p = comets.params()
+    p.all_params['writeFluxLog'] = True
+    p.all_params['writeTotalBiomassLog'] = False
+    sim = comets.comets(lyt, p, working_dir=os.path.join(tmp, 'run') + '/')
+    sim.write_run_files()
+    return(sim)
+
+
+def write_flux_log(sim, n_cycles=3):
+    ''' writes a flux log where the models alternate from one location to
+    the next, and returns it as read by pd.read_csv '''
+    rng = np.random.default_rng(0)
+    n_reactions = [len(m.reactions) for m in sim.layout.models]
+    path = sim.get_log_path('FluxLogName')
+    with open(path, 'w') as f:
+        for cycle in range(1, n_cycles + 1):
+            for x, y, model in [(1, 1, 1), (1, 1, 2), (2, 1, 2), (1, 2, 1)]:
+                fluxes = rng.integers(-5, 5, n_reactions[model - 1])
+                f.write(' '.join(str(v) for v in
+                                 [cycle, x, y, model] + list(fluxes)) + '\n')
+    return(pd.read_csv(path, delim_whitespace=True, header=None,
+                       names=range(4 + max(n_reactions))))
+
+
+def test_fluxes_in_log_order():
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = make_sim(tmp)
+        log = write_flux_log(sim)
+        sim.read_run_output(delete_files=False)
+        pd.testing.assert_frame_equal(sim.fluxes, log, check_dtype=False)
+        # built once
+        assert sim.fluxes is sim.fluxes
+        assert list(sim.fluxes_by_species['b'].columns[3:]) == \
+            list(sim.layout.models[1].reactions.REACTION_NAMES)
+
+
+def test_set_fluxes():
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = make_sim(tmp)
+        log = write_flux_log(sim)
+        sim.fluxes = log.iloc[:4]
+        sim.build_readable_flux_object()
+        assert len(sim.fluxes) == 4
+        assert len(sim.fluxes_by_species['a']) == 2
+        assert len(sim.fluxes_by_species['b']) == 2
+
+
+def test_corrupt_flux_line():
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = make_sim(tmp)
+        write_flux_log(sim)
+        with open(sim.get_log_path('FluxLogName'), 'a') as f:
+            f.write('4 1 1 2 0.5\n')
+        with pytest.raises(comets.CorruptLine):
+            sim.read_run_output(delete_files=False)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# checks the media table of comets.layout: the setters add and change rows
+# through the metabolite index, reading layout.media leaves the layout as it
+# is, and changes made to the table in place are followed. Needs no COMETS
+# install
+
+import os
+import pickle
+import sys
+
+import cobra
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+
+@pytest.fixture
+def lyt(tmp_path):
+    os.environ.setdefault('GUROBI_HOME', str(tmp_path))
+    os.environ.setdefault('COMETS_HOME', str(tmp_path))
+    return(comets.layout([comets.model(cobra.io.load_model('textbook'))]))
+
+
+def amounts(lyt):
+    return(dict(zip(lyt.media['metabolite'], lyt.media['init_amount'])))
+
+
+def test_setters_add_rows(lyt):
+    n = len(lyt.media)
+    lyt.set_specific_metabolite('glc__D_e', 10.)
+    lyt.set_specific_metabolites({'o2_e': 5., 'new1_e': 1., 'new2_e': 2.})
+    lyt.set_specific_static('new1_e', 3.)
+    assert len(lyt.media) == n + 2
+    assert amounts(lyt)['glc__D_e'] == 10.
+    assert amounts(lyt)['new2_e'] == 2.
+    row = lyt.media.loc[lyt.media['metabolite'] == 'new1_e'].iloc[0]
+    assert (row['g_static'], row['g_static_val']) == (1, 3.)
+
+
+def test_reading_media_changes_nothing(lyt):
+    lyt.set_specific_metabolite('new_e', 1.)
+    state = dict(lyt.__dict__)
+    assert lyt.media is lyt.media
+    assert lyt.all_exchanged_mets is lyt.all_exchanged_mets
+    pickle.dumps(lyt)
+    assert lyt.__dict__ == state
+
+
+def test_changes_in_place_are_followed(lyt):
+    lyt.set_specific_metabolite('glc__D_e', 10.)
+    # rows renamed and reordered without changing the length
+    i = lyt.media.index[lyt.media['metabolite'] == 'o2_e'][0]
+    lyt.media.loc[i, 'metabolite'] = 'o2_renamed_e'
+    lyt.media.sort_values('metabolite', ascending=False, inplace=True)
+    lyt.set_specific_metabolites({'glc__D_e': 7., 'o2_renamed_e': 4.})
+    assert amounts(lyt)['glc__D_e'] == 7.
+    assert amounts(lyt)['o2_renamed_e'] == 4.
+    assert 'o2_e' not in amounts(lyt)
+
+
+def test_exchanged_mets_changed_in_place(lyt):
+    lyt.set_specific_metabolite_at_location('glc__D_e', (0, 0), 1.)
+    lyt.all_exchanged_mets.append('zz_e')
+    lyt.set_specific_metabolite_at_location('zz_e', (0, 0), 1.)
+    lyt.all_exchanged_mets[-1] = 'zy_e'
+    lyt.set_specific_metabolite_at_location('zy_e', (0, 0), 1.)
+    with pytest.raises(Exception):
+        lyt.set_specific_metabolite_at_location('zz_e', (0, 0), 1.)
+
+
+def test_copies_keep_media(lyt):
+    lyt.set_specific_metabolite('new_e', 1.)
+    for other in [pickle.loads(pickle.dumps(lyt)), lyt.clone()]:
+        other.set_specific_metabolite('new_e', 2.)
+        other.set_specific_metabolite('other_e', 3.)
+        assert amounts(other)['new_e'] == 2.
+        assert amounts(lyt)['new_e'] == 1.
+        assert 'other_e' not in amounts(lyt)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
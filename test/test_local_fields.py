@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# checks the local media, refresh and static values of comets.layout: set
+# by location or as a field, changed in place through layout.local_media
+# and the like, shared by clones until changed, and written as the dicts
+# of locations and met amounts they used to be were written. Needs no
+# COMETS install
+
+import os
+import sys
+
+import cobra
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+
+@pytest.fixture
+def lyt(tmp_path):
+    os.environ.setdefault('GUROBI_HOME', str(tmp_path))
+    os.environ.setdefault('COMETS_HOME', str(tmp_path))
+    lyt = comets.layout([comets.model(cobra.io.load_model('textbook'))])
+    lyt.grid = [4, 3]
+    return(lyt)
+
+
+def written_block(lyt, directory, start):
+    ''' returns the lines of the local block of the written layout that
+    starts with the line start, as tuples of numbers '''
+    lyt.write_layout(str(directory) + '/')
+    with open(os.path.join(directory, '.current_layout')) as f:
+        lines = f.read().splitlines()
+    i = [line.split()[0] if line.strip() else ''
+         for line in lines].index(start) + 1
+    block = []
+    while lines[i].strip() != '//':
+        block.append(tuple(float(token) for token in lines[i].split()))
+        i += 1
+    return(sorted(block))
+
+
+def dict_block(located, mets, static=False):
+    ''' the lines of a local block, as they were written from a dict with
+    locations as keys and dicts of met amounts as values '''
+    block = []
+    for (x, y), amounts in located.items():
+        line = [x, y]
+        for met in mets:
+            if static:
+                line.append(1 if met in amounts else 0)
+            line.append(amounts.get(met, 0))
+        block.append(tuple(float(v) for v in line))
+    return(sorted(block))
+
+
+def test_set_by_location_and_field(lyt):
+    lyt.set_specific_metabolite_at_location('glc__D_e', (0, 1), 5.)
+    lyt.set_specific_metabolite_at_location('o2_e', (0, 1), 2)
+    field = np.full((4, 3), np.nan)
+    field[1:3, 2] = [1., 3.]
+    field[0, 1] = 7.
+    lyt.set_specific_metabolite_field('glc__D_e', field)
+    assert lyt.local_media.to_dict() == {
+        (0, 1): {'glc__D_e': 7., 'o2_e': 2.},
+        (1, 2): {'glc__D_e': 1.},
+        (2, 2): {'glc__D_e': 3.}}
+    # NaN leaves a location as it is
+    lyt.set_specific_metabolite_field('o2_e', np.full((2, 2), np.nan))
+    assert lyt.local_media[(0, 1)]['o2_e'] == 2.
+    with pytest.raises(ValueError):
+        lyt.set_specific_metabolite_field('o2_e', np.zeros((5, 1)))
+
+
+def test_changes_in_place(lyt):
+    lyt.set_specific_metabolite_at_location('glc__D_e', (0, 1), 5.)
+    media = lyt.local_media
+    media[(0, 1)]['o2_e'] = 1.
+    media[(3, 2)] = {'glc__D_e': 4.}
+    media[(0, 1)]['glc__D_e'] += 1
+    del media[(0, 1)]['o2_e']
+    assert media == {(0, 1): {'glc__D_e': 6.}, (3, 2): {'glc__D_e': 4.}}
+    assert lyt.local_media.to_dict() == media
+    # a location replaced by assignment only has the given amounts
+    media[(0, 1)] = {'o2_e': 2.}
+    assert dict(lyt.local_media[(0, 1)]) == {'o2_e': 2.}
+    del media[(3, 2)]
+    assert list(lyt.local_media) == [(0, 1)]
+    with pytest.raises(KeyError):
+        lyt.local_media[(3, 2)]
+    with pytest.raises(KeyError):
+        del lyt.local_media[(0, 1)]['glc__D_e']
+
+    lyt.local_refresh.setdefault((1, 1), {})['o2_e'] = 0.5
+    assert lyt.local_refresh.to_dict() == {(1, 1): {'o2_e': 0.5}}
+    lyt.local_static = {(2, 0): {'o2_e': 1.5}}
+    assert lyt.local_static[(2, 0)]['o2_e'] == 1.5
+
+
+def test_clone_copies_on_write(lyt):
+    lyt.set_specific_metabolite_at_location('glc__D_e', (0, 1), 5.)
+    lyt.set_specific_static_at_location('o2_e', (1, 1), 2.)
+    other = lyt.clone()
+    # the arrays are shared until either layout changes them
+    assert other.local_media.amounts['glc__D_e'] is \
+        lyt.local_media.amounts['glc__D_e']
+
+    other.set_specific_metabolite_at_location('glc__D_e', (0, 1), 1.)
+    other.local_media[(2, 2)] = {'o2_e': 3.}
+    lyt.local_static[(1, 1)]['o2_e'] = 4.
+    assert lyt.local_media.to_dict() == {(0, 1): {'glc__D_e': 5.}}
+    assert other.local_media.to_dict() == {(0, 1): {'glc__D_e': 1.},
+                                           (2, 2): {'o2_e': 3.}}
+    assert other.local_static.to_dict() == {(1, 1): {'o2_e': 2.}}
+    assert lyt.local_static.to_dict() == {(1, 1): {'o2_e': 4.}}
+
+
+def test_written_as_dicts(lyt, tmp_path):
+    located = {'media': {}, 'refresh': {}, 'static': {}}
+    rng = np.random.default_rng(0)
+    mets = lyt.all_exchanged_mets
+    # locations set out of order, some twice
+    for n, (x, y) in enumerate(rng.integers(0, [4, 3], size=(30, 2))):
+        x, y = int(x), int(y)
+        met = mets[n % len(mets)]
+        amount = [1, 2.5, 0.125, 3.][n % 4]
+        lyt.set_specific_metabolite_at_location(met, (x, y), amount)
+        located['media'].setdefault((x, y), {})[met] = amount
+        if n % 3 == 0:
+            lyt.set_specific_refresh_at_location(met, (x, y), amount)
+            located['refresh'].setdefault((x, y), {})[met] = amount
+            lyt.set_specific_static_at_location(met, (y, x), amount)
+            located['static'].setdefault((y, x), {})[met] = amount
+
+    assert written_block(lyt, tmp_path, 'media') == \
+        dict_block(located['media'], mets)
+    assert written_block(lyt, tmp_path, 'media_refresh') == \
+        dict_block(located['refresh'], mets)
+    assert written_block(lyt, tmp_path, 'static_media') == \
+        dict_block(located['static'], mets, static=True)
+    for kind, field in [('media', lyt.local_media),
+                        ('refresh', lyt.local_refresh),
+                        ('static', lyt.local_static)]:
+        assert field == located[kind]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# checks the chunked log readers on synthetic media, biomass and flux logs:
+# their rows match the whole log read with pandas, only blocks near the
+# cycles asked for are read, and comets.iter_* stop at the cycle where a
+# stopping rule stopped the run. Needs no COMETS install
+
+import os
+import sys
+import tempfile
+
+import cobra
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+N_CYCLES = 40
+METS = ['glc__D_e', 'o2_e', 'nh4_e']
+
+
+def write_logs(directory, n_reactions=(3, 5)):
+    ''' writes media, biomass and flux logs on a 3x2 grid, and returns their
+    paths '''
+    rng = np.random.default_rng(0)
+    paths = {name: os.path.join(directory, name)
+             for name in ['media', 'biomass', 'fluxes']}
+    with open(paths['media'], 'w') as media, \
+            open(paths['biomass'], 'w') as biomass, \
+            open(paths['fluxes'], 'w') as fluxes:
+        for cycle in range(N_CYCLES + 1):
+            for x in range(1, 4):
+                for y in range(1, 3):
+                    for met in METS:
+                        media.write('%s %d %d %d %.4f\n' %
+                                    (met, cycle, x, y, rng.random()))
+                    for i, n in enumerate(n_reactions):
+                        biomass.write('%d\t%d\t%d\tm%d\t%.4f\n' %
+                                      (cycle, x, y, i + 1, rng.random()))
+                        fluxes.write(' '.join(
+                            [str(cycle), str(x), str(y), str(i + 1)] +
+                            ['%.3f' % v for v in rng.random(n)]) + '\n')
+    return(paths)
+
+
+def window(df, cycles, bbox):
+    keep = ((df['cycle'] >= cycles[0]) & (df['cycle'] <= cycles[1]) &
+            (df['x'] >= bbox[0]) & (df['x'] <= bbox[1]) &
+            (df['y'] >= bbox[2]) & (df['y'] <= bbox[3]))
+    return(df.loc[keep].reset_index(drop=True))
+
+
+@pytest.mark.parametrize('block_size', [200, 1 << 22])
+def test_iter_logs_match_pandas(block_size):
+    cycles = (12, 30)
+    bbox = (2, 3, 1, 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_logs(tmp)
+
+        media = pd.read_csv(paths['media'], delim_whitespace=True,
+                            names=['metabolite', 'cycle', 'x', 'y',
+                                   'conc_mmol'])
+        media = window(media.loc[media['metabolite'].isin(METS[:2])],
+                       cycles, bbox)
+        chunks = list(comets.iter_media_log(paths['media'], METS[:2], cycles,
+                                            bbox, 2, block_size))
+        assert len(chunks) == 10
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True),
+                                      media)
+
+        biomass = pd.read_csv(paths['biomass'], delimiter=r'\s+',
+                              names=['cycle', 'x', 'y', 'species',
+                                     'biomass'])
+        biomass = window(biomass.loc[biomass['species'] == 'm2'], cycles,
+                         bbox)
+        chunks = comets.iter_biomass_log(paths['biomass'], ['m2'], cycles,
+                                         bbox, 1, block_size)
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True),
+                                      biomass)
+
+        fluxes = pd.read_csv(paths['fluxes'], delim_whitespace=True,
+                             names=range(9))
+        fluxes = fluxes.loc[fluxes[3] == 2].drop(columns=3)
+        fluxes.columns = ['cycle', 'x', 'y', 'a', 'b', 'c', 'd', 'e']
+        fluxes = window(fluxes, cycles, bbox)[['cycle', 'x', 'y', 'b', 'e']]
+        chunks = comets.iter_flux_log(paths['fluxes'], 2,
+                                      ['a', 'b', 'c', 'd', 'e'], ['b', 'e'],
+                                      cycles, bbox, 1, block_size)
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True),
+                                      fluxes)
+
+
+def test_blocks_out_of_range_are_not_read():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_logs(tmp)['media']
+        blocks = list(comets.read_log_blocks(path, 1, (30, 31), 1000))
+        text = ''.join(blocks)
+        # every line is whole, and only a few blocks around 30-31 are read
+        assert text.endswith('\n')
+        assert all(len(line.split()) == 5 for line in text.splitlines())
+        assert len(text) < 6000 < os.path.getsize(path)
+        cycles = [int(line.split()[1]) for line in text.splitlines()]
+        assert min(cycles) <= 30 and max(cycles) >= 31
+
+
+def test_iter_stops_at_stop_cycle():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault('GUROBI_HOME', tmp)
+        os.environ.setdefault('COMETS_HOME', tmp)
+        m = comets.model(cobra.io.load_model('textbook'))
+        p = comets.params()
+        p.all_params['writeMediaLog'] = True
+        sim = comets.comets(comets.layout([m]), p, working_dir=tmp + '/')
+        paths = write_logs(tmp)
+        os.replace(paths['media'], sim.get_log_path('MediaLogName'))
+        sim.stop_cycle = 15
+
+        cycles = pd.concat(sim.iter_media(), ignore_index=True)['cycle']
+        assert cycles.max() == 15
+        cycles = pd.concat(sim.iter_media(cycles=(10, 30)),
+                           ignore_index=True)['cycle']
+        assert (cycles.min(), cycles.max()) == (10, 15)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
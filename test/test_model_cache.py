@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# checks that a damaged model cache entry counts as a miss, and that
+# comets.model rejects inputs that are neither cobra models nor paths
+
+import os
+import sys
+import tempfile
+
+import cobra
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+
+def write_model(directory):
+    m = comets.model(cobra.io.load_model('textbook'))
+    m.write_comets_model(directory + '/')
+    return(os.path.join(directory, m.id + '.cmd'))
+
+
+@pytest.mark.parametrize('damage', [b'PK\x03\x04 not a zip file', None])
+def test_damaged_entry_is_a_miss(damage):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_model(tmp)
+        cache = comets.model_cache(os.path.join(tmp, 'cache'))
+        cached = comets.model(path, cache=cache)
+        entry = cache.entry_path(path)
+        with open(entry, 'rb') as f:
+            content = f.read()
+        with open(entry, 'wb') as f:
+            # garbage, or a zip file cut short
+            f.write(damage if damage is not None
+                    else content[:len(content) // 2])
+
+        m = comets.model(path, cache=cache)
+        pd.testing.assert_frame_equal(m.smat, cached.smat)
+        # the entry was written again
+        assert cache.load(path, comets.model())
+
+
+def test_damaged_result_entry_is_a_miss():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = comets.result_cache(tmp)
+        with open(cache.entry_path('abc'), 'wb') as f:
+            f.write(b'PK\x03\x04 not a zip file')
+        assert cache.load('abc') is None
+
+
+def test_unsupported_model_input():
+    with pytest.raises(TypeError):
+        comets.model(42)
+
+
+if __name__ == '__main__':
+    test_damaged_entry_is_a_miss(b'PK\x03\x04 not a zip file')
+    test_damaged_entry_is_a_miss(None)
+    test_damaged_result_entry_is_a_miss()
+    test_unsupported_model_input()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# checks that a cached result is not reused for a simulation whose model
+# was renamed, since results are keyed by model id, and that the result
+# cache evicts its least recently used entries. Needs no COMETS install:
+# only the run files are written
+
+import os
+import sys
+import tempfile
+
+import cobra
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+
+def test_renamed_model_misses_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault('GUROBI_HOME', tmp)
+        os.environ.setdefault('COMETS_HOME', tmp)
+        m = comets.model(cobra.io.load_model('textbook'))
+        m.id = 'ecoli'
+        m.initial_pop = [0, 0, 1e-5]
+        sim = comets.comets(comets.layout([m]), comets.params(),
+                            working_dir=os.path.join(tmp, 'run') + '/')
+        cache = comets.result_cache(os.path.join(tmp, 'cache'))
+
+        sim.write_run_files()
+        fingerprint = sim.get_fingerprint()
+        cache.save(fingerprint, {}, {'run_output': ''})
+        assert cache.load(fingerprint) is not None
+
+        m.id = 'renamed'
+        sim.write_run_files()
+        renamed = sim.get_fingerprint()
+        assert renamed != fingerprint
+        assert cache.load(renamed) is None
+
+
+def test_result_cache_eviction():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = comets.result_cache(tmp)
+        assert isinstance(cache, comets.npz_cache)
+        assert not isinstance(cache, comets.model_cache)
+        frames = {'total_biomass': pd.DataFrame({'cycle': range(100),
+                                                 'ecoli': 1.})}
+        cache.save('old', frames, {})
+        os.utime(cache.entry_path('old'), (0, 0))
+        cache.max_size = cache.size() * 1.5
+        cache.save('new', frames, {})
+        assert cache.load('old') is None
+        loaded, attributes = cache.load('new')
+        pd.testing.assert_frame_equal(loaded['total_biomass'],
+                                      frames['total_biomass'])
+        cache.invalidate('new')
+        assert cache.size() == 0
+
+
+if __name__ == '__main__':
+    test_renamed_model_misses_cache()
+    test_result_cache_eviction()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# checks that writing the run files of an evolution simulation does not
+# change the params object, which many simulations may share. Needs no
+# COMETS install: only the run files are written
+
+import os
+import sys
+import tempfile
+
+import cobra
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+
+def test_evolution_does_not_change_shared_params():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault('GUROBI_HOME', tmp)
+        os.environ.setdefault('COMETS_HOME', tmp)
+        m = comets.model(cobra.io.load_model('textbook'))
+        m.initial_pop = [0, 0, 1e-5]
+        p = comets.params()
+        p.all_params['evolution'] = True
+        shared = dict(p.all_params)
+        sim = comets.comets(comets.layout([m]), p,
+                            working_dir=os.path.join(tmp, 'run') + '/')
+
+        sim.write_run_files()
+        assert p.all_params == shared
+        assert not sim.run_params()['writeTotalBiomassLog']
+        assert sim.run_params()['writeBiomassLog']
+        with open(sim.working_dir + '.current_global') as f:
+            written = f.read()
+        assert 'writeTotalBiomassLog = false' in written
+        assert 'writeBiomassLog = true' in written
+
+
+if __name__ == '__main__':
+    test_evolution_does_not_change_shared_params()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# checks that results saved with comets.save_results come back the same
+# from comets.load_results, with the media either as a table or as a media
+# cube. Needs a Parquet engine (pyarrow) but no COMETS install: the logs
+# are written here
+
+import os
+import sys
+import tempfile
+
+import cobra
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+pytest.importorskip('pyarrow')
+
+N_CYCLES = 5
+
+
+def make_sim(tmp, media_cube_dir=None):
+    os.environ.setdefault('GUROBI_HOME', tmp)
+    os.environ.setdefault('COMETS_HOME', tmp)
+    m = comets.model(cobra.io.load_model('textbook'))
+    m.id = 'ecoli'
+    m.initial_pop = [0, 0, 1e-5]
+    lyt = comets.layout([m])
+    lyt.grid = [2, 2]
+    lyt.set_specific_metabolite('glc__D_e', 10.)
+    p = comets.params()
+    p.all_params['writeMediaLog'] = True
+    p.all_params['writeFluxLog'] = True
+    sim = comets.comets(lyt, p, working_dir=os.path.join(tmp, 'run') + '/',
+                        media_cube_dir=media_cube_dir)
+    sim.write_run_files()
+    return(sim)
+
+
+def write_logs(sim):
+    rng = np.random.default_rng(0)
+    n_reactions = len(sim.layout.models[0].reactions)
+    with open(sim.get_log_path('TotalBiomassLogName'), 'w') as f:
+        for cycle in range(N_CYCLES + 1):
+            f.write(str(cycle) + '\t' + str(cycle / 10) + '\n')
+    with open(sim.get_log_path('MediaLogName'), 'w') as media, \
+            open(sim.get_log_path('FluxLogName'), 'w') as fluxes:
+        for cycle in range(N_CYCLES + 1):
+            for x in [1, 2]:
+                for y in [1, 2]:
+                    for met in ['glc__D_e', 'o2_e']:
+                        media.write(' '.join([met, str(cycle), str(x),
+                                              str(y), str(rng.random())]) +
+                                    '\n')
+                    fluxes.write(' '.join(
+                        [str(cycle), str(x), str(y), '1'] +
+                        [str(v) for v in rng.random(n_reactions)]) + '\n')
+
+
+def test_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = make_sim(tmp)
+        write_logs(sim)
+        sim.read_run_output(delete_files=False)
+        sim.save_results(os.path.join(tmp, 'saved'))
+
+        res = comets.load_results(os.path.join(tmp, 'saved'))
+        assert sorted(res.tables) == ['media', 'total_biomass']
+        pd.testing.assert_frame_equal(res.total_biomass, sim.total_biomass)
+        pd.testing.assert_frame_equal(res.media, sim.media,
+                                      check_categorical=False,
+                                      check_dtype=False)
+        pd.testing.assert_frame_equal(res.fluxes_by_species['ecoli'],
+                                      sim.fluxes_by_species['ecoli'])
+        glc = res.read('media', columns=['cycle', 'conc_mmol'],
+                       filters=[('metabolite', '==', 'glc__D_e')])
+        assert len(glc) == 4 * (N_CYCLES + 1)
+        ex = res.read_fluxes('ecoli', reactions=['EX_glc__D_e'])
+        assert list(ex.columns) == ['cycle', 'x', 'y', 'EX_glc__D_e']
+        assert res.grid == [2, 2]
+        assert res.model_ids == ['ecoli']
+        assert not hasattr(res, 'media_cube')
+
+
+def test_round_trip_media_cube():
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = make_sim(tmp, os.path.join(tmp, 'cube'))
+        write_logs(sim)
+        sim.read_run_output(delete_files=False)
+        assert sim.media is None
+        sim.save_results(os.path.join(tmp, 'saved'))
+
+        res = comets.load_results(os.path.join(tmp, 'saved'))
+        assert 'media' not in res.tables
+        assert res.media_cube.metabolites == sim.media_cube.metabolites
+        np.testing.assert_array_equal(res.media_cube.cycles,
+                                      sim.media_cube.cycles)
+        np.testing.assert_array_equal(res.media_cube.get('o2_e'),
+                                      sim.media_cube.get('o2_e'))
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
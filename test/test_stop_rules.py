@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# checks the stopping rules of comets.run on synthetic total biomass and
+# media logs: the reason and cycle they stop at, and that the results are
+# cut at that cycle. Needs no COMETS install: the logs are written here and
+# followed while a short-lived process stands in for java
+
+import os
+import subprocess as sp
+import sys
+import tempfile
+
+import cobra
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import comets
+
+N_CYCLES = 30
+
+
+def make_sim(tmp):
+    os.environ.setdefault('GUROBI_HOME', tmp)
+    os.environ.setdefault('COMETS_HOME', tmp)
+    m = comets.model(cobra.io.load_model('textbook'))
+    m.id = 'ecoli'
+    m.initial_pop = [0, 0, 1e-5]
+    lyt = comets.layout([m])
+    lyt.grid = [2, 2]
+    lyt.set_specific_metabolite('glc__D_e', 10.)
+    p = comets.params()
+    p.all_params['writeMediaLog'] = True
+    p.all_params['MediaLogRate'] = 1
+    sim = comets.comets(lyt, p, working_dir=os.path.join(tmp, 'run') + '/')
+    sim.write_run_files()
+    return(sim)
+
+
+def write_logs(sim):
+    ''' biomass grows to 1 and then stays there from cycle 10 on, and the
+    glucose in the grid drops by 0.5 per cycle until it runs out at cycle
+    20 '''
+    with open(sim.get_log_path('TotalBiomassLogName'), 'w') as f:
+        for cycle in range(N_CYCLES + 1):
+            f.write(str(cycle) + '\t' + str(min(cycle, 10) / 10) + '\n')
+    with open(sim.get_log_path('MediaLogName'), 'w') as f:
+        for cycle in range(N_CYCLES + 1):
+            glc = max(10. - 0.5 * cycle, 0.)
+            for x in [1, 2]:
+                for y in [1, 2]:
+                    f.write('glc__D_e ' + str(cycle) + ' ' + str(x) + ' ' +
+                            str(y) + ' ' + str(glc / 4) + '\n')
+
+
+def follow(sim, rule):
+    ''' follows the logs as run() does while a process runs '''
+    write_logs(sim)
+    p = sp.Popen([sys.executable, '-c', 'pass'], stdout=sp.PIPE,
+                 stderr=sp.STDOUT)
+    if hasattr(rule, 'check'):
+        rule.check(sim)
+    sim._comets__monitor(p, None, (), 0.05, [rule])
+    sim.read_run_output(delete_files=False)
+
+
+@pytest.mark.parametrize('rule, reason, cycle', [
+    (comets.stop_on_plateau(1e-6, 3),
+     'relative growth below 1e-06 for 3 cycles', 13),
+    (comets.stop_on_biomass(0.5, 'ecoli'), 'biomass reached 0.5', 5),
+    (comets.stop_on_biomass(0.7), 'biomass reached 0.7', 7),
+    (comets.stop_on_depletion('glc__D_e'), 'glc__D_e depleted', 20),
+    (comets.stop_on_depletion('glc__D_e', 2.), 'glc__D_e depleted', 16)])
+def test_rule_stops_and_cuts_results(rule, reason, cycle):
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = make_sim(tmp)
+        follow(sim, rule)
+        assert sim.stop_reason == reason
+        assert sim.stop_cycle == cycle
+        assert sim.total_biomass['cycle'].max() == cycle
+        assert sim.media['cycle'].max() == cycle
+        assert len(sim.total_biomass) == cycle + 1
+
+
+def test_rule_that_never_stops():
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = make_sim(tmp)
+        follow(sim, comets.stop_on_biomass(2.))
+        assert sim.stop_reason is None
+        assert sim.stop_cycle is None
+        assert sim.total_biomass['cycle'].max() == N_CYCLES
+        assert sim.media['cycle'].max() == N_CYCLES
+
+
+@pytest.mark.parametrize('rule', [comets.stop_on_biomass(1., 'nothere'),
+                                  comets.stop_on_depletion('nothere_e')])
+def test_rule_check(rule):
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = make_sim(tmp)
+        with pytest.raises(ValueError):
+            rule.check(sim)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])